@@ -7,6 +7,18 @@ from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import plotly.express as px
 import json
+import math
+import duckdb
+from sketches import SKETCH_DIMENSIONS, host_count, merge_host_sketches, merge_price_sketches, price_quantile
+from spatial import ZOOM_LEVELS, tile_xy
+from cube import CUBE_DIMENSIONS, CUBE_MEASURES, CUBE_MIN_LISTINGS, cube_column, cube_slice_sql
+import time
+import os
+from text_search import BM25_B, BM25_K1, bm25_idf, tokenize
+from dashboard_db import (ANALYSIS_DB, EXPLORE_DATE_COLUMNS, EXPLORE_ROW_CAP, EXPLORE_TIMEOUT_SECONDS, QUERIES_DB,
+                          STAGING_DIR, explore_listings, explore_options, page_load, page_log, query_df,
+                          reset_page_load, staging_version, table_names)
+from run_log import RUN_LOG_DB, RUN_LOG_KEEP_RUNS, RunLog
 
 def main():
     """
@@ -14,29 +26,44 @@ def main():
     """
     st.set_page_config(page_title="Airbnb Listings Dashboard")
 
-    # Load data from SQLite database
-    conn = sqlite3.connect('airbnb_queries.db')
-    conn_analysis = sqlite3.connect('airbnb_analysis_results.db')
-
+    # Query results are read through pooled read-only connections and cached until the databases change on disk
     # Create sidebar for navigation
     pages = {
         "Questions": questions_page,
         "Story and Insights": story_page,
-        "Sample Rows": lambda: sample_rows_page(conn),
-        "Average Price by City": lambda: avg_price_by_city_page(conn),
-        "Review Scores by Property Type": lambda: review_scores_by_property_type_page(conn),
-        "Reviews by Neighborhood": lambda: reviews_by_neighborhood_page(conn),
-        "Price and Bedrooms by Property Type": lambda: price_bedrooms_by_property_type_page(conn),
-        "Interactive City Comparison": lambda: interactive_city_comparison_page(conn),
-        "Interactive Property Type Reviews": lambda: interactive_property_type_reviews_page(conn),
-        "Top Cities by Property Type (Spark Analysis)": lambda: top_cities_by_property_type_page(conn_analysis),
+        "Sample Rows": lambda: sample_rows_page(QUERIES_DB),
+        "Average Price by City": lambda: avg_price_by_city_page(QUERIES_DB),
+        "Review Scores by Property Type": lambda: review_scores_by_property_type_page(QUERIES_DB),
+        "Reviews by Neighborhood": lambda: reviews_by_neighborhood_page(QUERIES_DB),
+        "Price and Bedrooms by Property Type": lambda: price_bedrooms_by_property_type_page(QUERIES_DB),
+        "Amenities and Price": lambda: amenities_page(QUERIES_DB),
+        "Interactive City Comparison": lambda: interactive_city_comparison_page(QUERIES_DB),
+        "Interactive Property Type Reviews": lambda: interactive_property_type_reviews_page(QUERIES_DB),
+        "Top Cities by Property Type (Spark Analysis)": lambda: top_cities_by_property_type_page(ANALYSIS_DB),
+        "Price vs Reviews Density": lambda: price_review_density_page(QUERIES_DB),
+        "Listings Map": lambda: listings_map_page(QUERIES_DB),
+        "Price Percentiles and Hosts": lambda: price_percentiles_page(QUERIES_DB),
+        "Search Listings": lambda: search_listings_page(QUERIES_DB),
+        "Drill Down": lambda: drill_down_page(QUERIES_DB),
+        "Explore Listings": lambda: explore_listings_page(STAGING_DIR),
     }
 
+    # Hidden diagnostics page: open the dashboard with ?diagnostics=1
+    if st.query_params.get('diagnostics'):
+        pages["Diagnostics"] = lambda: diagnostics_page(RUN_LOG_DB)
+
     selection = st.sidebar.radio("Go to", list(pages.keys()))
 
-    # Call the selected page function
-    pages[selection]()
-    conn.close()
+    # Call the selected page function, timing the data loading separately from the rendering
+    run_log = RunLog('airbnb_dashboard.py')
+    reset_page_load()
+    with run_log.stage(f"page {selection}") as stage:
+        pages[selection]()
+    stage.update(rows_in=page_load.rows, details={'load_seconds': page_load.seconds,
+                                                  'render_seconds': stage['seconds'] - page_load.seconds,
+                                                  'queries': page_load.queries})
+    # Written in batches by a background thread
+    page_log().put(run_log)
 
 
 def questions_page():
@@ -96,7 +123,7 @@ def story_page():
     """)
 
 
-def sample_rows_page(conn):
+def sample_rows_page(db):
     """
     Renders the Sample Rows page with sample rows from all the tables.
     """
@@ -104,23 +131,28 @@ def sample_rows_page(conn):
     st.write("This page displays sample rows from all the tables in the database.")
 
     queries = [
-        ("Average Price and Listings by City", "SELECT * FROM query_1 LIMIT 50"),
-        ("Listings and Average Price by Amenities", "SELECT * FROM query_2 LIMIT 50"),
-        ("Review Scores by Property Type", "SELECT * FROM query_3 LIMIT 50"),
-        ("Reviews by Neighborhood", "SELECT * FROM query_4 LIMIT 50"),
-        ("Price and Bedrooms by Property Type", "SELECT * FROM query_5 LIMIT 50"),
-        ("Price vs Reviews", "SELECT * FROM query_6 LIMIT 50")
+        ("Average Price and Listings by City", 'query_1', "SELECT * FROM query_1 LIMIT 50"),
+        ("Listings and Average Price by Amenities", 'amenity_stats',
+         "SELECT * FROM amenity_stats ORDER BY Number_of_Listings DESC LIMIT 50"),
+        ("Review Scores by Property Type", 'query_3', "SELECT * FROM query_3 LIMIT 50"),
+        ("Reviews by Neighborhood", 'query_4', "SELECT * FROM query_4 LIMIT 50"),
+        ("Price and Bedrooms by Property Type", 'query_5', "SELECT * FROM query_5 LIMIT 50"),
+        ("Price vs Reviews", 'query_6', "SELECT * FROM query_6 LIMIT 50")
     ]
 
-    for title, query in queries:
+    tables = table_names(db)
+    for title, table_name, query in queries:
         st.subheader(title)
-        df = pd.read_sql(query, conn)
+        if table_name not in tables:
+            st.write(f"The {table_name} table is not built yet. Run `python main.py` to build it.")
+            continue
+        df = query_df(db, query)
         st.dataframe(df.style.highlight_max(axis=0))
         st.write(
             f"This table shows a sample of {title.lower()}. It provides insight into the data used to create the visualizations.")
 
 
-def avg_price_by_city_page(conn):
+def avg_price_by_city_page(db):
     """
     Renders the Average Price by City page with a bar chart showing the average price and number of listings for each city.
     """
@@ -129,7 +161,7 @@ def avg_price_by_city_page(conn):
     This chart displays the average price and number of listings for each city with at least 100 listings. 
     It helps us understand how prices and listing volumes vary across different locations.
     """)
-    df = pd.read_sql("SELECT * FROM query_1 ORDER BY Average_Price DESC LIMIT 7", conn)
+    df = query_df(db, "SELECT * FROM query_1 ORDER BY Average_Price DESC LIMIT 7")
 
     # Check if dataframe is empty
     if df.empty:
@@ -172,7 +204,7 @@ def avg_price_by_city_page(conn):
 
 
 
-def review_scores_by_property_type_page(conn):
+def review_scores_by_property_type_page(db):
     """
     Renders the Review Scores by Property Type page with a heatmap showing different review score types for each property type.
     """
@@ -181,7 +213,7 @@ def review_scores_by_property_type_page(conn):
     This heatmap shows different types of review scores for each property type. It helps us understand how different property types perform in terms of guest satisfaction.
     """)
 
-    df = pd.read_sql("SELECT * FROM query_3 LIMIT 41", conn)
+    df = query_df(db, "SELECT * FROM query_3 LIMIT 41")
     pd.set_option('display.float_format', lambda x: '%.2f' % x)
 
     fig, ax = plt.subplots(figsize=(12, 8))
@@ -193,7 +225,7 @@ def review_scores_by_property_type_page(conn):
     st.pyplot(fig)
 
 
-def reviews_by_neighborhood_page(conn):
+def reviews_by_neighborhood_page(db):
     """
     Renders the Reviews by Neighborhood page with a bar chart showing total reviews and average review score for top neighborhoods.
     """
@@ -201,7 +233,7 @@ def reviews_by_neighborhood_page(conn):
     st.write("""
     This chart displays the total number of reviews and average review score for top neighborhoods. It helps identify which neighborhoods are most popular and highly rated.
     """)
-    df = pd.read_sql("SELECT * FROM query_4 WHERE Neighbourhood IS NOT NULL ORDER BY Total_Reviews DESC LIMIT 20", conn)
+    df = query_df(db, "SELECT * FROM query_4 WHERE Neighbourhood IS NOT NULL ORDER BY Total_Reviews DESC LIMIT 20")
 
     if df.empty:
         st.write("No data available for this visualization.")
@@ -233,7 +265,7 @@ import plotly.express as px
 import pandas as pd
 import streamlit as st
 
-def price_bedrooms_by_property_type_page(conn):
+def price_bedrooms_by_property_type_page(db):
     """
     Renders the Price and Bedrooms by Property Type page with a scatter plot showing the relationship
     between average price and average number of bedrooms for different property types.
@@ -243,7 +275,7 @@ def price_bedrooms_by_property_type_page(conn):
     This scatter plot visualizes the relationship between average price and average number of bedrooms 
     for different property types. It helps understand how property characteristics relate to pricing.
     """)
-    df = pd.read_sql("SELECT * FROM query_5", conn)
+    df = query_df(db, "SELECT * FROM query_5")
 
     # Filter data to include only properties with up to 10 bedrooms
     df_filtered = df[df["Average_Bedrooms"] <= 10]
@@ -266,7 +298,58 @@ def price_bedrooms_by_property_type_page(conn):
     st.write(f"Property type with most bedrooms on average: {df_filtered['Property Type'].iloc[df_filtered['Average_Bedrooms'].idxmax()]} ({df_filtered['Average_Bedrooms'].max():.2f} bedrooms)")
 
 
-def interactive_city_comparison_page(conn):
+def amenities_page(db):
+    """
+    Renders the Amenities and Price page comparing the average price of listings with and without each amenity,
+    and the average price of listings offering a selected pair of amenities.
+    """
+    st.header("Listings and Average Price by Amenities")
+    st.write("""
+    This chart shows, for the most common amenities, the average price of listings that offer the amenity
+    compared with listings that don't. It helps answer what a single amenity, such as Wifi or a Pool, does to the price.
+    """)
+
+    # The amenity tables are only built by a full `python main.py` run (not by --incremental)
+    if not {'amenity_stats', 'amenity_pairs'} <= table_names(db):
+        st.write("No amenity tables available. Run `python main.py` to build them.")
+        return
+    df = query_df(db, "SELECT * FROM amenity_stats ORDER BY Number_of_Listings DESC LIMIT 20")
+
+    if df.empty:
+        st.write("No data available for this visualization.")
+        return
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=df['Amenity'], y=df['Average_Price'], name="With amenity"))
+    fig.add_trace(go.Bar(x=df['Amenity'], y=df['Average_Price_Without'], name="Without amenity"))
+    fig.update_layout(title="Average Price With and Without Each Amenity", barmode='group',
+                      xaxis_title="Amenity", yaxis_title="Average Price ($)")
+    st.plotly_chart(fig)
+
+    # Price uplift of each amenity
+    df['Price_Difference'] = df['Average_Price'] - df['Average_Price_Without']
+    best = df.loc[df['Price_Difference'].idxmax()]
+    st.write(f"Amenity with the largest price difference: {best['Amenity']} (${best['Price_Difference']:.2f})")
+
+    # Amenity combinations
+    st.subheader("Amenity Combinations")
+    pairs = query_df(db, "SELECT * FROM amenity_pairs")
+    amenities = sorted(set(pairs['Amenity_A']) | set(pairs['Amenity_B']))
+    if not amenities:
+        return
+    col1, col2 = st.columns(2)
+    first = col1.selectbox("First amenity", amenities, index=0)
+    second = col2.selectbox("Second amenity", amenities, index=min(1, len(amenities) - 1))
+    pair = pairs[((pairs['Amenity_A'] == first) & (pairs['Amenity_B'] == second)) |
+                 ((pairs['Amenity_A'] == second) & (pairs['Amenity_B'] == first))]
+    if pair.empty:
+        st.write("Select two different amenities to see their combination.")
+    else:
+        st.write(f"Listings with both {first} and {second}: {pair['Number_of_Listings'].iloc[0]} "
+                 f"(average price ${pair['Average_Price'].iloc[0]:.2f})")
+
+
+def interactive_city_comparison_page(db):
     st.header("Interactive City Comparison")
     st.write("""
     This interactive chart allows you to compare average prices and number of listings across different cities.
@@ -274,7 +357,7 @@ def interactive_city_comparison_page(conn):
     """)
 
     # Fetch data
-    df = pd.read_sql("SELECT * FROM query_1", conn)
+    df = query_df(db, "SELECT * FROM query_1")
 
     # Allow user to select cities for comparison
     selected_cities = st.multiselect(
@@ -319,7 +402,7 @@ def interactive_city_comparison_page(conn):
     st.write(f"City with highest average price: {df_selected.loc[df_selected['Average_Price'].idxmax(), 'City']} (${df_selected['Average_Price'].max():.2f})")
     st.write(f"City with most listings: {df_selected.loc[df_selected['Number_of_Listings'].idxmax(), 'City']} ({df_selected['Number_of_Listings'].max()} listings)")
 
-def interactive_property_type_reviews_page(conn):
+def interactive_property_type_reviews_page(db):
     st.header("Interactive Property Type Review Scores")
     st.write("""
     This interactive chart allows you to explore review scores across different property types.
@@ -327,7 +410,7 @@ def interactive_property_type_reviews_page(conn):
     """)
 
     # Fetch data
-    df = pd.read_sql("SELECT * FROM query_3", conn)
+    df = query_df(db, "SELECT * FROM query_3")
 
     # Add a slider for filtering based on average review score
     min_score = float(df['Average_Review_Score'].min())
@@ -366,28 +449,45 @@ def interactive_property_type_reviews_page(conn):
     st.write(f"Property type with highest overall score: {df_filtered.loc[df_filtered['Average_Review_Score'].idxmax(), 'Property Type']} ({df_filtered['Average_Review_Score'].max():.2f})")
     st.write(f"Property type with highest cleanliness score: {df_filtered.loc[df_filtered['Average_Cleanliness_Score'].idxmax(), 'Property Type']} ({df_filtered['Average_Cleanliness_Score'].max():.2f})")
     st.write(f"Property type with highest location score: {df_filtered.loc[df_filtered['Average_Location_Score'].idxmax(), 'Property Type']} ({df_filtered['Average_Location_Score'].max():.2f})")
-def top_cities_by_property_type_page(conn):
+def top_cities_by_property_type_page(db):
     st.header("Top 5 Cities with Highest Average Listing Prices by Property Type (Spark Analysis)")
     st.write("""
     This visualization shows the top 5 cities with the highest average listing prices for each property type,
     based on the Spark analysis of the Airbnb dataset.
     """)
 
-    # Load data
-    df = pd.read_sql_query("SELECT * FROM top_cities_by_property_type", conn)
-
-    # Convert the 'top_cities' column from JSON string to list of dicts
-    df['top_cities'] = df['top_cities'].apply(json.loads)
-
-    # Select a property type
-    property_type = st.selectbox("Select a Property Type", df['property_type'].unique())
-
-    # Filter data for the selected property type
-    selected_data = df[df['property_type'] == property_type]['top_cities'].iloc[0]
+    tables = table_names(db)
+    if not tables & {'top_cities_by_property_type_ranked', 'top_cities_by_property_type'}:
+        st.write("No Spark analysis results yet. Run `python spark_analysis.py` to compute them.")
+        return
+    if 'top_cities_by_property_type_ranked' in tables:
+        # Normalized layout: one row per ranked city, filtered by the indexed property_type column
+        property_types = query_df(db, """
+            SELECT DISTINCT property_type FROM top_cities_by_property_type_ranked ORDER BY property_type
+        """)['property_type'].tolist()
+        property_type = st.selectbox("Select a Property Type", property_types)
+        selected_data = query_df(db, """
+            SELECT city AS name, avg_price
+            FROM top_cities_by_property_type_ranked
+            WHERE property_type = ?
+            ORDER BY rank
+        """, (property_type,))
+    else:
+        # Legacy layout: one JSON list of cities per property type
+        df = query_df(db, "SELECT * FROM top_cities_by_property_type")
+
+        # Convert the 'top_cities' column from JSON string to list of dicts
+        df['top_cities'] = df['top_cities'].apply(json.loads)
+
+        # Select a property type
+        property_type = st.selectbox("Select a Property Type", df['property_type'].unique())
+
+        # Filter data for the selected property type
+        selected_data = pd.DataFrame(df[df['property_type'] == property_type]['top_cities'].iloc[0])
 
     # Create lists for city names and average prices
-    cities = [city['name'] for city in selected_data]
-    prices = [city['avg_price'] for city in selected_data]
+    cities = selected_data['name'].tolist()
+    prices = selected_data['avg_price'].tolist()
 
     # Create bar chart
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -402,7 +502,559 @@ def top_cities_by_property_type_page(conn):
 
     # Display data in table format
     st.subheader("Data Table")
-    table_data = pd.DataFrame(selected_data)
-    st.table(table_data)
+    st.table(selected_data)
+
+
+# Bins per axis the density page aims to show for the current view
+DENSITY_TARGET_BINS = 40
+
+
+def price_review_density_page(db):
+    """
+    Renders the Price vs Reviews Density page: a heatmap of listings by price and number of reviews, read from
+    the multi-resolution histogram pyramid. Only the bins of the current view are read, at the coarsest
+    level that still shows about DENSITY_TARGET_BINS bins per axis.
+    """
+    st.header("Price vs Number of Reviews Density")
+    st.write("""
+    This heatmap shows how listings are distributed over price and number of reviews, both on a log scale.
+    Narrow the price and review ranges to zoom in: finer bins are loaded as the view gets smaller.
+    """)
+
+    if 'price_review_histogram' not in table_names(db):
+        st.write("No histogram data available. Run `python main.py` to build it.")
+        return
+    axes = query_df(db, "SELECT * FROM price_review_axes").iloc[0]
+    min_level, max_level = int(axes['min_level']), int(axes['max_level'])
+    price_span = axes['log_price_max'] - axes['log_price_min']
+    reviews_span = axes['log_reviews_max'] - axes['log_reviews_min']
+
+    # Optional split by city or property type, most common values first
+    split = st.selectbox("Split by", ['all', 'City', 'Property Type'],
+                         format_func=lambda value: "All listings" if value == 'all' else value)
+    split_value = None
+    if split != 'all':
+        values = query_df(db, """
+            SELECT split_value
+            FROM price_review_histogram
+            WHERE split = ? AND level = ?
+            GROUP BY split_value
+            ORDER BY SUM(listings) DESC
+        """, (split, min_level))['split_value'].tolist()
+        split_value = st.selectbox(split, values)
+
+    # Viewport
+    min_price, max_price = math.exp(axes['log_price_min']), math.exp(axes['log_price_max'])
+    max_reviews = int(round(math.exp(axes['log_reviews_max']) - 1))
+    price_range = st.slider("Price range ($)", min_value=float(math.floor(min_price)),
+                            max_value=float(math.ceil(max_price)), value=(float(math.floor(min_price)),
+                                                                          float(math.ceil(max_price))))
+    review_range = st.slider("Number of reviews", min_value=0, max_value=max(max_reviews, 1),
+                             value=(0, max(max_reviews, 1)))
+
+    # Fraction of each axis in view (in log space), and the coarsest level showing enough bins
+    log_price_range = [(math.log(max(price, min_price)) - axes['log_price_min']) / price_span for price in price_range]
+    log_review_range = [(math.log1p(reviews) - axes['log_reviews_min']) / reviews_span for reviews in review_range]
+    visible = max(min(log_price_range[1] - log_price_range[0], log_review_range[1] - log_review_range[0]), 1e-6)
+    level = min(max_level, max(min_level, math.ceil(math.log2(DENSITY_TARGET_BINS / visible))))
+    bins = 2 ** level
+
+    def bin_bounds(fractions):
+        return max(0, int(math.floor(fractions[0] * bins))), min(bins - 1, int(math.floor(fractions[1] * bins)))
+
+    price_bins, review_bins = bin_bounds(log_price_range), bin_bounds(log_review_range)
+    df = query_df(db, """
+        SELECT price_bin, review_bin, listings, average_price
+        FROM price_review_histogram
+        WHERE split = ? AND split_value IS ? AND level = ?
+        AND price_bin BETWEEN ? AND ?
+        AND review_bin BETWEEN ? AND ?
+    """, (split, split_value, level, *price_bins, *review_bins))
+
+    if df.empty:
+        st.write("No listings in the selected range.")
+        return
+
+    # Bin centers, converted back from log space
+    price_centers = [math.exp(axes['log_price_min'] + (b + 0.5) / bins * price_span)
+                     for b in range(price_bins[0], price_bins[1] + 1)]
+    review_centers = [math.expm1(axes['log_reviews_min'] + (b + 0.5) / bins * reviews_span)
+                      for b in range(review_bins[0], review_bins[1] + 1)]
+    grid = df.pivot(index='review_bin', columns='price_bin', values='listings') \
+             .reindex(index=range(review_bins[0], review_bins[1] + 1), columns=range(price_bins[0], price_bins[1] + 1))
+
+    fig = go.Figure(go.Heatmap(z=grid.values, x=price_centers, y=review_centers, colorscale='Viridis',
+                               colorbar=dict(title="Listings"),
+                               hovertemplate="Price: $%{x:.0f}<br>Reviews: %{y:.0f}<br>Listings: %{z}<extra></extra>"))
+    fig.update_xaxes(type='log', title_text="Price ($)")
+    fig.update_yaxes(type='log', title_text="Number of Reviews")
+    fig.update_layout(title_text=f"Listings by Price and Number of Reviews ({bins}x{bins} bins)")
+    st.plotly_chart(fig)
+
+    st.write(f"Listings in view: {int(df['listings'].sum()):,} in {len(df)} non-empty bins "
+             f"(average price ${(df['average_price'] * df['listings']).sum() / df['listings'].sum():.2f})")
+
+
+# Tiles the map page aims to show across the wider side of the viewport
+MAP_TARGET_TILES = 32
+
+
+def listings_map_page(db):
+    """
+    Renders the Listings Map page from the precomputed map tiles. Only the tiles inside the selected viewport
+    are read, at the zoom level that shows about MAP_TARGET_TILES tiles across it, so no raw listing points
+    reach the browser.
+    """
+    st.header("Listings Map")
+    st.write("""
+    Each circle is a map tile: its size shows the number of listings and its color the average price.
+    Narrow the latitude and longitude ranges to zoom in on finer tiles.
+    """)
+
+    if 'listing_tiles' not in table_names(db):
+        st.write("No map tiles available. Run `python main.py` to build them.")
+        return
+    extent = query_df(db, """
+        SELECT MIN(latitude) AS min_lat, MAX(latitude) AS max_lat, MIN(longitude) AS min_lon, MAX(longitude) AS max_lon
+        FROM listing_tiles
+        WHERE zoom = ?
+    """, (max(ZOOM_LEVELS),)).iloc[0]
+    if pd.isna(extent['min_lat']):
+        st.write("No listings with coordinates.")
+        return
+
+    # Viewport, defaulting to the extent of the listings
+    lat_range = st.slider("Latitude", min_value=-85.0, max_value=85.0,
+                          value=(max(float(math.floor(extent['min_lat'])), -85.0),
+                                 min(float(math.ceil(extent['max_lat'])), 85.0)))
+    lon_range = st.slider("Longitude", min_value=-180.0, max_value=180.0,
+                          value=(float(math.floor(extent['min_lon'])), float(math.ceil(extent['max_lon']))))
+
+    # Coarsest stored zoom with about MAP_TARGET_TILES tiles across the viewport
+    span = max(lat_range[1] - lat_range[0], lon_range[1] - lon_range[0], 1e-6)
+    wanted_zoom = math.log2(MAP_TARGET_TILES * 360 / span)
+    zoom = next((level for level in ZOOM_LEVELS if level >= wanted_zoom), max(ZOOM_LEVELS))
+
+    # Tile y grows southwards
+    min_x, min_y = tile_xy(lat_range[1], lon_range[0], zoom)
+    max_x, max_y = tile_xy(lat_range[0], lon_range[1], zoom)
+    df = query_df(db, """
+        SELECT tile_x, tile_y, listings, latitude, longitude, average_price, average_rating
+        FROM listing_tiles
+        WHERE zoom = ?
+        AND tile_x BETWEEN ? AND ?
+        AND tile_y BETWEEN ? AND ?
+    """, (zoom, min_x, max_x, min_y, max_y))
+
+    if df.empty:
+        st.write("No listings in the selected area.")
+        return
+
+    fig = px.scatter_map(df, lat='latitude', lon='longitude', size='listings', color='average_price',
+                         hover_data={'listings': True, 'average_price': ':.2f', 'average_rating': ':.1f'},
+                         color_continuous_scale='Viridis', size_max=30,
+                         center={'lat': sum(lat_range) / 2, 'lon': sum(lon_range) / 2},
+                         zoom=max(0.0, math.log2(360 / span)))
+    fig.update_layout(title_text=f"Listings by Map Tile (zoom {zoom})", map_style="open-street-map")
+    st.plotly_chart(fig)
+
+    st.write(f"Listings in view: {int(df['listings'].sum()):,} in {len(df)} tiles")
+
+
+# Values listed per dimension on the Price Percentiles and Hosts page
+SKETCH_TOP_VALUES = 20
+
+
+def price_percentiles_page(db):
+    """
+    Renders the Price Percentiles and Hosts page from the precomputed sketches. Median and 90th percentile
+    prices are within 1% of the exact values, distinct hosts within a few percent. Sketches of several values
+    merge, so any combination is estimated without reading the listings.
+    """
+    st.header("Price Percentiles and Hosts")
+    st.write("""
+    Median and 90th percentile prices and the number of distinct hosts, estimated from compact sketches
+    of the listing prices and host IDs.
+    """)
+
+    if 'listing_sketches' not in table_names(db):
+        st.write("No sketches available. Run `python main.py` to build them.")
+        return
+    dimension = st.selectbox("Group by", SKETCH_DIMENSIONS)
+    df = query_df(db, """
+        SELECT value, priced_listings, median_price, p90_price, hosts, price_sketch, host_sketch
+        FROM listing_sketches
+        WHERE dimension = ?
+        ORDER BY priced_listings DESC
+    """, (dimension,))
+    if df.empty:
+        st.write("No listings with a price.")
+        return
+
+    top = df.head(SKETCH_TOP_VALUES)
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=top['value'], y=top['median_price'], name='Median Price'))
+    fig.add_trace(go.Bar(x=top['value'], y=top['p90_price'], name='90th Percentile Price'))
+    fig.update_layout(title_text=f"Price Percentiles by {dimension}", barmode='group',
+                      xaxis_title=dimension, yaxis_title="Price")
+    st.plotly_chart(fig)
+    st.dataframe(top[['value', 'priced_listings', 'median_price', 'p90_price', 'hosts']].rename(columns={
+        'value': dimension, 'priced_listings': 'Listings', 'median_price': 'Median Price',
+        'p90_price': '90th Percentile Price', 'hosts': 'Hosts'}))
+
+    # Merge the sketches of the selected values
+    selected = st.multiselect(f"Combine {dimension} values", df['value'].tolist(),
+                              default=df['value'].head(2).tolist())
+    if selected:
+        rows = df[df['value'].isin(selected)]
+        price_sketch = merge_price_sketches(rows['price_sketch'].dropna())
+        host_sketch = merge_host_sketches(rows['host_sketch'].dropna())
+        median_price = price_quantile(price_sketch, 0.5)
+        p90_price = price_quantile(price_sketch, 0.9)
+        st.write(f"Combined listings: {int(rows['priced_listings'].sum()):,}")
+        st.write(f"Median price: {median_price:.2f}" if median_price is not None else "Median price: n/a")
+        st.write(f"90th percentile price: {p90_price:.2f}" if p90_price is not None else "90th percentile price: n/a")
+        st.write(f"Distinct hosts: {host_count(host_sketch):,}")
+
+
+# Drill-down page: values of the breakdown dimension shown, the rest are summed into "Other"
+CUBE_TOP_VALUES = 30
+
+
+def cube_statistics(df, measure):
+    """
+    Adds the average and standard deviation of a measure to cube cells, from their count, sum and sum of squares.
+    """
+    count = df[f'{measure}_count'].where(df[f'{measure}_count'] > 0)
+    average = df[f'{measure}_sum'] / count
+    variance = (df[f'{measure}_sumsq'] / count - average ** 2).clip(lower=0)
+    return df.assign(average=average, stddev=variance ** 0.5)
+
+
+def drill_down_page(db):
+    """
+    Renders the Drill Down page from the precomputed rollup cube. Every slice and breakdown is a single
+    indexed lookup of cube cells; no listing is read.
+    """
+    st.header("Drill Down")
+    st.write(f"""
+    Filter the listings by any of {', '.join(CUBE_DIMENSIONS)} and break them down by another dimension.
+    Values with fewer than {CUBE_MIN_LISTINGS} listings in a slice are counted in "Other".
+    """)
+
+    if 'listing_cube' not in table_names(db):
+        st.write("No rollup cube available. Run `python main.py` to build it.")
+        return
+
+    # Each filter only offers the values present in the slice selected so far
+    filters = {}
+    for dimension in CUBE_DIMENSIONS:
+        sql, params = cube_slice_sql(filters, dimension)
+        values = query_df(db, f"{sql} ORDER BY listings DESC", params)[cube_column(dimension)].tolist()
+        value = st.selectbox(dimension, ["All"] + values)
+        if value != "All":
+            filters[dimension] = value
+
+    remaining = [dimension for dimension in CUBE_DIMENSIONS if dimension not in filters]
+    breakdown = st.selectbox("Break down by", remaining) if remaining else None
+    label = st.radio("Measure", list(CUBE_MEASURES.values()))
+    measure = next(name for name, column in CUBE_MEASURES.items() if column == label)
+
+    sql, params = cube_slice_sql(filters)
+    total = query_df(db, sql, params)
+    if total.empty:
+        st.write(f"Fewer than {CUBE_MIN_LISTINGS} listings in this slice.")
+        return
+    total = cube_statistics(total, measure).iloc[0]
+    st.write(f"Listings: {int(total['listings']):,}")
+    if pd.notna(total['average']):
+        st.write(f"{label}: average {total['average']:.2f}, standard deviation {total['stddev']:.2f}")
+    if breakdown is None:
+        return
+
+    sql, params = cube_slice_sql(filters, breakdown)
+    cells = query_df(db, f"{sql} ORDER BY listings DESC", params)
+    column = cube_column(breakdown)
+    top = cells.head(CUBE_TOP_VALUES)[[column, 'listings', f'{measure}_count', f'{measure}_sum', f'{measure}_sumsq']]
+
+    # The cells not shown (and the pruned ones) are the difference between the slice and the shown cells
+    other = {name: total[name] - top[name].sum() for name in top.columns if name != column}
+    if other['listings'] > 0:
+        top = pd.concat([top, pd.DataFrame([{column: "Other", **other}])], ignore_index=True)
+    top = cube_statistics(top, measure)
+
+    fig = px.bar(top, x=column, y='average', error_y='stddev', hover_data=['listings'],
+                 labels={column: breakdown, 'average': f"Average {label}", 'listings': 'Listings'})
+    fig.update_layout(title_text=f"Average {label} by {breakdown}")
+    st.plotly_chart(fig)
+    st.dataframe(top[[column, 'listings', f'{measure}_count', 'average', 'stddev']].rename(columns={
+        column: breakdown, 'listings': 'Listings', f'{measure}_count': f'Listings with {label}',
+        'average': f'Average {label}', 'stddev': f'{label} Standard Deviation'}))
+
+
+# Search page: listings returned at most, and the width of the price and rating facet buckets
+SEARCH_MAX_RESULTS = 100
+SEARCH_PRICE_BUCKET = 50
+SEARCH_RATING_BUCKET = 10
+
+
+def search_listings_page(db):
+    """
+    Renders the Search Listings page from the precomputed inverted index. Only the postings of the query
+    terms are read: listings are ranked by BM25, and the price and rating facets count every match.
+    """
+    st.header("Search Listings")
+    st.write("""
+    Search the listing names, summaries, descriptions, neighborhood overviews and transit notes,
+    e.g. "canal view". Results are ranked by relevance (BM25).
+    """)
+
+    if 'search_postings' not in table_names(db):
+        st.write("No search index available. Run `python main.py` to build it.")
+        return
+    stats = query_df(db, "SELECT * FROM search_stats").iloc[0]
+    if not stats['documents']:
+        st.write("No listing text to search.")
+        return
+
+    text = st.text_input("Search", "canal view")
+    match_all = st.checkbox("Match all words", value=True)
+    top_k = st.slider("Results", min_value=10, max_value=SEARCH_MAX_RESULTS, value=20, step=10)
+    min_price, max_price = float(stats['min_price'] or 0), float(stats['max_price'] or 0)
+    price_range = st.slider("Price", min_value=min_price, max_value=max(max_price, min_price + 1),
+                            value=(min_price, max(max_price, min_price + 1)))
+    min_rating = st.slider("Minimum Rating", min_value=0, max_value=100, value=0, step=5)
+
+    terms = list(dict.fromkeys(tokenize(text)))
+    if not terms:
+        st.write("Enter at least one word to search for.")
+        return
+
+    start = time.perf_counter()
+    placeholders = ', '.join('?' * len(terms))
+    term_documents = query_df(db, f"""
+        SELECT term, COUNT(*) AS documents FROM search_postings WHERE term IN ({placeholders}) GROUP BY term
+    """, terms)
+    found = dict(zip(term_documents['term'], term_documents['documents']))
+    if not found or (match_all and len(found) < len(terms)):
+        st.write(f"No listings match \"{text}\".")
+        return
+
+    # Listings matching the query terms, filtered by the facets
+    weights = ', '.join('(?, ?)' for _ in found)
+    weight_params = [value for term, documents in found.items()
+                     for value in (term, bm25_idf(stats['documents'], documents))]
+    conditions = ["COALESCE(d.rating, 0) >= ?"]
+    filter_params = [min_rating]
+    if price_range != (min_price, max(max_price, min_price + 1)):
+        conditions.append("d.price BETWEEN ? AND ?")
+        filter_params.extend(price_range)
+    matched = f"""
+        WITH weights(term, idf) AS (VALUES {weights})
+        SELECT
+            d.listing_id, d.name, d.city, d.property_type, d.price, d.rating,
+            SUM(w.idf * p.frequency * {BM25_K1 + 1} /
+                (p.frequency + {BM25_K1} * (1 - {BM25_B} + {BM25_B} * d.length / ?))) AS score
+        FROM search_postings p
+        JOIN weights w ON w.term = p.term
+        JOIN search_documents d ON d.listing_id = p.listing_id
+        WHERE {' AND '.join(conditions)}
+        GROUP BY d.listing_id
+        HAVING COUNT(*) >= ?
+    """
+    params = weight_params + [stats['average_length']] + filter_params + [len(terms) if match_all else 1]
+    results = query_df(db, f"{matched} ORDER BY score DESC LIMIT ?", params + [top_k])
+    facets = query_df(db, f"""
+        SELECT
+            CAST(price / {SEARCH_PRICE_BUCKET} AS INTEGER) * {SEARCH_PRICE_BUCKET} AS price_bucket,
+            CAST(rating / {SEARCH_RATING_BUCKET} AS INTEGER) * {SEARCH_RATING_BUCKET} AS rating_bucket,
+            COUNT(*) AS listings
+        FROM ({matched})
+        GROUP BY price_bucket, rating_bucket
+    """, params)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    total = int(facets['listings'].sum())
+    st.write(f"{total:,} matching listings ({elapsed_ms:.0f} ms)")
+    if results.empty:
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        by_price = facets.groupby('price_bucket', dropna=False)['listings'].sum().reset_index()
+        fig = px.bar(by_price, x='price_bucket', y='listings', labels={'price_bucket': 'Price', 'listings': 'Listings'})
+        fig.update_layout(title_text="Matches by Price")
+        st.plotly_chart(fig)
+    with col2:
+        by_rating = facets.groupby('rating_bucket', dropna=False)['listings'].sum().reset_index()
+        fig = px.bar(by_rating, x='rating_bucket', y='listings',
+                     labels={'rating_bucket': 'Rating', 'listings': 'Listings'})
+        fig.update_layout(title_text="Matches by Rating")
+        st.plotly_chart(fig)
+
+    st.dataframe(results.rename(columns={
+        'listing_id': 'ID', 'name': 'Name', 'city': 'City', 'property_type': 'Property Type', 'price': 'Price',
+        'rating': 'Rating', 'score': 'Relevance'}))
+
+
+def explore_listings_page(staging_dir):
+    """
+    Renders the Explore Listings page, which filters the raw listings live with DuckDB over their Parquet copy.
+    """
+    st.header("Explore Listings")
+    st.write("""
+    Slice the full listings by country, room type, price range and date. The filters run directly against
+    the Parquet copy of the listings, so any combination can be explored, not only the precomputed questions.
+    """)
+
+    version = staging_version(staging_dir)
+    if version is None:
+        st.write("No staged listings found. Run `python main.py --stage` to create the Parquet copy of the listings.")
+        return
+
+    date_column = st.selectbox("Date column", EXPLORE_DATE_COLUMNS)
+    try:
+        countries, room_types, bounds = explore_options(staging_dir, version, date_column)
+    except duckdb.InterruptException:
+        st.write(f"Loading the filter options took longer than {EXPLORE_TIMEOUT_SECONDS}s and was cancelled. "
+                 f"Reload the page to try again.")
+        return
+
+    col1, col2 = st.columns(2)
+    selected_countries = col1.multiselect("Country", countries)
+    selected_room_types = col2.multiselect("Room type", room_types)
+
+    min_price, max_price = float(bounds['min_price']), float(bounds['max_price'])
+    price_range = (min_price, max_price)
+    if min_price < max_price:
+        price_range = st.slider("Price range", min_value=min_price, max_value=max_price, value=(min_price, max_price))
+
+    # Dates only filter once narrowed, so listings without a date are not dropped by default
+    date_range = None
+    if pd.notna(bounds['min_date']):
+        min_date, max_date = pd.Timestamp(bounds['min_date']).date(), pd.Timestamp(bounds['max_date']).date()
+        dates = st.date_input(f"{date_column} between", value=(min_date, max_date),
+                              min_value=min_date, max_value=max_date)
+        if len(dates) == 2 and tuple(dates) != (min_date, max_date):
+            date_range = tuple(dates)
+
+    min_listings = st.number_input("Minimum listings per city", min_value=1, value=1)
+
+    filter_key = (('countries', tuple(selected_countries)), ('room_types', tuple(selected_room_types)),
+                  ('price_range', tuple(price_range)), ('date_column', date_column), ('date_range', date_range))
+    try:
+        summary, by_city, rows, truncated = explore_listings(staging_dir, version, filter_key, int(min_listings))
+    except duckdb.InterruptException:
+        st.write(f"The query took longer than {EXPLORE_TIMEOUT_SECONDS}s and was cancelled. "
+                 f"Narrow the filters and try again.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Listings", f"{summary['Number_of_Listings'].iloc[0]:,}")
+    if summary['Number_of_Listings'].iloc[0] == 0:
+        st.write("No listings match the selected filters.")
+        return
+    col2.metric("Average price", f"${summary['Average_Price'].iloc[0]:.2f}")
+    col3.metric("Median price", f"${summary['Median_Price'].iloc[0]:.2f}")
+
+    if not by_city.empty:
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+        fig.add_trace(go.Bar(x=by_city['City'], y=by_city['Average_Price'], name="Average Price"), secondary_y=False)
+        fig.add_trace(go.Scatter(x=by_city['City'], y=by_city['Number_of_Listings'], name="Number of Listings",
+                                 mode='lines+markers'), secondary_y=True)
+        fig.update_yaxes(title_text="Average Price ($)", secondary_y=False)
+        fig.update_yaxes(title_text="Number of Listings", secondary_y=True)
+        fig.update_layout(title_text="Cities with the Most Matching Listings")
+        st.plotly_chart(fig)
+
+    st.subheader("Matching Listings")
+    st.dataframe(rows)
+    if truncated:
+        st.write(f"Showing the first {EXPLORE_ROW_CAP} matching listings.")
+
+
+
+# Runs listed per script and dashboard renders summarized on the diagnostics page
+DIAGNOSTICS_RUNS = 20
+DIAGNOSTICS_RENDERS = RUN_LOG_KEEP_RUNS
+
+
+def diagnostics_page(db):
+    """
+    Renders the hidden Diagnostics page from the run log: the stages of recent main.py and
+    spark_analysis.py runs with their profiles, and the load and render time of every dashboard page.
+    """
+    st.header("Diagnostics")
+    if not os.path.exists(db) or 'run_log' not in table_names(db):
+        st.write("No runs logged yet. Run `python main.py` or `python spark_analysis.py` to record some.")
+        return
+
+    st.subheader("Pipeline Runs")
+    script = st.selectbox("Script", ['main.py', 'spark_analysis.py'])
+    runs = query_df(db, """
+        SELECT run_id, MIN(started_at) AS started_at, COUNT(*) AS stages
+        FROM run_log
+        WHERE script = ?
+        GROUP BY run_id
+        ORDER BY started_at DESC
+        LIMIT ?
+    """, (script, DIAGNOSTICS_RUNS))
+    if runs.empty:
+        st.write(f"No {script} runs logged yet.")
+    else:
+        run_id = st.selectbox("Run", runs['run_id'].tolist(),
+                              format_func=lambda run: f"{runs.set_index('run_id').loc[run, 'started_at']} ({run[:8]})")
+        stages = query_df(db, """
+            SELECT stage, seconds, rows_in, rows_out, peak_rss_mb, details
+            FROM run_log
+            WHERE run_id = ?
+            ORDER BY rowid
+        """, (run_id,))
+        fig = px.bar(stages, x='seconds', y='stage', orientation='h', color='peak_rss_mb',
+                     labels={'seconds': 'Wall Time (s)', 'stage': 'Stage', 'peak_rss_mb': 'Peak RSS (MB)'})
+        fig.update_layout(title_text="Wall Time by Stage", yaxis={'autorange': 'reversed'})
+        st.plotly_chart(fig)
+        st.dataframe(stages.drop(columns=['details']))
+
+        # EXPLAIN ANALYZE profiles (main.py --profile) and Spark stage metrics (spark_analysis.py --profile)
+        for _, row in stages[stages['details'].notna()].iterrows():
+            details = json.loads(row['details'])
+            with st.expander(f"Profile: {row['stage']}"):
+                if 'explain_analyze' in details:
+                    st.code(details['explain_analyze'])
+                else:
+                    st.json(details)
+
+    st.subheader("Dashboard Pages")
+    pages = query_df(db, """
+        SELECT
+            stage AS page,
+            COUNT(*) AS renders,
+            AVG(json_extract(details, '$.load_seconds')) AS avg_load_seconds,
+            AVG(json_extract(details, '$.render_seconds')) AS avg_render_seconds,
+            MAX(seconds) AS max_seconds,
+            AVG(json_extract(details, '$.queries')) AS avg_queries,
+            MAX(peak_rss_mb) AS peak_rss_mb
+        FROM (
+            SELECT * FROM run_log
+            WHERE script = 'airbnb_dashboard.py'
+            ORDER BY started_at DESC
+            LIMIT ?
+        )
+        GROUP BY stage
+        ORDER BY avg_load_seconds + avg_render_seconds DESC
+    """, (DIAGNOSTICS_RENDERS,))
+    if pages.empty:
+        st.write("No page renders logged yet.")
+        return
+    fig = go.Figure()
+    fig.add_trace(go.Bar(y=pages['page'], x=pages['avg_load_seconds'], name='Data Loading', orientation='h'))
+    fig.add_trace(go.Bar(y=pages['page'], x=pages['avg_render_seconds'], name='Rendering', orientation='h'))
+    fig.update_layout(title_text=f"Average Page Time (last {DIAGNOSTICS_RENDERS} renders)", barmode='stack',
+                      xaxis_title="Seconds", yaxis={'autorange': 'reversed'})
+    st.plotly_chart(fig)
+    st.dataframe(pages)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
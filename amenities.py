@@ -0,0 +1,140 @@
+import time
+
+# Number of most common amenities encoded as bits of the per-listing mask (bit i = amenity_id i)
+MASK_BITS = 64
+
+# Number of most common amenities whose pairwise combinations are analysed
+COMBINATION_AMENITIES = 20
+
+# Tables exported to the dashboard database
+AMENITY_TABLES = ['amenity_stats', 'amenity_pairs']
+
+# Step 1: One row per listing with its cleaned, de-duplicated list of amenities
+LISTING_AMENITY_LIST_SQL = """
+    CREATE OR REPLACE TABLE listing_amenity_list AS
+    SELECT
+        ROW_NUMBER() OVER () AS listing_key,
+        Price,
+        list_distinct(list_filter(
+            list_transform(string_split(regexp_replace(Amenities, '[{{}}"]', '', 'g'), ','), a -> trim(a)),
+            a -> a <> '' AND NOT starts_with(a, 'translation missing')
+        )) AS amenities
+    FROM {source}
+    WHERE Amenities IS NOT NULL
+    AND Price IS NOT NULL
+"""
+
+# Step 2: Amenity dictionary, ids assigned by descending frequency so the most common amenities get the low bits
+AMENITY_DICTIONARY_SQL = """
+    CREATE OR REPLACE TABLE amenity_dictionary AS
+    SELECT
+        CAST(ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC, amenity) - 1 AS SMALLINT) AS amenity_id,
+        amenity
+    FROM (SELECT UNNEST(amenities) AS amenity FROM listing_amenity_list)
+    GROUP BY amenity
+"""
+
+# Step 3: Bridge table (listing, amenity id) covering every amenity
+LISTING_AMENITIES_SQL = """
+    CREATE OR REPLACE TABLE listing_amenities AS
+    SELECT l.listing_key, d.amenity_id
+    FROM (SELECT listing_key, UNNEST(amenities) AS amenity FROM listing_amenity_list) l
+    JOIN amenity_dictionary d USING (amenity)
+"""
+
+# Step 4: Per-listing bitmask of the MASK_BITS most common amenities
+LISTING_AMENITY_MASKS_SQL = """
+    CREATE OR REPLACE TABLE listing_amenity_masks AS
+    SELECT
+        l.listing_key,
+        l.Price,
+        COALESCE(bit_or(CAST(1 AS UBIGINT) << b.amenity_id) FILTER (WHERE b.amenity_id < {mask_bits}),
+                 CAST(0 AS UBIGINT)) AS amenity_mask
+    FROM listing_amenity_list l
+    LEFT JOIN listing_amenities b USING (listing_key)
+    GROUP BY l.listing_key, l.Price
+"""
+
+# Per-amenity listings and average price, with the average price of listings without the amenity
+AMENITY_STATS_SQL = """
+    WITH totals AS (
+        SELECT COUNT(*) AS listings, SUM(Price) AS price_sum FROM listing_amenity_masks
+    ),
+    per_amenity AS (
+        SELECT b.amenity_id, COUNT(*) AS listings, SUM(m.Price) AS price_sum
+        FROM listing_amenities b
+        JOIN listing_amenity_masks m USING (listing_key)
+        GROUP BY b.amenity_id
+    )
+    SELECT
+        d.amenity_id,
+        d.amenity AS Amenity,
+        p.listings AS Number_of_Listings,
+        p.price_sum / p.listings AS Average_Price,
+        (t.price_sum - p.price_sum) / NULLIF(t.listings - p.listings, 0) AS Average_Price_Without
+    FROM per_amenity p
+    JOIN amenity_dictionary d USING (amenity_id)
+    CROSS JOIN totals t
+    ORDER BY Number_of_Listings DESC
+"""
+
+# Listings and average price for every pair of the COMBINATION_AMENITIES most common amenities. Listings are
+# first collapsed to distinct masks, then each pair is matched with a single AND against those masks.
+AMENITY_PAIRS_SQL = """
+    WITH masks AS (
+        SELECT amenity_mask & {top_mask} AS mask, COUNT(*) AS listings, SUM(Price) AS price_sum
+        FROM listing_amenity_masks
+        GROUP BY 1
+    ),
+    pairs AS (
+        SELECT
+            a.amenity_id AS amenity_a,
+            b.amenity_id AS amenity_b,
+            (CAST(1 AS UBIGINT) << a.amenity_id) | (CAST(1 AS UBIGINT) << b.amenity_id) AS pair_mask
+        FROM amenity_dictionary a
+        JOIN amenity_dictionary b ON a.amenity_id < b.amenity_id
+        WHERE b.amenity_id < {combination_amenities}
+    )
+    SELECT
+        da.amenity AS Amenity_A,
+        db.amenity AS Amenity_B,
+        SUM(m.listings) AS Number_of_Listings,
+        SUM(m.price_sum) / SUM(m.listings) AS Average_Price
+    FROM pairs p
+    JOIN masks m ON m.mask & p.pair_mask = p.pair_mask
+    JOIN amenity_dictionary da ON da.amenity_id = p.amenity_a
+    JOIN amenity_dictionary db ON db.amenity_id = p.amenity_b
+    GROUP BY da.amenity, db.amenity
+    ORDER BY Number_of_Listings DESC
+"""
+
+
+def amenity_build_sql():
+    """
+    Returns the SQL text of every amenity step, used as the result cache key of the amenity tables.
+    """
+    return '\n'.join([LISTING_AMENITY_LIST_SQL, AMENITY_DICTIONARY_SQL, LISTING_AMENITIES_SQL,
+                      LISTING_AMENITY_MASKS_SQL, AMENITY_STATS_SQL, AMENITY_PAIRS_SQL,
+                      f"-- mask_bits={MASK_BITS} combination_amenities={COMBINATION_AMENITIES}"])
+
+
+def build_amenity_dimension(con, source='airbnb_listings'):
+    """
+    Splits the raw Amenities strings into the amenity dictionary, the listing/amenity bridge table and
+    the per-listing bitmask, then stores the per-amenity and amenity-pair analytics as DuckDB tables
+    (result_amenity_stats and result_amenity_pairs).
+    """
+    start = time.perf_counter()
+    combination_amenities = min(COMBINATION_AMENITIES, MASK_BITS)
+    top_mask = f"CAST({(1 << combination_amenities) - 1} AS UBIGINT)"
+    con.execute(LISTING_AMENITY_LIST_SQL.format(source=source))
+    con.execute(AMENITY_DICTIONARY_SQL)
+    con.execute(LISTING_AMENITIES_SQL)
+    con.execute(LISTING_AMENITY_MASKS_SQL.format(mask_bits=MASK_BITS))
+    con.execute(f"CREATE OR REPLACE TABLE result_amenity_stats AS {AMENITY_STATS_SQL}")
+    pairs_sql = AMENITY_PAIRS_SQL.format(top_mask=top_mask, combination_amenities=combination_amenities)
+    con.execute(f"CREATE OR REPLACE TABLE result_amenity_pairs AS {pairs_sql}")
+    amenity_count = con.execute("SELECT COUNT(*) FROM amenity_dictionary").fetchone()[0]
+    print(f"Built amenity dimension ({amenity_count} amenities) in {time.perf_counter() - start:.2f}s")
+    return {table_name: con.execute(f"SELECT COUNT(*) FROM result_{table_name}").fetchone()[0]
+            for table_name in AMENITY_TABLES}
@@ -0,0 +1,161 @@
+import os
+
+from sqlite_export import create_dashboard_indexes, export_spark_dataframe, export_table
+
+# Table names of the two result layouts
+RANKED_TABLE = 'top_cities_by_property_type_ranked'
+JSON_TABLE = 'top_cities_by_property_type'
+
+# Inputs at least this large are analysed with Spark by default; smaller ones with DuckDB,
+# which avoids starting a JVM for a query that takes less time than the startup itself
+SPARK_MIN_INPUT_BYTES = 1024 ** 3
+
+# Question: What are the top 5 cities with the highest average listing prices for each property type?
+# Written once in the SQL dialect shared by DuckDB and Spark SQL, against a `listings` view.
+TOP_CITIES_SQL = """
+    SELECT property_type, rank, city, avg_price
+    FROM (
+        SELECT
+            property_type,
+            city.name AS city,
+            AVG(price) AS avg_price,
+            DENSE_RANK() OVER (PARTITION BY property_type ORDER BY AVG(price) DESC) AS rank
+        FROM listings
+        GROUP BY city.name, property_type
+    ) ranked_cities
+    WHERE rank <= 5
+    ORDER BY property_type, rank, city
+"""
+
+
+def input_format(path):
+    """
+    Returns 'parquet' or 'json' for a listings file or directory.
+    Both JSON array files and NDJSON (one listing per line) are read as 'json'.
+    """
+    if os.path.isdir(path):
+        names = [name for name in os.listdir(path) if not name.startswith(('.', '_'))]
+        return 'parquet' if names and all(name.endswith('.parquet') for name in names) else 'json'
+    return 'parquet' if path.endswith('.parquet') else 'json'
+
+
+def input_size(path):
+    """
+    Returns the size in bytes of a listings file, or of all files in a listings directory.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+                   if not name.startswith(('.', '_')))
+    return os.path.getsize(path)
+
+
+def choose_engine(path, spark_min_bytes=SPARK_MIN_INPUT_BYTES):
+    """
+    Returns 'spark' for inputs of at least `spark_min_bytes`, and 'duckdb' otherwise.
+    """
+    return 'spark' if input_size(path) >= spark_min_bytes else 'duckdb'
+
+
+class DuckDBEngine:
+    """
+    Runs the analysis in-process with DuckDB, reading the JSON with read_json_auto.
+    """
+    name = 'duckdb'
+
+    # Nests the ranked cities of each property type into one JSON list, in rank order
+    json_list_sql = """
+        SELECT property_type,
+               to_json(list({{'name': city, 'avg_price': avg_price}} ORDER BY rank, city)) AS top_cities
+        FROM ({ranked}) ranked_cities
+        GROUP BY property_type
+        ORDER BY property_type
+    """
+
+    def __init__(self):
+        import duckdb
+        self.con = duckdb.connect()
+
+    def load_listings(self, path):
+        """
+        Registers the listings file or directory as the `listings` view.
+        """
+        file_format = input_format(path)
+        if os.path.isdir(path):
+            path = os.path.join(path, f'*.{file_format}')
+        reader = 'read_parquet' if file_format == 'parquet' else 'read_json_auto'
+        literal = path.replace("'", "''")
+        self.con.execute(f"CREATE OR REPLACE VIEW listings AS SELECT * FROM {reader}('{literal}')")
+
+    def export(self, sql, sqlite_conn, table_name):
+        """
+        Writes the result of `sql` to a SQLite table and returns the number of rows written.
+        """
+        return export_table(self.con, f"({sql})", sqlite_conn, table_name)
+
+    def close(self):
+        self.con.close()
+
+
+class SparkEngine:
+    """
+    Runs the analysis with Spark SQL. Uses the given SparkSession, or starts (and later stops) its own.
+    """
+    name = 'spark'
+
+    # Nests the ranked cities of each property type into one list, in rank order (written as JSON on export)
+    json_list_sql = """
+        SELECT property_type,
+               transform(array_sort(collect_list(struct(rank, city, avg_price))),
+                         c -> named_struct('name', c.city, 'avg_price', c.avg_price)) AS top_cities
+        FROM ({ranked}) ranked_cities
+        GROUP BY property_type
+        ORDER BY property_type
+    """
+
+    def __init__(self, spark=None):
+        from spark_analysis import spark_session
+        self.owns_session = spark is None
+        self.spark = spark if spark is not None else spark_session()
+
+    def load_listings(self, path):
+        """
+        Registers the listings file or directory as the `listings` view, read with the declared schema.
+        """
+        from spark_analysis import read_listings
+        read_listings(self.spark, path).createOrReplaceTempView("listings")
+
+    def export(self, sql, sqlite_conn, table_name):
+        """
+        Writes the result of `sql` to a SQLite table and returns the number of rows written.
+        """
+        return export_spark_dataframe(self.spark.sql(sql), sqlite_conn, table_name)
+
+    def close(self):
+        if self.owns_session:
+            self.spark.stop()
+
+
+ENGINES = {
+    'duckdb': DuckDBEngine,
+    'spark': SparkEngine,
+}
+
+
+def top_cities_sql(engine, layout='normalized'):
+    """
+    Returns the (SQLite table name, SQL) of the top cities analysis in the given layout.
+    """
+    if layout == 'json':
+        return JSON_TABLE, engine.json_list_sql.format(ranked=TOP_CITIES_SQL)
+    return RANKED_TABLE, TOP_CITIES_SQL
+
+
+def export_top_cities(engine, sqlite_conn, layout='normalized'):
+    """
+    Runs the top cities analysis on an engine whose `listings` view is loaded and writes it to SQLite.
+    Returns the table name and the number of rows written.
+    """
+    table_name, sql = top_cities_sql(engine, layout)
+    row_count = engine.export(sql, sqlite_conn, table_name)
+    create_dashboard_indexes(sqlite_conn, [table_name])
+    return table_name, row_count
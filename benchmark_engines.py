@@ -0,0 +1,76 @@
+"""
+Benchmarks the top cities analysis on DuckDB and on Spark across dataset sizes.
+
+Each size is generated once with the vectorized generator of fake_data.py, then spark_analysis.py is run
+end to end (interpreter and JVM startup included) with `--engine duckdb` and `--engine spark`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from analysis_engines import ENGINES, SPARK_MIN_INPUT_BYTES
+from fake_data import write_vectorized
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_engine(engine, input_path, output_db):
+    """
+    Runs the top cities analysis of spark_analysis.py with one engine and returns its wall time in seconds.
+    """
+    command = [sys.executable, os.path.join(script_dir, 'spark_analysis.py'), '--input', input_path,
+               '--output-db', output_db, '--engine', engine, '--analyses', 'top_cities']
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the DuckDB and Spark engines across dataset sizes.")
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000, 1000000],
+                        help="Dataset sizes to generate, in listings (default: 10000 100000 1000000)")
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per engine and size; the fastest is kept")
+    parser.add_argument('--work-dir', default=None, help="Directory for the generated datasets (default: a temp dir)")
+    parser.add_argument('--output', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='airbnb_engines_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = []
+    for rows in args.rows:
+        input_path = os.path.join(work_dir, f"airbnb_listings_{rows}.json")
+        if not os.path.exists(input_path):
+            print(f"Generating {rows} listings...")
+            write_vectorized(input_path, 'json', seed=0, rows=rows)
+        size_bytes = os.path.getsize(input_path)
+
+        for engine in args.engines:
+            output_db = os.path.join(work_dir, f"results_{engine}.db")
+            seconds = min(run_engine(engine, input_path, output_db) for _ in range(args.repeat))
+            results.append({'engine': engine, 'rows': rows, 'bytes': size_bytes, 'seconds': seconds,
+                            'mb_per_second': size_bytes / 1024 ** 2 / seconds})
+            print(f"  {engine:<7} {size_bytes / 1024 ** 2:>9.1f} MB  {seconds:>8.2f}s  "
+                  f"{results[-1]['mb_per_second']:>8.1f} MB/s")
+
+    print("Fastest engine per size:")
+    for size_bytes in sorted({result['bytes'] for result in results}):
+        runs = [result for result in results if result['bytes'] == size_bytes]
+        fastest = min(runs, key=lambda result: result['seconds'])
+        print(f"  {size_bytes / 1024 ** 2:>9.1f} MB: {fastest['engine']}")
+    print(f"--engine auto switches to Spark at {SPARK_MIN_INPUT_BYTES / 1024 ** 2:.0f} MB "
+          f"(spark_analysis.py --spark-min-bytes)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
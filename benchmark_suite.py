@@ -0,0 +1,257 @@
+"""
+End-to-end benchmark of the project across dataset sizes.
+
+For every scale a listings CSV is generated with the vectorized generator of fake_data.py (and a JSON file
+with the same number of listings for spark_analysis.py). Each stage is then timed: DuckDB CSV ingestion,
+each main.py query, the derived dashboard tables, the SQLite export, the spark_analysis.py job and every
+dashboard page rendered headlessly. Throughput and peak RSS of every stage are written to a JSON file, and
+stages slower or larger than a stored baseline are flagged as regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+import duckdb
+
+from amenities import AMENITY_TABLES, build_amenity_dimension
+from cube import CUBE_TABLES, build_listing_cube
+from fake_data import parse_size, write_vectorized
+from histograms import HISTOGRAM_TABLES, build_price_review_histograms
+from main import load_listings, queries
+from query_engine import result_table, run_queries
+from run_log import peak_rss
+from sketches import SKETCH_TABLES, build_listing_sketches
+from spatial import SPATIAL_TABLES, build_listing_tiles
+from sqlite_export import export_tables
+from text_search import SEARCH_TABLES, build_search_index
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Dataset sizes of the listings CSV
+DEFAULT_SCALES = ['10MB', '100MB', '1GB']
+
+# Derived tables built by main.py after the queries: (stage name, builder, tables)
+DERIVED_BUILDERS = [
+    ('amenities', build_amenity_dimension, AMENITY_TABLES),
+    ('histograms', build_price_review_histograms, HISTOGRAM_TABLES),
+    ('tiles', build_listing_tiles, SPATIAL_TABLES),
+    ('sketches', build_listing_sketches, SKETCH_TABLES),
+    ('search_index', build_search_index, SEARCH_TABLES),
+    ('cube', build_listing_cube, CUBE_TABLES),
+]
+
+# A stage regresses when it is more than REGRESSION_TOLERANCE slower (or larger) than the baseline, and the
+# difference is above the noise floor
+REGRESSION_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_RSS_MB = 20
+
+# Seed of the generated datasets, so every run benchmarks the same listings
+DATA_SEED = 0
+
+
+class StageFailed(Exception):
+    """
+    Raised by a stage that failed without stopping the benchmark (the Spark job, a dashboard page).
+    """
+
+
+def run_stage(results, scale, stage, fn, rows=None, input_bytes=None):
+    """
+    Runs `fn` while timing it and sampling the peak RSS, and appends the stage record to `results`.
+    A StageFailed raised by `fn` is recorded as the error of the stage. Returns the record.
+    """
+    start = time.perf_counter()
+    error = None
+    with peak_rss() as peak:
+        try:
+            fn()
+        except StageFailed as e:
+            error = str(e)
+    seconds = time.perf_counter() - start
+
+    record = {'scale': scale, 'stage': stage, 'seconds': seconds, 'peak_rss_mb': peak['bytes'] / 1024 ** 2,
+              'rows': rows, 'bytes': input_bytes,
+              'rows_per_second': rows / seconds if rows and seconds > 0 else None,
+              'mb_per_second': input_bytes / 1024 ** 2 / seconds if input_bytes and seconds > 0 else None,
+              'error': error}
+    results.append(record)
+    throughput = f"{record['rows_per_second']:>12,.0f} rows/s" if record['rows_per_second'] else " " * 19
+    print(f"  {stage:<45} {seconds:>8.3f}s {throughput} {record['peak_rss_mb']:>8.0f} MB RSS"
+          f"{'  ERROR: ' + error if error else ''}")
+    return record
+
+
+def generate_datasets(scale_dir, target_size):
+    """
+    Generates the listings CSV of one scale unless it already exists. Returns its path.
+    """
+    csv_path = os.path.join(scale_dir, 'airbnb-listings.csv')
+    if not os.path.exists(csv_path):
+        print(f"Generating {target_size / 1024 ** 2:.0f} MB of listings...")
+        write_vectorized(csv_path, 'csv', seed=DATA_SEED, target_size=target_size)
+    return csv_path
+
+
+def benchmark_main(results, scale, scale_dir, csv_path):
+    """
+    Times the main.py pipeline on one scale: CSV ingestion, each query, the derived tables and the export.
+    Returns the number of listings.
+    """
+    con = duckdb.connect()
+    csv_bytes = os.path.getsize(csv_path)
+    run_stage(results, scale, 'ingest_csv', lambda: load_listings(con, csv_path), input_bytes=csv_bytes)
+    listings = con.execute("SELECT COUNT(*) FROM airbnb_listings").fetchone()[0]
+    results[-1].update(rows=listings, rows_per_second=listings / results[-1]['seconds'])
+
+    # Every query runs alone (no shared scans, no concurrency) so its own time is measured
+    tables = []
+    for idx, (_, query_name) in enumerate(queries):
+        table_name = f"query_{idx + 1}"
+        run_stage(results, scale, f"{table_name} {query_name}",
+                  lambda: run_queries(con, queries, workers=1, share_scans=False, only=[table_name]),
+                  rows=listings)
+        tables.append(table_name)
+
+    for stage, build, table_names in DERIVED_BUILDERS:
+        run_stage(results, scale, stage, lambda: build(con), rows=listings)
+        tables += table_names
+
+    sqlite_path = os.path.join(scale_dir, 'airbnb_queries.db')
+    for path in (sqlite_path, f"{sqlite_path}-wal", f"{sqlite_path}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    sqlite_conn = sqlite3.connect(sqlite_path)
+    exported = {}
+    run_stage(results, scale, 'sqlite_export',
+              lambda: exported.update(export_tables(con, [(result_table(table), table) for table in tables],
+                                                    sqlite_conn)))
+    results[-1].update(rows=sum(exported.values()), rows_per_second=sum(exported.values()) / results[-1]['seconds'])
+    sqlite_conn.close()
+    con.close()
+    return listings
+
+
+def benchmark_spark(results, scale, scale_dir, listings):
+    """
+    Times spark_analysis.py (all analyses, Spark engine) on a JSON file with the same number of listings.
+    """
+    json_path = os.path.join(scale_dir, f"airbnb_listings_{listings}.json")
+    if not os.path.exists(json_path):
+        print(f"Generating {listings} JSON listings for Spark...")
+        write_vectorized(json_path, 'json', seed=DATA_SEED, rows=listings)
+    command = [sys.executable, os.path.join(script_dir, 'spark_analysis.py'), '--input', os.path.abspath(json_path),
+               '--output-db', 'airbnb_analysis_results.db', '--engine', 'spark']
+
+    def run():
+        with open(os.path.join(scale_dir, 'spark_analysis.log'), 'w') as log:
+            returncode = subprocess.run(command, cwd=scale_dir, stdout=log, stderr=subprocess.STDOUT).returncode
+        if returncode != 0:
+            raise StageFailed(f"exit code {returncode}, see {os.path.join(scale_dir, 'spark_analysis.log')}")
+
+    run_stage(results, scale, 'spark_analysis', run, rows=listings, input_bytes=os.path.getsize(json_path))
+
+
+def benchmark_dashboard(results, scale, scale_dir):
+    """
+    Renders every dashboard page headlessly (Streamlit AppTest) against the databases of one scale.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    cwd = os.getcwd()
+    # The dashboard opens its databases relative to the working directory
+    os.chdir(scale_dir)
+    try:
+        app = AppTest.from_file(os.path.join(script_dir, 'airbnb_dashboard.py'), default_timeout=600)
+        run_stage(results, scale, 'dashboard startup', app.run)
+        for page in app.sidebar.radio[0].options:
+            def render():
+                app.sidebar.radio[0].set_value(page).run()
+                if app.exception:
+                    raise StageFailed(str(app.exception[0].value).splitlines()[0])
+            run_stage(results, scale, f"page {page}", render)
+    finally:
+        os.chdir(cwd)
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Returns the (record, baseline record, metric) triples whose time or peak RSS exceeds the baseline of the
+    same scale and stage by more than `tolerance`.
+    """
+    previous = {(record['scale'], record['stage']): record for record in baseline['results']}
+    regressions = []
+    for record in results:
+        base = previous.get((record['scale'], record['stage']))
+        if base is None:
+            continue
+        if (record['seconds'] > base['seconds'] * (1 + tolerance) and
+                record['seconds'] - base['seconds'] > MIN_REGRESSION_SECONDS):
+            regressions.append((record, base, 'seconds'))
+        if (record['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance) and
+                record['peak_rss_mb'] - base['peak_rss_mb'] > MIN_REGRESSION_RSS_MB):
+            regressions.append((record, base, 'peak_rss_mb'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, queries, export, Spark and the dashboard.")
+    parser.add_argument('--scales', nargs='+', default=DEFAULT_SCALES,
+                        help="Sizes of the generated listings CSV (default: 10MB 100MB 1GB)")
+    parser.add_argument('--work-dir', default='airbnb_benchmark',
+                        help="Directory of the generated datasets and databases (datasets are reused)")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file receiving the results")
+    parser.add_argument('--baseline', default='benchmark_baseline.json',
+                        help="Results of a previous run to compare against (if the file exists)")
+    parser.add_argument('--save-baseline', action='store_true', help="Also store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help="Relative slowdown (or RSS growth) flagged as a regression (default: 0.25)")
+    parser.add_argument('--skip-spark', action='store_true', help="Do not run spark_analysis.py")
+    parser.add_argument('--skip-dashboard', action='store_true', help="Do not render the dashboard pages")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        scale_dir = os.path.join(args.work_dir, scale)
+        os.makedirs(scale_dir, exist_ok=True)
+        csv_path = generate_datasets(scale_dir, parse_size(scale))
+        print(f"Scale {scale} ({os.path.getsize(csv_path) / 1024 ** 2:.1f} MB CSV):")
+        listings = benchmark_main(results, scale, scale_dir, csv_path)
+        if not args.skip_spark:
+            benchmark_spark(results, scale, scale_dir, listings)
+        if not args.skip_dashboard:
+            benchmark_dashboard(results, scale, scale_dir)
+
+    run = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+           'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'duckdb': duckdb.__version__,
+           'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        print(f"Compared with the baseline of {baseline['created_at']}: {len(regressions)} regression(s)")
+        for record, base, metric in regressions:
+            print(f"  REGRESSION {record['scale']} {record['stage']}: {metric} {base[metric]:.3f} -> "
+                  f"{record[metric]:.3f} ({record[metric] / base[metric] - 1:+.0%})")
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    errors = [record for record in results if record.get('error')]
+    if regressions or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
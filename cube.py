@@ -0,0 +1,201 @@
+import time
+
+# Dimensions of the rollup cube; every combination of them (2**6 = 64 grouping sets) is precomputed
+CUBE_DIMENSIONS = ['City', 'Neighbourhood', 'Property Type', 'Room Type', 'Bedrooms', 'Cancellation Policy']
+
+# Measured columns: the cube keeps their count, sum and sum of squares, so averages and standard deviations
+# of any slice can be derived (and partial cubes merged by adding them)
+CUBE_MEASURES = {'price': 'Price', 'rating': 'Review Scores Rating'}
+
+# Cells with fewer listings are pruned from the exported cube
+CUBE_MIN_LISTINGS = 5
+
+# Value of a dimension that is missing in a listing (NULL in a cell means "all values" of the dimension)
+CUBE_UNKNOWN = '(unknown)'
+
+# Grouping sets aggregated per scan of the listings when the cube is built; fewer sets per scan bound the
+# memory of the aggregation (the out-of-core mode builds the cube under a memory limit)
+CUBE_BATCH_SETS = 8
+
+# Tables exported to the dashboard database
+CUBE_TABLES = ['listing_cube']
+
+# Signed partial cube of `source`: one row per cell of the given grouping sets (every set by default) with
+# at least {min_listings} listings. dimension_mask has bit i set when CUBE_DIMENSIONS[i] is fixed in the cell
+CUBE_PARTIALS_SQL = """
+    SELECT
+        {dimension_mask} AS dimension_mask,
+        {dimension_outputs},
+        {sign} * COUNT(*) AS listings,
+        {measures}
+    FROM (
+        SELECT {dimension_values}, {measure_values}
+        FROM {source}
+    )
+    GROUP BY GROUPING SETS ({grouping_sets})
+    HAVING COUNT(*) >= {min_listings}
+"""
+
+# Merges partial cubes (the state and any number of signed partials) into one row per cell
+MERGE_CUBE_SQL = """
+    SELECT dimension_mask, {dimension_columns}, SUM(listings) AS listings, {measures}
+    FROM ({partials})
+    GROUP BY dimension_mask, {dimension_columns}
+    HAVING SUM(listings) > 0
+"""
+
+# Exported cube: cells with at least {min_listings} listings
+LISTING_CUBE_SQL = """
+    SELECT *
+    FROM {cube}
+    WHERE listings >= {min_listings}
+    ORDER BY dimension_mask, {dimension_columns}
+"""
+
+
+def cube_column(dimension):
+    """
+    Returns the cube column of a dimension ('Property Type' -> property_type).
+    """
+    return dimension.lower().replace(' ', '_')
+
+
+def cube_measure_columns():
+    """
+    Returns the names of the count, sum and sum-of-squares columns of every measure.
+    """
+    return [f"{name}_{suffix}" for name in CUBE_MEASURES for suffix in ('count', 'sum', 'sumsq')]
+
+
+def cube_grouping_set(mask):
+    """
+    Returns the grouping set fixing the dimensions of a dimension_mask, e.g. (city, room_type).
+    """
+    return f"({', '.join(cube_column(dimension) for i, dimension in enumerate(CUBE_DIMENSIONS) if mask >> i & 1)})"
+
+
+def cube_partials_sql(source, sign=1, masks=None, min_listings=1):
+    """
+    Returns the SELECT computing the signed partial cube of `source` over the grouping sets of `masks`
+    (all of them by default), keeping the cells with at least `min_listings` listings.
+    """
+    if masks is None:
+        masks = range(2 ** len(CUBE_DIMENSIONS))
+    # Dimensions no grouping set of `masks` fixes are NULL in every cell (GROUPING() rejects them)
+    grouped = [any(mask >> i & 1 for mask in masks) for i in range(len(CUBE_DIMENSIONS))]
+    return CUBE_PARTIALS_SQL.format(
+        source=source,
+        sign=sign,
+        grouping_sets=', '.join(cube_grouping_set(mask) for mask in masks),
+        min_listings=min_listings,
+        dimension_mask=' + '.join([f"(1 - GROUPING({cube_column(dimension)})) * {1 << i}"
+                                   for i, dimension in enumerate(CUBE_DIMENSIONS) if grouped[i]] or ['0']),
+        dimension_outputs=', '.join(cube_column(dimension) if grouped[i]
+                                    else f"CAST(NULL AS VARCHAR) AS {cube_column(dimension)}"
+                                    for i, dimension in enumerate(CUBE_DIMENSIONS)),
+        dimension_values=', '.join(f"""COALESCE(CAST("{dimension}" AS VARCHAR), '{CUBE_UNKNOWN}') AS {cube_column(dimension)}"""
+                                   for dimension in CUBE_DIMENSIONS),
+        measure_values=', '.join(f'CAST("{column}" AS DOUBLE) AS {name}' for name, column in CUBE_MEASURES.items()),
+        measures=', '.join(f"{sign} * COUNT({name}) AS {name}_count, "
+                           f"{sign} * COALESCE(SUM({name}), 0) AS {name}_sum, "
+                           f"{sign} * COALESCE(SUM({name} * {name}), 0) AS {name}_sumsq"
+                           for name in CUBE_MEASURES))
+
+
+def merge_cube_sql(*partials):
+    """
+    Returns the SELECT merging the given partial cube SELECTs or tables.
+    """
+    return MERGE_CUBE_SQL.format(
+        partials=' UNION ALL BY NAME '.join(f"SELECT * FROM ({partial})" for partial in partials),
+        dimension_columns=', '.join(cube_column(dimension) for dimension in CUBE_DIMENSIONS),
+        measures=', '.join(f"SUM({column}) AS {column}" for column in cube_measure_columns()))
+
+
+def listing_cube_sql(cube):
+    """
+    Returns the SELECT of the pruned cube read from the merged cube `cube`.
+    """
+    return LISTING_CUBE_SQL.format(cube=cube, min_listings=CUBE_MIN_LISTINGS,
+                                   dimension_columns=', '.join(cube_column(dimension) for dimension in CUBE_DIMENSIONS))
+
+
+def cube_slice_sql(filters, breakdown=None):
+    """
+    Returns the SELECT (and its parameters) of the cells of a slice of the exported cube. `filters` maps
+    dimensions to the value they are fixed to; with a `breakdown` dimension one cell per value of that
+    dimension is returned, otherwise the single cell of the slice. Every dimension is constrained (to a
+    value, or to NULL for "all values"), so the lookup is answered from the (dimension_mask, ...) index.
+    """
+    fixed = set(filters) | ({breakdown} if breakdown else set())
+    conditions = ["dimension_mask = ?"]
+    params = [sum(1 << i for i, dimension in enumerate(CUBE_DIMENSIONS) if dimension in fixed)]
+    for dimension in CUBE_DIMENSIONS:
+        if dimension == breakdown:
+            continue
+        if dimension in filters:
+            conditions.append(f"{cube_column(dimension)} = ?")
+            params.append(str(filters[dimension]))
+        else:
+            conditions.append(f"{cube_column(dimension)} IS NULL")
+    return f"SELECT * FROM listing_cube WHERE {' AND '.join(conditions)}", params
+
+
+def cube_build_sql():
+    """
+    Returns the SQL text of every cube step, used as the result cache key of the cube table.
+    """
+    return '\n'.join([cube_partials_sql('airbnb_listings'), merge_cube_sql('cube'), listing_cube_sql('cube'),
+                      f"-- min_listings={CUBE_MIN_LISTINGS} batch_sets={CUBE_BATCH_SETS}"])
+
+
+def build_listing_cube(con, source='airbnb_listings'):
+    """
+    Aggregates the listings over every combination of CUBE_DIMENSIONS and stores the cells with at least
+    CUBE_MIN_LISTINGS listings, with the count, sum and sum of squares of every measure, as a DuckDB table
+    (result_listing_cube). The grouping sets are aggregated CUBE_BATCH_SETS at a time and pruned before
+    they are stored, so the unpruned cube is never materialized.
+    """
+    start = time.perf_counter()
+    masks = list(range(2 ** len(CUBE_DIMENSIONS)))
+    for offset in range(0, len(masks), CUBE_BATCH_SETS):
+        batch = cube_partials_sql(source, masks=masks[offset:offset + CUBE_BATCH_SETS],
+                                  min_listings=CUBE_MIN_LISTINGS)
+        if offset == 0:
+            con.execute(f"CREATE OR REPLACE TABLE result_listing_cube AS {batch}")
+        else:
+            con.execute(f"INSERT INTO result_listing_cube BY NAME {batch}")
+    print(f"Built rollup cube over {', '.join(CUBE_DIMENSIONS)} in {time.perf_counter() - start:.2f}s")
+    return {table_name: con.execute(f"SELECT COUNT(*) FROM result_{table_name}").fetchone()[0]
+            for table_name in CUBE_TABLES}
+
+
+def init_cube_state(con, listings='listing_state', state='cube_state'):
+    """
+    Creates the persistent unpruned cube on first use (incremental mode), seeded from the stored `listings`
+    so later retractions of those listings stay consistent.
+    """
+    exists = con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                         [state]).fetchall()[0][0]
+    if not exists:
+        con.execute(f"CREATE TABLE {state} AS {merge_cube_sql(cube_partials_sql(listings))}")
+
+
+def merge_cube_state(con, incoming, retracted, state='cube_state'):
+    """
+    Adds the partial cube of the `incoming` rows to the persistent cube and subtracts that of the
+    `retracted` rows. Cells left without listings are dropped; pruning happens on export.
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE merged_cube AS
+        {merge_cube_sql(f"SELECT * FROM {state}", cube_partials_sql(incoming, 1), cube_partials_sql(retracted, -1))}
+    """)
+    con.execute(f"DELETE FROM {state}")
+    con.execute(f"INSERT INTO {state} BY NAME SELECT * FROM merged_cube")
+
+
+def cube_state_source(state='cube_state'):
+    """
+    Returns the (DuckDB source, SQLite table name) pair exporting the pruned incremental cube.
+    """
+    return f"({listing_cube_sql(state)})", 'listing_cube'
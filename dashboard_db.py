@@ -0,0 +1,396 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from run_log import write_run_logs
+from snapshots import published_snapshot
+from staging import create_listings_view, read_manifest
+
+QUERIES_DB = 'airbnb_queries.db'
+ANALYSIS_DB = 'airbnb_analysis_results.db'
+
+# Parquet copy of the listings written by `main.py --stage`
+STAGING_DIR = 'airbnb_staging'
+
+# Memoized query results kept per process (older versions of a database age out first)
+MAX_CACHED_RESULTS = 512
+
+# Time, queries and rows spent loading data for the page being rendered. Every session renders on its own
+# script thread, so the counters are per thread.
+page_load = threading.local()
+
+
+def reset_page_load():
+    """
+    Zeroes the data loading counters before a page is rendered.
+    """
+    page_load.seconds = 0.0
+    page_load.queries = 0
+    page_load.rows = 0
+
+
+def record_page_load(seconds, rows):
+    """
+    Adds one query to the data loading counters of the current page.
+    """
+    if not hasattr(page_load, 'seconds'):
+        reset_page_load()
+    page_load.seconds += seconds
+    page_load.queries += 1
+    page_load.rows += rows
+
+
+@st.cache_resource(show_spinner=False)
+def page_log():
+    """
+    Returns the queue of page renders waiting to be written to the run log. The first call starts the
+    thread writing them.
+    """
+    pending = queue.Queue()
+    threading.Thread(target=flush_page_log, args=(pending,), name='run-log-writer', daemon=True).start()
+    return pending
+
+
+def flush_page_log(pending):
+    """
+    Background loop: writes the queued page renders to the run log in one transaction every
+    RUN_LOG_FLUSH_SECONDS, so no page waits for the run-log file.
+    """
+    while True:
+        time.sleep(RUN_LOG_FLUSH_SECONDS)
+        run_logs = []
+        while True:
+            try:
+                run_logs.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        if not run_logs:
+            continue
+        try:
+            write_run_logs(run_logs, run_logs[0].db_path)
+        except sqlite3.OperationalError:
+            # The run log is diagnostics only; renders are dropped when the file is busy or read-only
+            pass
+
+
+def db_version(db_path):
+    """
+    Returns a cheap fingerprint of a SQLite database on disk: the inode, size and modification time of the
+    database file and of its WAL file. It changes whenever results are written or the file is replaced.
+    """
+    version = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            stat = os.stat(path)
+            version.extend([stat.st_ino, stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            version.extend([None, None, None])
+    return tuple(version)
+
+
+# Seconds between checks of the databases for a newly published snapshot
+SNAPSHOT_POLL_SECONDS = 2
+
+# Seconds between writes of the buffered page renders to the run log (renders still buffered when the
+# dashboard stops are not logged)
+RUN_LOG_FLUSH_SECONDS = 5
+
+# Most recent queries per database re-run on a new snapshot before the sessions are moved over to it
+PREWARM_QUERIES = 64
+
+
+def open_snapshot(db_path):
+    """
+    Returns the snapshot currently published as `db_path`: its version, the read-only URI of the versioned
+    file (immutable, so read without locking) and an empty connection pool. A database written in place by
+    an older pipeline is opened directly.
+    """
+    while True:
+        version = db_version(db_path)
+        path = published_snapshot(db_path) if os.path.exists(db_path) else None
+        # Published again while resolving: resolve the newer version
+        if db_version(db_path) == version:
+            break
+    uri = f"file:{path}?mode=ro&immutable=1" if path else f"file:{db_path}?mode=ro"
+    return {'db_path': db_path, 'version': version, 'uri': uri, 'connections': queue.LifoQueue(), 'prewarmed': {},
+            'retired': False}
+
+
+@st.cache_resource(show_spinner=False)
+def snapshot_state():
+    """
+    Returns the snapshots served to every session, per database, with the queries recently run on them.
+    The first call starts the thread moving the sessions over to newly published snapshots.
+    """
+    state = {'lock': threading.Lock(), 'served': {}, 'recent': {}}
+    threading.Thread(target=watch_snapshots, args=(state,), name='snapshot-watcher', daemon=True).start()
+    return state
+
+
+def served_snapshot(db_path):
+    """
+    Returns the snapshot of `db_path` the sessions read, opening it on first use.
+    """
+    state = snapshot_state()
+    with state['lock']:
+        if db_path not in state['served']:
+            state['served'][db_path] = open_snapshot(db_path)
+            state['recent'][db_path] = OrderedDict()
+        return state['served'][db_path]
+
+
+@contextmanager
+def pooled_connection(snapshot):
+    """
+    Borrows a read-only connection to a snapshot from its pool, opening a new one when the pool is empty.
+    Connections of a retired snapshot are closed when they are returned. If the snapshot file was already
+    pruned, the database currently published is opened instead.
+    """
+    try:
+        conn = snapshot['connections'].get_nowait()
+    except queue.Empty:
+        try:
+            conn = sqlite3.connect(snapshot['uri'], uri=True, check_same_thread=False)
+        except sqlite3.OperationalError:
+            conn = sqlite3.connect(f"file:{snapshot['db_path']}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        yield conn
+    finally:
+        if snapshot['retired']:
+            conn.close()
+        else:
+            snapshot['connections'].put(conn)
+
+
+def retire_snapshot(snapshot):
+    """
+    Closes the idle connections of a snapshot that is no longer served; the ones still in use by a
+    session are closed when that session returns them.
+    """
+    snapshot['retired'] = True
+    snapshot['prewarmed'].clear()
+    while True:
+        try:
+            snapshot['connections'].get_nowait().close()
+        except queue.Empty:
+            return
+
+
+def prewarm_snapshot(snapshot, queries):
+    """
+    Runs the given (query, params) on a new snapshot and keeps their results for the first sessions asking
+    for them. Queries failing on the new version (e.g. a dropped table) are left to the sessions.
+    """
+    for query, params in queries:
+        try:
+            with pooled_connection(snapshot) as conn:
+                snapshot['prewarmed'][(query, params)] = pd.read_sql_query(query, conn, params=params)
+        except (sqlite3.Error, pd.errors.DatabaseError):
+            continue
+
+
+def watch_snapshots(state):
+    """
+    Background loop: when a database is published again, opens the new snapshot, re-runs the recent queries
+    on it, then moves the sessions over in one step. Sessions keep reading the previous snapshot meanwhile,
+    so a page never waits for the swap nor mixes a partial state.
+    """
+    while True:
+        time.sleep(SNAPSHOT_POLL_SECONDS)
+        with state['lock']:
+            served = dict(state['served'])
+        for db_path, snapshot in served.items():
+            try:
+                if db_version(db_path) == snapshot['version']:
+                    continue
+                new_snapshot = open_snapshot(db_path)
+            except OSError:
+                # Missing while being replaced by hand: checked again on the next poll
+                continue
+            with state['lock']:
+                recent = list(state['recent'][db_path])
+            prewarm_snapshot(new_snapshot, recent)
+            with state['lock']:
+                state['served'][db_path] = new_snapshot
+            retire_snapshot(snapshot)
+
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS, show_spinner=False)
+def cached_query(db_path, query, params, version, _snapshot):
+    """
+    Runs a query on a pooled connection to a snapshot, unless the background swap already ran it.
+    Results are memoized per (database, query, parameters, version).
+    """
+    df = _snapshot['prewarmed'].pop((query, params), None)
+    if df is not None:
+        return df
+    with pooled_connection(_snapshot) as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+
+def remember_query(db_path, query, params):
+    """
+    Records a query as recently run on a database, so it is prewarmed on the next published snapshot.
+    """
+    state = snapshot_state()
+    with state['lock']:
+        recent = state['recent'][db_path]
+        recent[(query, params)] = None
+        recent.move_to_end((query, params))
+        if len(recent) > PREWARM_QUERIES:
+            recent.popitem(last=False)
+
+
+def query_df(db_path, query, params=()):
+    """
+    Returns the result of a query as a DataFrame, read from the snapshot currently served and cached until
+    a new one is published.
+    """
+    start = time.perf_counter()
+    snapshot = served_snapshot(db_path)
+    remember_query(db_path, query, tuple(params))
+    df = cached_query(db_path, query, tuple(params), snapshot['version'], snapshot)
+    record_page_load(time.perf_counter() - start, len(df))
+    return df
+
+
+def table_names(db_path):
+    """
+    Returns the set of table names in a database (cached like any other query), empty until it is published.
+    """
+    if not os.path.exists(db_path):
+        return set()
+    return set(query_df(db_path, "SELECT name FROM sqlite_master WHERE type = 'table'")['name'])
+
+
+# Exploration page: listing rows returned at most, and seconds before a DuckDB query is interrupted
+EXPLORE_ROW_CAP = 1000
+EXPLORE_TIMEOUT_SECONDS = 5
+
+# Columns shown in the exploration page's listing table
+EXPLORE_COLUMNS = ['ID', 'Name', 'Country', 'City', 'Neighbourhood Cleansed', 'Property Type', 'Room Type',
+                   'Price', 'Bedrooms', 'Number of Reviews', 'Review Scores Rating']
+
+# Date columns the exploration page can filter on
+EXPLORE_DATE_COLUMNS = ['Last Scraped', 'Host Since', 'First Review', 'Last Review']
+
+
+def staging_version(staging_dir=STAGING_DIR):
+    """
+    Returns the (fingerprint, staged_at) of the staged listings, or None if nothing has been staged yet.
+    """
+    manifest = read_manifest(staging_dir)
+    if manifest is None:
+        return None
+    return manifest['fingerprint'], manifest['staged_at']
+
+
+@st.cache_resource(show_spinner=False)
+def listings_connection(staging_dir, version):
+    """
+    Returns the DuckDB connection over the staged Parquet listings, shared by every session.
+    Each query runs on its own cursor; a new connection is opened when the listings are restaged.
+    """
+    import duckdb
+    con = duckdb.connect()
+    create_listings_view(con, staging_dir)
+    return con
+
+
+def run_listings_query(staging_dir, version, query, params=(), timeout=EXPLORE_TIMEOUT_SECONDS):
+    """
+    Runs a query against the staged listings on a fresh cursor and returns a DataFrame.
+    The query is interrupted after `timeout` seconds (duckdb.InterruptException).
+    """
+    start = time.perf_counter()
+    cursor = listings_connection(staging_dir, version).cursor()
+    timer = threading.Timer(timeout, cursor.interrupt)
+    timer.start()
+    try:
+        df = cursor.execute(query, list(params)).df()
+    finally:
+        timer.cancel()
+        cursor.close()
+    record_page_load(time.perf_counter() - start, len(df))
+    return df
+
+
+def explore_where(filters):
+    """
+    Returns the WHERE clause and parameters of the exploration filters. Every staged file holds a single
+    Country, so filtering on it skips the other files.
+    """
+    conditions = ['Price IS NOT NULL']
+    params = []
+    if filters['countries']:
+        conditions.append(f"Country IN ({', '.join('?' * len(filters['countries']))})")
+        params.extend(filters['countries'])
+    if filters['room_types']:
+        conditions.append(f'"Room Type" IN ({", ".join("?" * len(filters["room_types"]))})')
+        params.extend(filters['room_types'])
+    conditions.append("Price BETWEEN ? AND ?")
+    params.extend(filters['price_range'])
+    if filters['date_range']:
+        conditions.append(f'"{filters["date_column"]}" BETWEEN ? AND ?')
+        params.extend(filters['date_range'])
+    return ' AND '.join(conditions), params
+
+
+@st.cache_data(show_spinner=False)
+def explore_options(staging_dir, version, date_column):
+    """
+    Returns the filter choices of the exploration page: countries, room types, price and date bounds.
+    """
+    countries = run_listings_query(staging_dir, version, """
+        SELECT DISTINCT Country FROM airbnb_listings WHERE Country IS NOT NULL ORDER BY Country
+    """)['Country'].tolist()
+    room_types = run_listings_query(staging_dir, version, """
+        SELECT DISTINCT "Room Type" FROM airbnb_listings WHERE "Room Type" IS NOT NULL ORDER BY 1
+    """)['Room Type'].tolist()
+    bounds = run_listings_query(staging_dir, version, f"""
+        SELECT MIN(Price) AS min_price, MAX(Price) AS max_price,
+               MIN("{date_column}") AS min_date, MAX("{date_column}") AS max_date
+        FROM airbnb_listings
+    """).iloc[0]
+    return countries, room_types, bounds
+
+
+@st.cache_data(max_entries=MAX_CACHED_RESULTS, show_spinner=False)
+def explore_listings(staging_dir, version, filter_key, min_listings, row_cap=EXPLORE_ROW_CAP):
+    """
+    Returns the summary, the per-city aggregates and at most `row_cap` listing rows matching the filters.
+    Results are cached per filter combination and staged version, so repeated selections by any user
+    do not rescan the listings.
+    """
+    filters = dict(filter_key)
+    where, params = explore_where(filters)
+    summary = run_listings_query(staging_dir, version, f"""
+        SELECT COUNT(*) AS Number_of_Listings, AVG(Price) AS Average_Price, MEDIAN(Price) AS Median_Price
+        FROM airbnb_listings
+        WHERE {where}
+    """, params)
+    by_city = run_listings_query(staging_dir, version, f"""
+        SELECT City, Country, COUNT(*) AS Number_of_Listings, AVG(Price) AS Average_Price
+        FROM airbnb_listings
+        WHERE {where} AND City IS NOT NULL
+        GROUP BY City, Country
+        HAVING COUNT(*) >= ?
+        ORDER BY Number_of_Listings DESC
+        LIMIT 20
+    """, params + [min_listings])
+    columns = ', '.join(f'"{column}"' for column in EXPLORE_COLUMNS + [filters['date_column']])
+    # One row more than the cap tells whether the result was truncated
+    rows = run_listings_query(staging_dir, version, f"""
+        SELECT {columns}
+        FROM airbnb_listings
+        WHERE {where}
+        LIMIT {row_cap + 1}
+    """, params)
+    return summary, by_city, rows.head(row_cap), len(rows) > row_cap
@@ -1,28 +1,66 @@
 from faker import Faker
+import argparse
 import json
+import multiprocessing
+import os
 import random
+import re
+import time
 
-print("Starting script...")
+import numpy as np
+
+from staging import CSV_COLUMN_TYPES
 
 fake = Faker()
 
+# Defaults of the generated dataset
+target_size = 70 * 1024 * 1024  # 70MB in bytes
+batch_size = 1000
+sample_size = 50
+
+# Rows per batch, and size of each pre-generated Faker pool, of the vectorized generator
+vectorized_batch_size = 100000
+vectorized_pool_size = 10000
+
+# Rows of the first vectorized batch when generating up to a target size, used to measure the bytes per listing
+vectorized_probe_size = 1000
+
+# Distance between the seeds of consecutive shards
+SHARD_SEED_STRIDE = 1000003
+
+# Listings CSV layout (--format csv): number of distinct cities, neighbourhoods per city and scrape date
+csv_city_count = 50
+csv_neighbourhoods_per_city = 10
+csv_scrape_date = '2017-04-02'
+csv_scrape_id = '20170402075052'
+
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2, 'G': 1024 ** 3, 'GB': 1024 ** 3,
+              'T': 1024 ** 4, 'TB': 1024 ** 4}
+
+
+PROPERTY_TYPES = ["Apartment", "House", "Loft", "Villa", "Condo"]
+
+# Define base price ranges for each property type
+BASE_PRICE_RANGES = {
+    "Apartment": (50, 300),
+    "House": (100, 500),
+    "Loft": (80, 400),
+    "Villa": (300, 1500),
+    "Condo": (70, 350)
+}
+
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room"]
+
+AMENITIES = ["Wifi", "Kitchen", "Washer", "Dryer", "Air conditioning", "Heating", "TV", "Pool"]
+
 
 def generate_airbnb_listing():
-    property_type = random.choice(["Apartment", "House", "Loft", "Villa", "Condo"])
-
-    # Define base price ranges for each property type
-    base_price_ranges = {
-        "Apartment": (50, 300),
-        "House": (100, 500),
-        "Loft": (80, 400),
-        "Villa": (300, 1500),
-        "Condo": (70, 350)
-    }
+    property_type = random.choice(PROPERTY_TYPES)
 
     # Generate a city-specific multiplier
     city_multiplier = random.uniform(0.8, 1.2)
 
-    min_price, max_price = base_price_ranges[property_type]
+    min_price, max_price = BASE_PRICE_RANGES[property_type]
 
     # Apply the city multiplier to the price range
     adjusted_min_price = min_price * city_multiplier
@@ -47,51 +85,471 @@ def generate_airbnb_listing():
         "price": price,
         "bedrooms": random.randint(1, 5),
         "property_type": property_type,
-        "room_type": random.choice(["Entire home/apt", "Private room", "Shared room"]),
-        "amenities": random.sample(["Wifi", "Kitchen", "Washer", "Dryer", "Air conditioning", "Heating", "TV", "Pool"],
-                                   k=random.randint(3, 8))
+        "room_type": random.choice(ROOM_TYPES),
+        "amenities": random.sample(AMENITIES, k=random.randint(3, 8))
     }
 
-print("Generating listings...")
 
-listings = []
-target_size = 70 * 1024 * 1024  # 70MB in bytes
-current_size = 0
-batch_size = 1000
+def build_pools(seed, pool_size=vectorized_pool_size):
+    """
+    Pre-generates the slow Faker fields (city names, countries, host names) once, so the vectorized
+    generator only has to draw indexes into these pools.
+    """
+    pool_faker = Faker()
+    pool_faker.seed_instance(seed)
+    return {
+        'city': np.array([pool_faker.city() for _ in range(pool_size)], dtype=object),
+        'country': np.array([pool_faker.country() for _ in range(pool_size)], dtype=object),
+        'name': np.array([pool_faker.name() for _ in range(pool_size)], dtype=object),
+        'sentence': np.array([pool_faker.sentence(nb_words=10) for _ in range(pool_size)], dtype=object),
+        # City centres of the listings CSV
+        'latitude': np.random.default_rng(seed).uniform(-50, 65, size=pool_size),
+        'longitude': np.random.default_rng(seed + 1).uniform(-170, 170, size=pool_size),
+    }
+
+
+def uuid4_batch(rng, n):
+    """
+    Returns `n` random version-4 UUID strings.
+    """
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hex_digits = raw.tobytes().hex()
+    return [f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+            for h in (hex_digits[i * 32:(i + 1) * 32] for i in range(n))]
+
+
+def generate_listing_batch(rng, n, pools):
+    """
+    Vectorized version of generate_airbnb_listing(): returns `n` listings as a dict of columns.
+    Prices follow the same per-property-type distribution (base range, city multiplier, +/-10% noise).
+    """
+    property_index = rng.integers(0, len(PROPERTY_TYPES), size=n)
+    price_ranges = np.array([BASE_PRICE_RANGES[property_type] for property_type in PROPERTY_TYPES], dtype=float)
+    city_multiplier = rng.uniform(0.8, 1.2, size=n)
+    adjusted_min_price = price_ranges[property_index, 0] * city_multiplier
+    adjusted_max_price = price_ranges[property_index, 1] * city_multiplier
+    price = np.round(rng.uniform(adjusted_min_price, adjusted_max_price) * rng.uniform(0.9, 1.1, size=n), 2)
+
+    # Amenities: a random permutation of the amenity list per row, cut at a random length between 3 and 8
+    amenity_order = np.argsort(rng.random((n, len(AMENITIES))), axis=1)
+    amenity_count = rng.integers(3, len(AMENITIES) + 1, size=n)
+    amenity_names = np.array(AMENITIES, dtype=object)
+    amenities = [amenity_names[order[:k]].tolist() for order, k in zip(amenity_order, amenity_count)]
+
+    def pick(pool):
+        return pools[pool][rng.integers(0, len(pools[pool]), size=n)]
+
+    return {
+        'id': uuid4_batch(rng, n),
+        'name': pick('city'),
+        'host_id': uuid4_batch(rng, n),
+        'host_name': pick('name'),
+        'host_location': pick('city'),
+        'host_response_rate': np.round(rng.uniform(0.5, 1.0, size=n), 2),
+        'city_name': pick('city'),
+        'city_country': pick('country'),
+        'price': price,
+        'bedrooms': rng.integers(1, 6, size=n),
+        'property_type': np.array(PROPERTY_TYPES, dtype=object)[property_index],
+        'room_type': np.array(ROOM_TYPES, dtype=object)[rng.integers(0, len(ROOM_TYPES), size=n)],
+        'amenities': amenities,
+    }
+
+
+def batch_to_listings(batch):
+    """
+    Converts a columnar batch into listing dicts with the same nested layout as generate_airbnb_listing().
+    """
+    columns = {name: values if isinstance(values, list) else values.tolist() for name, values in batch.items()}
+    return [
+        {
+            "id": listing_id,
+            "name": name,
+            "host": {"id": host_id, "name": host_name, "location": host_location, "response_rate": response_rate},
+            "city": {"name": city_name, "country": city_country},
+            "price": price,
+            "bedrooms": bedrooms,
+            "property_type": property_type,
+            "room_type": room_type,
+            "amenities": amenities,
+        }
+        for (listing_id, name, host_id, host_name, host_location, response_rate, city_name, city_country,
+             price, bedrooms, property_type, room_type, amenities)
+        in zip(*(columns[name] for name in batch))
+    ]
+
+
+def batch_to_arrow(batch):
+    """
+    Converts a columnar batch into an Arrow table with nested `host` and `city` structs.
+    """
+    import pyarrow as pa
+
+    return pa.table({
+        'id': pa.array(batch['id'], pa.string()),
+        'name': pa.array(batch['name'], pa.string()),
+        'host': pa.StructArray.from_arrays(
+            [pa.array(batch['host_id'], pa.string()), pa.array(batch['host_name'], pa.string()),
+             pa.array(batch['host_location'], pa.string()), pa.array(batch['host_response_rate'], pa.float64())],
+            names=['id', 'name', 'location', 'response_rate']),
+        'city': pa.StructArray.from_arrays(
+            [pa.array(batch['city_name'], pa.string()), pa.array(batch['city_country'], pa.string())],
+            names=['name', 'country']),
+        'price': pa.array(batch['price'], pa.float64()),
+        'bedrooms': pa.array(batch['bedrooms'], pa.int64()),
+        'property_type': pa.array(batch['property_type'], pa.string()),
+        'room_type': pa.array(batch['room_type'], pa.string()),
+        'amenities': pa.array(batch['amenities'], pa.list_(pa.string())),
+    })
+
+
+def batch_to_csv(batch, rng, pools, header=True):
+    """
+    Converts a columnar batch into semicolon-delimited rows of the Airbnb listings CSV read by main.py.
+    The columns that only exist in the CSV (scrape, host and review dates, neighbourhoods, coordinates, review
+    scores, descriptions) are drawn from `rng`; the columns no script uses are left empty.
+    """
+    import pandas as pd
+
+    n = len(batch['id'])
+    scrape_date = np.datetime64(csv_scrape_date)
+
+    def pick(pool, size=n):
+        return pools[pool][rng.integers(0, len(pools[pool]), size=size)]
+
+    def days_before(low, high):
+        return np.datetime_as_string(scrape_date - rng.integers(low, high, size=n).astype('timedelta64[D]'))
+
+    city_index = rng.integers(0, csv_city_count, size=n)
+    neighbourhood_index = (csv_city_count + city_index * csv_neighbourhoods_per_city +
+                           rng.integers(0, csv_neighbourhoods_per_city, size=n))
+    latitude = np.round(pools['latitude'][city_index] + rng.normal(0, 0.05, size=n), 6)
+    longitude = np.round(pools['longitude'][city_index] + rng.normal(0, 0.05, size=n), 6)
+    reviews = rng.geometric(0.05, size=n) - 1
+    reviewed = reviews > 0
+
+    columns = {name: None for name in CSV_COLUMN_TYPES}
+    columns.update({
+        'ID': batch['id'],
+        'Scrape ID': csv_scrape_id,
+        'Last Scraped': csv_scrape_date,
+        'Name': pick('sentence'),
+        'Summary': pick('sentence'),
+        'Description': [' '.join(sentences) for sentences in pick('sentence', (n, 3))],
+        'Neighborhood Overview': pick('sentence'),
+        'Transit': pick('sentence'),
+        'Host ID': rng.integers(1, 10 ** 7, size=n),
+        'Host Name': batch['host_name'],
+        'Host Since': days_before(30, 3000),
+        'Host Response Rate': [f"{int(rate * 100)}%" for rate in batch['host_response_rate']],
+        'Neighbourhood': pools['city'][neighbourhood_index],
+        'Neighbourhood Cleansed': pools['city'][neighbourhood_index],
+        'City': pools['city'][city_index],
+        'Country': pools['country'][city_index],
+        'Latitude': latitude,
+        'Longitude': longitude,
+        'Property Type': batch['property_type'],
+        'Room Type': batch['room_type'],
+        'Accommodates': batch['bedrooms'] * 2,
+        'Bedrooms': batch['bedrooms'],
+        'Beds': batch['bedrooms'],
+        'Amenities': [','.join(amenities) for amenities in batch['amenities']],
+        'Price': batch['price'],
+        'Number of Reviews': reviews,
+        'First Review': np.where(reviewed, days_before(365, 3000), None),
+        'Last Review': np.where(reviewed, days_before(0, 365), None),
+        'Review Scores Rating': np.where(reviewed, rng.integers(60, 101, size=n), None),
+        'Review Scores Cleanliness': np.where(reviewed, rng.integers(4, 11, size=n), None),
+        'Review Scores Location': np.where(reviewed, rng.integers(4, 11, size=n), None),
+        'Cancellation Policy': np.array(['flexible', 'moderate', 'strict'], dtype=object)[rng.integers(0, 3, size=n)],
+        'Geolocation': [f"{lat},{lon}" for lat, lon in zip(latitude, longitude)],
+    })
+    return pd.DataFrame(columns).to_csv(sep=';', index=False, header=header)
+
+
+def write_vectorized(path, output_format, seed, target_size=None, rows=None, progress=True):
+    """
+    Generates listings with the vectorized batch generator and writes them to `path` as a JSON array,
+    NDJSON, Parquet (one row group per batch) or the semicolon-delimited listings CSV read by main.py. Stops after `rows` listings or `target_size` bytes.
+    Returns the number of listings, the number of bytes written and the first `sample_size` listings.
+    """
+    rng = np.random.default_rng(seed)
+    pools = build_pools(seed)
+    count = 0
+    bytes_written = 0
+    sample = []
+    first = True
+
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = None
+    else:
+        f = open(path, 'w', newline='')
+        if output_format == 'json':
+            bytes_written += f.write('[')
+
+    while (rows is None or count < rows) and (rows is not None or bytes_written < target_size):
+        if rows is not None:
+            current_batch = min(vectorized_batch_size, rows - count)
+        elif count == 0:
+            current_batch = vectorized_probe_size
+        else:
+            # Size the batch from the bytes per listing so far, so small targets are not overshot by a whole batch
+            current_batch = max(1, min(vectorized_batch_size,
+                                       int((target_size - bytes_written) / (bytes_written / count)) + 1))
+        batch = generate_listing_batch(rng, current_batch, pools)
+        if len(sample) < sample_size:
+            sample.extend(batch_to_listings({name: values[:sample_size - len(sample)]
+                                             for name, values in batch.items()}))
+
+        if output_format == 'parquet':
+            table = batch_to_arrow(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            bytes_written = os.path.getsize(path)
+        elif output_format == 'csv':
+            bytes_written += f.write(batch_to_csv(batch, rng, pools, header=first))
+        else:
+            listings = batch_to_listings(batch)
+            if output_format == 'json':
+                chunk = ', '.join(json.dumps(listing) for listing in listings)
+                bytes_written += f.write(chunk if first else ', ' + chunk)
+            else:
+                bytes_written += f.write(''.join(json.dumps(listing) + '\n' for listing in listings))
+        first = False
+
+        count += current_batch
+        if progress:
+            print(f"Generated {count} listings. Current size: {bytes_written / (1024 * 1024):.2f} MB")
+
+    if output_format == 'parquet':
+        if writer is not None:
+            writer.close()
+        bytes_written = os.path.getsize(path)
+    else:
+        if output_format == 'json':
+            bytes_written += f.write(']')
+        f.close()
+    return count, bytes_written, sample
+
+
+def compare_generators(rows=20000, seed=0):
+    """
+    Prints the rows/sec of the per-row generator and of the vectorized batch generator.
+    """
+    start = time.perf_counter()
+    for _ in range(rows):
+        generate_airbnb_listing()
+    per_row_rate = rows / (time.perf_counter() - start)
+
+    rng = np.random.default_rng(seed)
+    pools = build_pools(seed)
+    start = time.perf_counter()
+    batch_to_listings(generate_listing_batch(rng, rows, pools))
+    vectorized_rate = rows / (time.perf_counter() - start)
+
+    print(f"Per-row generator:    {per_row_rate:,.0f} rows/sec")
+    print(f"Vectorized generator: {vectorized_rate:,.0f} rows/sec ({vectorized_rate / per_row_rate:.1f}x)")
+
+
+def parse_size(text):
+    """
+    Parses a size such as "70MB", "1.5GB" or "1048576" into a number of bytes.
+    """
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?B?)\s*', text.upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def write_listings(f, output_format, target_size=None, rows=None, progress=True):
+    """
+    Generates listings in batches and writes them to `f` as they are produced, either as one JSON array
+    (`json`, the same layout as json.dump) or as one listing per line (`ndjson`).
+    Generation stops once `rows` listings were written, or once `target_size` bytes were written.
+    Only the current batch and the first `sample_size` listings are kept in memory.
+    Returns the number of listings, the number of bytes written and the sample.
+    """
+    count = 0
+    bytes_written = 0
+    sample = []
+
+    if output_format == 'json':
+        bytes_written += f.write('[')
+
+    while (rows is None or count < rows) and (rows is not None or bytes_written < target_size):
+        current_batch = batch_size if rows is None else min(batch_size, rows - count)
+        new_listings = [generate_airbnb_listing() for _ in range(current_batch)]
+        if len(sample) < sample_size:
+            sample.extend(new_listings[:sample_size - len(sample)])
+
+        # json.dumps escapes non-ASCII characters, so string length equals the number of bytes written
+        if output_format == 'json':
+            chunk = ', '.join(json.dumps(listing) for listing in new_listings)
+            bytes_written += f.write(chunk if count == 0 else ', ' + chunk)
+        else:
+            bytes_written += f.write(''.join(json.dumps(listing) + '\n' for listing in new_listings))
+
+        count += current_batch
+        if progress:
+            print(f"Generated {count} listings. Current size: {bytes_written / (1024 * 1024):.2f} MB")
+
+    if output_format == 'json':
+        bytes_written += f.write(']')
+    return count, bytes_written, sample
+
+
+def shard_file_name(shard, output_format='ndjson'):
+    return f"airbnb_listings-{shard:05d}.{'json' if output_format == 'ndjson' else output_format}"
+
+
+def shard_seed(seed, shard):
+    """
+    Returns the seed of one shard. It only depends on the run seed and the shard index,
+    so the output does not depend on how many workers generate the shards.
+    """
+    return seed * SHARD_SEED_STRIDE + shard
+
+
+def write_shard(task):
+    """
+    Generates one shard file. Runs in a worker process.
+    """
+    shard, seed, output_dir, shard_target_size, shard_rows, output_format, vectorized = task
+    path = os.path.join(output_dir, shard_file_name(shard, output_format))
+    if vectorized:
+        count, bytes_written, sample = write_vectorized(path, output_format, shard_seed(seed, shard),
+                                                        shard_target_size, shard_rows, progress=False)
+        return shard, path, count, bytes_written, sample
+    random.seed(shard_seed(seed, shard))
+    fake.seed_instance(shard_seed(seed, shard))
+    with open(path, 'w') as f:
+        count, bytes_written, sample = write_listings(f, output_format, shard_target_size, shard_rows, progress=False)
+    return shard, path, count, bytes_written, sample
+
+
+def write_shards(output_dir, shards, workers, seed, target_size=None, rows=None, output_format='ndjson',
+                 vectorized=False):
+    """
+    Generates `shards` files (airbnb_listings-00000.json, ...) in `output_dir` using `workers` processes, as
+    NDJSON or, with the vectorized generator, Parquet or CSV. The rows (or the target size) are split evenly
+    across the shards. Spark can read the directory directly.
+    Returns the total number of listings, the total bytes written and the sample of the first shard.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = []
+    for shard in range(shards):
+        shard_rows = None if rows is None else rows // shards + (1 if shard < rows % shards else 0)
+        tasks.append((shard, seed, output_dir, None if target_size is None else target_size / shards, shard_rows,
+                      output_format, vectorized))
+
+    total_count = 0
+    total_bytes = 0
+    samples = {}
+    with multiprocessing.Pool(processes=workers) as pool:
+        for shard, path, count, bytes_written, sample in pool.imap_unordered(write_shard, tasks):
+            total_count += count
+            total_bytes += bytes_written
+            samples[shard] = sample
+            print(f"Wrote {path}: {count} listings, {bytes_written / (1024 * 1024):.2f} MB")
+    return total_count, total_bytes, samples.get(0, [])
+
+
+def display_sample(sample):
+    """
+    Prints the first 5 listings of the sample.
+    """
+    for i, listing in enumerate(sample[:5], 1):
+        print(f"\nListing {i}:")
+        print(f"Name: {listing['name']}")
+        print(f"City: {listing['city']['name']}, {listing['city']['country']}")
+        print(f"Price: ${listing['price']}")
+        print(f"Property Type: {listing['property_type']}")
+        print(f"Bedrooms: {listing['bedrooms']}")
+        print(f"Host: {listing['host']['name']}")
+        print(f"Amenities: {', '.join(listing['amenities'][:3])}...")  # Show first 3 amenities
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate fake Airbnb listings.")
+    parser.add_argument('--target-size', type=parse_size, default=target_size,
+                        help="Approximate size of the generated file, e.g. 70MB or 2GB (default: 70MB)")
+    parser.add_argument('--rows', type=int, help="Number of listings to generate (overrides --target-size)")
+    parser.add_argument('--format', choices=['json', 'ndjson', 'parquet', 'csv'], default='json',
+                        help="A single JSON array, newline-delimited JSON with one listing per line, "
+                             "Parquet or the listings CSV read by main.py (the last two with --vectorized only)")
+    parser.add_argument('--output', help="Output file (default: airbnb_listings.<format>)")
+    parser.add_argument('--seed', type=int, help="Seed for reproducible output")
+    parser.add_argument('--shards', type=int,
+                        help="Write this many shard files into --output-dir instead of a single file "
+                             "(NDJSON with --format json or ndjson)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Number of processes generating shards (does not change the output)")
+    parser.add_argument('--output-dir', default='airbnb_listings', help="Directory of the shard files")
+    parser.add_argument('--vectorized', action='store_true',
+                        help="Generate listings in NumPy batches, drawing Faker fields from pre-generated pools")
+    parser.add_argument('--compare', action='store_true',
+                        help="Only compare the rows/sec of the per-row and vectorized generators")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_generators()
+        return
+    if args.format in ('parquet', 'csv') and not args.vectorized:
+        parser.error(f"--format {args.format} requires --vectorized")
+
+    print("Starting script...")
+
+    print("Generating listings...")
+
+    if args.shards:
+        # Every shard is seeded from the run seed, so the same seed always gives the same files
+        seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+        print(f"Generating {args.shards} shards with {args.workers} workers (seed {seed})")
+        # Shards are read as a directory, so JSON shards are newline-delimited rather than one array each
+        shard_format = 'ndjson' if args.format == 'json' else args.format
+        count, bytes_written, sample = write_shards(args.output_dir, args.shards, args.workers, seed,
+                                                    args.target_size, args.rows, shard_format, args.vectorized)
+        print(f"Saved full dataset to {args.output_dir}/ ({bytes_written / (1024 * 1024):.2f} MB)")
+    else:
+        if args.seed is not None:
+            random.seed(args.seed)
+            Faker.seed(args.seed)
+
+        output = args.output or f"airbnb_listings.{args.format}"
+
+        # Stream the full dataset to disk
+        start = time.perf_counter()
+        if args.vectorized:
+            seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+            count, bytes_written, sample = write_vectorized(output, args.format, seed, args.target_size, args.rows)
+        else:
+            with open(output, 'w') as f:
+                count, bytes_written, sample = write_listings(f, args.format, args.target_size, args.rows)
+        print(f"Generated {count / (time.perf_counter() - start):,.0f} rows/sec")
 
-while current_size < target_size:
-    new_listings = [generate_airbnb_listing() for _ in range(batch_size)]
-    listings.extend(new_listings)
-    current_size = len(json.dumps(listings).encode('utf-8'))
-    print(f"Generated {len(listings)} listings. Current size: {current_size / (1024 * 1024):.2f} MB")
+        print(f"Saved full dataset to {output} ({bytes_written / (1024 * 1024):.2f} MB)")
 
-print("Saving full dataset...")
+    print(f"Saving sample of {sample_size} records...")
 
-# Save full dataset
-with open('airbnb_listings.json', 'w') as f:
-    json.dump(listings, f)
+    # Save sample of 50 records
+    with open('airbnb_listings_sample.json', 'w') as f:
+        json.dump(sample, f, indent=2)
 
-print("Saving sample of 50 records...")
+    print(f"Generated {count} listings")
 
-# Save sample of 50 records
-with open('airbnb_listings_sample.json', 'w') as f:
-    json.dump(listings[:50], f, indent=2)
+    print("\nDisplaying sample data:")
 
-print(f"Generated {len(listings)} listings")
+    # Display the first 5 records from the sample
+    display_sample(sample)
 
-print("\nDisplaying sample data:")
+    print("\n... (remaining listings truncated)")
 
-# Display the first 5 records from the sample
-for i, listing in enumerate(listings[:5], 1):
-    print(f"\nListing {i}:")
-    print(f"Name: {listing['name']}")
-    print(f"City: {listing['city']['name']}, {listing['city']['country']}")
-    print(f"Price: ${listing['price']}")
-    print(f"Property Type: {listing['property_type']}")
-    print(f"Bedrooms: {listing['bedrooms']}")
-    print(f"Host: {listing['host']['name']}")
-    print(f"Amenities: {', '.join(listing['amenities'][:3])}...")  # Show first 3 amenities
+    print("Script completed.")
 
-print("\n... (remaining listings truncated)")
 
-print("Script completed.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
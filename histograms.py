@@ -0,0 +1,111 @@
+import time
+
+# Resolution levels of the pyramid: level L has 2**L bins per axis. The finest level is binned from the
+# listings; every coarser level merges 2x2 bins of the level below.
+MIN_LEVEL = 3
+MAX_LEVEL = 7
+
+# Columns the histograms are also split by (besides the overall histogram)
+HISTOGRAM_SPLITS = ['City', 'Property Type']
+
+# Tables exported to the dashboard database
+HISTOGRAM_TABLES = ['price_review_histogram', 'price_review_axes']
+
+# Step 1: Listings on the log scales of both axes
+PRICE_REVIEW_POINTS_SQL = """
+    CREATE OR REPLACE TABLE price_review_points AS
+    SELECT
+        {split_columns},
+        Price,
+        ln(Price) AS log_price,
+        ln(1 + "Number of Reviews") AS log_reviews
+    FROM {source}
+    WHERE Price > 0
+    AND "Number of Reviews" >= 0
+"""
+
+# Step 2: Axis bounds, needed to turn bin numbers back into prices and review counts
+PRICE_REVIEW_AXES_SQL = """
+    SELECT
+        MIN(log_price) AS log_price_min,
+        GREATEST(MAX(log_price), MIN(log_price) + 1e-9) AS log_price_max,
+        0.0 AS log_reviews_min,
+        GREATEST(MAX(log_reviews), 1e-9) AS log_reviews_max,
+        {min_level} AS min_level,
+        {max_level} AS max_level
+    FROM price_review_points
+"""
+
+# Step 3: Finest level, overall and per split value, in one GROUPING SETS pass
+FINEST_BINS_SQL = """
+    CREATE OR REPLACE TABLE price_review_finest AS
+    WITH binned AS (
+        SELECT
+            p.*,
+            LEAST(CAST(FLOOR((p.log_price - a.log_price_min) / (a.log_price_max - a.log_price_min) * {bins})
+                       AS INTEGER), {bins} - 1) AS price_bin,
+            LEAST(CAST(FLOOR(p.log_reviews / a.log_reviews_max * {bins}) AS INTEGER), {bins} - 1) AS review_bin
+        FROM price_review_points p
+        CROSS JOIN result_price_review_axes a
+    )
+    SELECT
+        CASE {split_cases} ELSE 'all' END AS split,
+        COALESCE({split_values}) AS split_value,
+        price_bin,
+        review_bin,
+        COUNT(*) AS listings,
+        SUM(Price) AS price_sum
+    FROM binned
+    GROUP BY GROUPING SETS ({grouping_sets})
+"""
+
+# Step 4: Every level of the pyramid, merging the finest bins
+PRICE_REVIEW_HISTOGRAM_SQL = """
+    SELECT
+        l.level,
+        f.split,
+        f.split_value,
+        f.price_bin >> ({max_level} - l.level) AS price_bin,
+        f.review_bin >> ({max_level} - l.level) AS review_bin,
+        SUM(f.listings) AS listings,
+        SUM(f.price_sum) / SUM(f.listings) AS average_price
+    FROM price_review_finest f
+    CROSS JOIN (SELECT UNNEST(range({min_level}, {max_level} + 1)) AS level) l
+    WHERE f.split_value IS NOT NULL OR f.split = 'all'
+    GROUP BY ALL
+    ORDER BY l.level, f.split, f.split_value, price_bin, review_bin
+"""
+
+
+def histogram_build_sql():
+    """
+    Returns the SQL text of every histogram step, used as the result cache key of the histogram tables.
+    """
+    return '\n'.join([PRICE_REVIEW_POINTS_SQL, PRICE_REVIEW_AXES_SQL, FINEST_BINS_SQL, PRICE_REVIEW_HISTOGRAM_SQL,
+                      f"-- levels={MIN_LEVEL}..{MAX_LEVEL} splits={HISTOGRAM_SPLITS}"])
+
+
+def build_price_review_histograms(con, source='airbnb_listings'):
+    """
+    Bins the listings by log price and log review count at every level of the pyramid, overall and split by
+    each HISTOGRAM_SPLITS column, and stores the bins and the axis bounds as DuckDB tables
+    (result_price_review_histogram and result_price_review_axes).
+    """
+    start = time.perf_counter()
+    split_columns = ', '.join(f'"{column}"' for column in HISTOGRAM_SPLITS)
+    con.execute(PRICE_REVIEW_POINTS_SQL.format(split_columns=split_columns, source=source))
+    con.execute("CREATE OR REPLACE TABLE result_price_review_axes AS " +
+                PRICE_REVIEW_AXES_SQL.format(min_level=MIN_LEVEL, max_level=MAX_LEVEL))
+
+    split_cases = ' '.join(f"WHEN GROUPING(\"{column}\") = 0 THEN '{column}'" for column in HISTOGRAM_SPLITS)
+    split_values = ', '.join(f'CAST("{column}" AS VARCHAR)' for column in HISTOGRAM_SPLITS) + ', NULL'
+    grouping_sets = ', '.join(['(price_bin, review_bin)'] +
+                              [f'("{column}", price_bin, review_bin)' for column in HISTOGRAM_SPLITS])
+    con.execute(FINEST_BINS_SQL.format(bins=2 ** MAX_LEVEL, split_cases=split_cases, split_values=split_values,
+                                       grouping_sets=grouping_sets))
+    con.execute("CREATE OR REPLACE TABLE result_price_review_histogram AS " +
+                PRICE_REVIEW_HISTOGRAM_SQL.format(min_level=MIN_LEVEL, max_level=MAX_LEVEL))
+    print(f"Built price/review histogram pyramid (levels {MIN_LEVEL}-{MAX_LEVEL}) "
+          f"in {time.perf_counter() - start:.2f}s")
+    return {table_name: con.execute(f"SELECT COUNT(*) FROM result_{table_name}").fetchone()[0]
+            for table_name in HISTOGRAM_TABLES}
@@ -0,0 +1,358 @@
+import sqlite3
+import time
+
+import duckdb
+
+from amenities import AMENITY_TABLES, amenity_build_sql, build_amenity_dimension
+from cube import cube_state_source, init_cube_state, merge_cube_state
+from histograms import HISTOGRAM_TABLES, build_price_review_histograms, histogram_build_sql
+from sketches import LISTING_SKETCHES_SQL, init_sketch_state, merge_sketch_state, register_sketch_functions
+from query_cache import forget_results
+from snapshots import publishing
+from spatial import SPATIAL_TABLES, build_listing_tiles, spatial_build_sql
+from sqlite_export import export_tables
+from text_search import SEARCH_TEXT_COLUMNS, init_search_state, search_state_sources, update_search_state
+from staging import CSV_COLUMN_TYPES, csv_source_sql, referenced_columns
+
+# Persistent DuckDB file holding the per-listing contributions and per-group partial aggregates
+state_db_name = 'airbnb_incremental.duckdb'
+
+# Columns of a listing that contribute to the incremental aggregates and the rebuilt tables (and its text, so
+# a search index created after the listing was ingested can be seeded from the state)
+STATE_COLUMNS = [
+    'ID', 'Scrape ID', 'Last Scraped', 'City', 'Neighbourhood', 'Property Type', 'Amenities', 'Price',
+    'Bedrooms', 'Number of Reviews', 'Review Scores Rating', 'Review Scores Cleanliness', 'Review Scores Location',
+    'Host ID', 'Room Type', 'Cancellation Policy', 'Latitude', 'Longitude'
+] + SEARCH_TEXT_COLUMNS
+
+# Dashboard tables that cannot be merged from partial state; every refresh rebuilds them from the stored listings
+REBUILT_TABLES = AMENITY_TABLES + HISTOGRAM_TABLES + SPATIAL_TABLES
+
+
+def count_of(column):
+    return f'CASE WHEN "{column}" IS NOT NULL THEN 1 ELSE 0 END'
+
+
+# Every measure is a SUM of an expression, so partial state can be merged (and retracted) by adding signed deltas.
+# The `where` filters and final SELECTs mirror the queries in main.py with the same `query_name`; `sql_hash` is
+# the query_cache.sql_hash() of the query text they mirror, so an edited query is not answered from the aggregate.
+MERGEABLE_AGGREGATES = [
+    {
+        'table': 'query_1',
+        'query_name': 'average_price_listings_by_city',
+        'sql_hash': '97f78099c91d86723466cfa44a8b3232563f3518c28a81af95d8020047de67ba',
+        'group_by': ['City'],
+        'where': """Price IS NOT NULL
+            AND "Number of Reviews" IS NOT NULL
+            AND City IS NOT NULL
+            AND City ~ '^[A-Za-z\\s]+$'""",
+        'measures': {'price_sum': 'Price', 'listings': '1'},
+        'final': """
+            SELECT City, price_sum / listings AS Average_Price, CAST(listings AS BIGINT) AS Number_of_Listings
+            FROM {state}
+            WHERE listings >= 100
+            ORDER BY Average_Price DESC
+            LIMIT 20
+        """,
+    },
+    {
+        'table': 'query_2',
+        'query_name': 'listings_avg_price_by_amenities',
+        'sql_hash': '86b90b8fcc24d9df501e753291365984f4090430828e4f3b26d01837d2bc9113',
+        'group_by': ['Amenities'],
+        'where': "Amenities IS NOT NULL AND Price IS NOT NULL",
+        'measures': {'price_sum': 'Price', 'listings': '1'},
+        'final': """
+            SELECT Amenities, CAST(listings AS BIGINT) AS Number_of_Listings, price_sum / listings AS Average_Price
+            FROM {state}
+            ORDER BY Number_of_Listings DESC
+        """,
+    },
+    {
+        'table': 'query_3',
+        'query_name': 'avg_review_scores_by_property_type',
+        'sql_hash': 'b0456be4b2382cf6a28d88ffe45ee379b76e1ad97aea8c0aca72cb60926ae976',
+        'group_by': ['Property Type'],
+        'where': '"Review Scores Rating" IS NOT NULL',
+        'measures': {
+            'rating_sum': '"Review Scores Rating"',
+            'rating_count': '1',
+            'cleanliness_sum': '"Review Scores Cleanliness"',
+            'cleanliness_count': count_of('Review Scores Cleanliness'),
+            'location_sum': '"Review Scores Location"',
+            'location_count': count_of('Review Scores Location'),
+        },
+        'final': """
+            SELECT
+                "Property Type",
+                rating_sum / rating_count AS Average_Review_Score,
+                cleanliness_sum / NULLIF(cleanliness_count, 0) * 10 AS Average_Cleanliness_Score,
+                location_sum / NULLIF(location_count, 0) * 10 AS Average_Location_Score
+            FROM {state}
+            ORDER BY Average_Review_Score DESC
+        """,
+    },
+    {
+        'table': 'query_4',
+        'query_name': 'total_reviews_avg_review_score_by_neighborhood',
+        'sql_hash': 'ea5beed374bab022429fd0a8eb5c9aa04c22d96113c9b11320a5db128b420663',
+        'group_by': ['Neighbourhood'],
+        'where': '"Number of Reviews" IS NOT NULL',
+        'measures': {
+            'reviews_sum': '"Number of Reviews"',
+            'rating_sum': '"Review Scores Rating"',
+            'rating_count': count_of('Review Scores Rating'),
+        },
+        'final': """
+            SELECT
+                "Neighbourhood",
+                CAST(reviews_sum AS BIGINT) AS Total_Reviews,
+                rating_sum / NULLIF(rating_count, 0) AS Average_Review_Score
+            FROM {state}
+            ORDER BY Total_Reviews DESC
+        """,
+    },
+    {
+        'table': 'query_5',
+        'query_name': 'property_types_highest_avg_price_bedrooms',
+        'sql_hash': 'e4494e76a66cd2541961f4a432eba269968c191306eb953c190188ad1b8ccd7c',
+        'group_by': ['Property Type'],
+        'where': 'Price IS NOT NULL',
+        'measures': {
+            'price_sum': 'Price',
+            'listings': '1',
+            'bedrooms_sum': 'Bedrooms',
+            'bedrooms_count': count_of('Bedrooms'),
+        },
+        'final': """
+            SELECT
+                "Property Type",
+                price_sum / listings AS Average_Price,
+                bedrooms_sum / NULLIF(bedrooms_count, 0) AS Average_Bedrooms
+            FROM {state}
+            ORDER BY Average_Price DESC, Average_Bedrooms DESC
+        """,
+    },
+    {
+        'table': 'query_6',
+        'query_name': 'relationship_price_reviews_excluding_null',
+        'sql_hash': '4a39f397a65f06612adfc4e536cb90355f89204738cbd8118c4ab82f8ad45b5e',
+        'group_by': ['Price', 'Number of Reviews'],
+        'where': 'Price IS NOT NULL AND "Number of Reviews" IS NOT NULL',
+        'measures': {'Listings': '1'},
+        'final': """
+            SELECT Price, "Number of Reviews", CAST(Listings AS BIGINT) AS Listings
+            FROM {state}
+            ORDER BY Price DESC, "Number of Reviews" DESC
+        """,
+    },
+]
+
+
+def quoted(columns):
+    return ', '.join(f'"{column}"' for column in columns)
+
+
+def init_state(con):
+    """
+    Creates the state tables on first use.
+    """
+    listing_columns = ', '.join(f'"{column}" {CSV_COLUMN_TYPES[column]}' for column in STATE_COLUMNS)
+    con.execute(f"CREATE TABLE IF NOT EXISTS listing_state ({listing_columns})")
+    # States created before a column was tracked get it added (empty for the listings already ingested)
+    for column in STATE_COLUMNS:
+        con.execute(f'ALTER TABLE listing_state ADD COLUMN IF NOT EXISTS "{column}" {CSV_COLUMN_TYPES[column]}')
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS ingested_batches (
+            scrape_id VARCHAR,
+            last_scraped DATE,
+            rows BIGINT,
+            ingested_at TIMESTAMP
+        )
+    """)
+    for aggregate in MERGEABLE_AGGREGATES:
+        group_columns = ', '.join(f'"{column}" {CSV_COLUMN_TYPES[column]}' for column in aggregate['group_by'])
+        measure_columns = ', '.join(f'{name} DOUBLE' for name in aggregate['measures'])
+        con.execute(f"""
+            CREATE TABLE IF NOT EXISTS {aggregate['table']}_state (
+                {group_columns}, {measure_columns}, contributing_rows BIGINT
+            )
+        """)
+    init_sketch_state(con)
+    init_search_state(con)
+    init_cube_state(con)
+
+
+def signed_partials_sql(aggregate, source, sign):
+    """
+    Returns a SELECT computing the partial aggregates of `source`, multiplied by `sign` (+1 to add, -1 to retract).
+    """
+    group_by = quoted(aggregate['group_by'])
+    measures = ', '.join(f"{sign} * COALESCE(SUM(CAST({expression} AS DOUBLE)), 0) AS {name}"
+                         for name, expression in aggregate['measures'].items())
+    return f"""
+        SELECT {group_by}, {measures}, {sign} * COUNT(*) AS contributing_rows
+        FROM {source}
+        WHERE {aggregate['where']}
+        GROUP BY {group_by}
+    """
+
+
+def merge_partials(con, aggregate):
+    """
+    Adds the partials of the incoming rows to the group state and subtracts those of the retracted rows.
+    Groups left without contributing rows are dropped.
+    """
+    state = f"{aggregate['table']}_state"
+    group_by = quoted(aggregate['group_by'])
+    measures = ', '.join(f"SUM({name}) AS {name}" for name in aggregate['measures'])
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE merged AS
+        SELECT {group_by}, {measures}, SUM(contributing_rows) AS contributing_rows
+        FROM (
+            SELECT * FROM {state}
+            UNION ALL BY NAME
+            {signed_partials_sql(aggregate, 'incoming', 1)}
+            UNION ALL BY NAME
+            {signed_partials_sql(aggregate, 'retracted', -1)}
+        )
+        GROUP BY {group_by}
+        HAVING SUM(contributing_rows) > 0
+    """)
+    con.execute(f"DELETE FROM {state}")
+    con.execute(f"INSERT INTO {state} BY NAME SELECT * FROM merged")
+
+
+def build_rebuilt_tables(con):
+    """
+    Rebuilds the REBUILT_TABLES from the stored listings on a new in-memory DuckDB connection, so their
+    intermediate tables stay out of the state database. Returns that connection; the results are in its
+    result_<table> tables.
+    """
+    columns = [column for column in referenced_columns([amenity_build_sql(), histogram_build_sql(),
+                                                         spatial_build_sql()]) if column in STATE_COLUMNS]
+    rebuilt = duckdb.connect()
+    rebuilt.register('stored_listings_batches',
+                     con.execute(f"SELECT {quoted(columns)} FROM listing_state").fetch_record_batch())
+    rebuilt.execute("CREATE TABLE stored_listings AS SELECT * FROM stored_listings_batches")
+    rebuilt.unregister('stored_listings_batches')
+    build_amenity_dimension(rebuilt, 'stored_listings')
+    build_price_review_histograms(rebuilt, 'stored_listings')
+    build_listing_tiles(rebuilt, 'stored_listings')
+    return rebuilt
+
+
+def ingest_incremental(csv_file_name, sqlite_path, state_path=state_db_name, snapshot=False):
+    """
+    Folds the new scrape batches of a listings dump into the persistent aggregate state and refreshes the
+    query_N tables in SQLite from that state, without rescanning previously ingested listings (only the
+    REBUILT_TABLES are recomputed from all the stored listings). The tables
+    are written to a new snapshot of `sqlite_path`, published only when there was something to ingest.
+
+    A batch is a (Scrape ID, Last Scraped) pair; batches that were already ingested are skipped. A listing
+    (keyed on ID) that shows up again replaces its previous version, whose contribution is retracted first.
+    With `snapshot=True` the dump is treated as the complete set of active listings and listings missing
+    from it are retracted as removed.
+    """
+    start = time.perf_counter()
+    con = duckdb.connect(state_path)
+    init_state(con)
+
+    con.begin()
+
+    # Step 1: Read only the columns that contribute to the aggregates and the search index
+    con.execute(f"""
+        CREATE TEMP TABLE dump AS
+        SELECT {quoted(STATE_COLUMNS)} FROM {csv_source_sql()}
+    """, [csv_file_name])
+
+    # Step 2: Keep the rows of batches that were not ingested yet, latest version per listing
+    con.execute("""
+        CREATE TEMP TABLE new_batches AS
+        SELECT "Scrape ID" AS scrape_id, "Last Scraped" AS last_scraped, COUNT(*) AS rows
+        FROM dump d
+        ANTI JOIN ingested_batches b
+            ON d."Scrape ID" IS NOT DISTINCT FROM b.scrape_id
+            AND d."Last Scraped" IS NOT DISTINCT FROM b.last_scraped
+        GROUP BY ALL
+    """)
+    con.execute("""
+        CREATE TEMP TABLE incoming AS
+        SELECT d.*
+        FROM dump d
+        SEMI JOIN new_batches b
+            ON d."Scrape ID" IS NOT DISTINCT FROM b.scrape_id
+            AND d."Last Scraped" IS NOT DISTINCT FROM b.last_scraped
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY d.ID ORDER BY d."Last Scraped" DESC NULLS LAST, d."Scrape ID" DESC) = 1
+    """)
+
+    # Rows older than the version we already hold are stale
+    con.execute("""
+        DELETE FROM incoming
+        USING listing_state s
+        WHERE incoming.ID = s.ID AND s."Last Scraped" > incoming."Last Scraped"
+    """)
+
+    # Step 3: Collect the stored versions that get replaced (and removed listings in snapshot mode)
+    removed_condition = "OR NOT EXISTS (SELECT 1 FROM dump d WHERE d.ID = s.ID)" if snapshot else ""
+    con.execute(f"""
+        CREATE TEMP TABLE retracted AS
+        SELECT * FROM listing_state s
+        WHERE EXISTS (SELECT 1 FROM incoming i WHERE i.ID = s.ID) {removed_condition}
+    """)
+
+    incoming_rows = con.execute("SELECT COUNT(*) FROM incoming").fetchone()[0]
+    retracted_rows = con.execute("SELECT COUNT(*) FROM retracted").fetchone()[0]
+    batches = con.execute("SELECT COUNT(*) FROM new_batches").fetchone()[0]
+
+    if incoming_rows == 0 and retracted_rows == 0:
+        con.execute("INSERT INTO ingested_batches SELECT *, now() FROM new_batches")
+        con.commit()
+        con.close()
+        print("No new scrape batches to ingest.")
+        return {'batches': batches, 'incoming_rows': 0, 'retracted_rows': 0}
+
+    # Step 4: Merge the signed partial aggregates into the group state
+    for aggregate in MERGEABLE_AGGREGATES:
+        merge_partials(con, aggregate)
+    merge_sketch_state(con, 'incoming', 'retracted')
+    update_search_state(con, 'incoming', 'retracted')
+    merge_cube_state(con, 'incoming', 'retracted')
+
+    # Step 5: Replace the stored listing versions and record the ingested batches
+    con.execute("DELETE FROM listing_state WHERE ID IN (SELECT ID FROM retracted)")
+    con.execute(f"INSERT INTO listing_state BY NAME SELECT {quoted(STATE_COLUMNS)} FROM incoming")
+    con.execute("INSERT INTO ingested_batches SELECT *, now() FROM new_batches")
+
+    print(f"Ingested {batches} new batch(es): {incoming_rows} listings added or updated, "
+          f"{retracted_rows} previous versions retracted")
+
+    # Step 6: Refresh the query tables from the merged state, and rebuild the tables that cannot be merged.
+    # The state is only committed once they are exported and published: after a failure the batches are
+    # rolled back and ingested again by the next run.
+    try:
+        with publishing(sqlite_path, 'main.py --incremental') as snapshot_path:
+            sqlite_conn = sqlite3.connect(snapshot_path)
+            register_sketch_functions(con)
+            sources = [(f"({aggregate['final'].format(state=aggregate['table'] + '_state')})", aggregate['table'])
+                       for aggregate in MERGEABLE_AGGREGATES]
+            sources.append((f"({LISTING_SKETCHES_SQL.format(state='sketch_state')})", 'listing_sketches'))
+            sources += search_state_sources()
+            sources.append(cube_state_source())
+            export_tables(con, sources, sqlite_conn)
+            rebuilt = build_rebuilt_tables(con)
+            export_tables(rebuilt, [(f"result_{table_name}", table_name) for table_name in REBUILT_TABLES],
+                          sqlite_conn)
+            rebuilt.close()
+            # The refreshed tables no longer match their cached SQL and source fingerprint
+            forget_results(sqlite_conn, [table_name for _, table_name in sources] + REBUILT_TABLES)
+            sqlite_conn.close()
+    except BaseException:
+        con.rollback()
+        con.close()
+        raise
+    con.commit()
+    con.close()
+
+    print(f"Incremental refresh completed in {time.perf_counter() - start:.2f}s")
+    return {'batches': batches, 'incoming_rows': incoming_rows, 'retracted_rows': retracted_rows}
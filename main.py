@@ -1,114 +1,72 @@
+import argparse
 import duckdb
-import pandas as pd
+import os
 import sqlite3
+from staging import csv_source_sql, csv_fingerprint, stage_listings, create_listings_view, referenced_columns
+from incremental import ingest_incremental, state_db_name
+from query_engine import run_queries, print_timings, result_table
+from sqlite_export import export_tables
+from query_cache import cache_entries, stale_tables, record_results, print_cache_report
+from amenities import AMENITY_TABLES, amenity_build_sql, build_amenity_dimension
+from histograms import HISTOGRAM_TABLES, histogram_build_sql, build_price_review_histograms
+from spatial import SPATIAL_TABLES, spatial_build_sql, build_listing_tiles
+from sketches import SKETCH_TABLES, sketch_build_sql, build_listing_sketches
+from text_search import SEARCH_TABLES, search_build_sql, build_search_index
+from cube import CUBE_TABLES, cube_build_sql, build_listing_cube
+from run_log import RUN_LOG_DB, RunLog, duckdb_profile, max_rss_so_far
+from snapshots import open_published, publishing
 
 # Define the name of our CSV file
 csv_file_name = 'airbnb-listings.csv'
 
-# Connect to DuckDB
-con = duckdb.connect()
-
-# Create the table and load data from the CSV file
-con.execute("""
-    CREATE TABLE airbnb_listings AS 
-    SELECT * FROM read_csv_auto(?, 
-        types={
-            'ID': 'VARCHAR',
-            'Listing Url': 'VARCHAR',
-            'Scrape ID': 'VARCHAR',
-            'Last Scraped': 'DATE',
-            'Name': 'VARCHAR',
-            'Summary': 'VARCHAR',
-            'Space': 'VARCHAR',
-            'Description': 'VARCHAR',
-            'Experiences Offered': 'VARCHAR',
-            'Neighborhood Overview': 'VARCHAR',
-            'Notes': 'VARCHAR',
-            'Transit': 'VARCHAR',
-            'Access': 'VARCHAR',
-            'Interaction': 'VARCHAR',
-            'House Rules': 'VARCHAR',
-            'Thumbnail Url': 'VARCHAR',
-            'Medium Url': 'VARCHAR',
-            'Picture Url': 'VARCHAR',
-            'XL Picture Url': 'VARCHAR',
-            'Host ID': 'VARCHAR',
-            'Host URL': 'VARCHAR',
-            'Host Name': 'VARCHAR',
-            'Host Since': 'DATE',
-            'Host Location': 'VARCHAR',
-            'Host About': 'VARCHAR',
-            'Host Response Time': 'VARCHAR',
-            'Host Response Rate': 'VARCHAR',
-            'Host Acceptance Rate': 'VARCHAR',
-            'Host Thumbnail Url': 'VARCHAR',
-            'Host Picture Url': 'VARCHAR',
-            'Host Neighbourhood': 'VARCHAR',
-            'Host Listings Count': 'INTEGER',
-            'Host Total Listings Count': 'INTEGER',
-            'Host Verifications': 'VARCHAR',
-            'Street': 'VARCHAR',
-            'Neighbourhood': 'VARCHAR',
-            'Neighbourhood Cleansed': 'VARCHAR',
-            'Neighbourhood Group Cleansed': 'VARCHAR',
-            'City': 'VARCHAR',
-            'State': 'VARCHAR',
-            'Zipcode': 'VARCHAR',
-            'Market': 'VARCHAR',
-            'Smart Location': 'VARCHAR',
-            'Country Code': 'VARCHAR',
-            'Country': 'VARCHAR',
-            'Latitude': 'FLOAT',
-            'Longitude': 'FLOAT',
-            'Property Type': 'VARCHAR',
-            'Room Type': 'VARCHAR',
-            'Accommodates': 'INTEGER',
-            'Bathrooms': 'FLOAT',
-            'Bedrooms': 'INTEGER',
-            'Beds': 'INTEGER',
-            'Bed Type': 'VARCHAR',
-            'Amenities': 'VARCHAR',
-            'Square Feet': 'FLOAT',
-            'Price': 'FLOAT',
-            'Weekly Price': 'FLOAT',
-            'Monthly Price': 'FLOAT',
-            'Security Deposit': 'FLOAT',
-            'Cleaning Fee': 'FLOAT',
-            'Guests Included': 'INTEGER',
-            'Extra People': 'FLOAT',
-            'Minimum Nights': 'INTEGER',
-            'Maximum Nights': 'INTEGER',
-            'Calendar Updated': 'VARCHAR',
-            'Has Availability': 'VARCHAR',
-            'Availability 30': 'INTEGER',
-            'Availability 60': 'INTEGER',
-            'Availability 90': 'INTEGER',
-            'Availability 365': 'INTEGER',
-            'Calendar last Scraped': 'VARCHAR',
-            'Number of Reviews': 'INTEGER',
-            'First Review': 'DATE',
-            'Last Review': 'DATE',
-            'Review Scores Rating': 'FLOAT',
-            'Review Scores Accuracy': 'FLOAT',
-            'Review Scores Cleanliness': 'FLOAT',
-            'Review Scores Checkin': 'FLOAT',
-            'Review Scores Communication': 'FLOAT',
-            'Review Scores Location': 'FLOAT',
-            'Review Scores Value': 'FLOAT',
-            'License': 'VARCHAR',
-            'Jurisdiction Names': 'VARCHAR',
-            'Cancellation Policy': 'VARCHAR',
-            'Calculated host listings count': 'INTEGER',
-            'Reviews per Month': 'FLOAT',
-            'Geolocation': 'VARCHAR',
-            'Features': 'VARCHAR'
-        }
-    )
-""", [csv_file_name])
+# Directory holding the Parquet copy of the CSV (used with --stage)
+staging_dir = 'airbnb_staging'
+
+# SQLite database read by the dashboard
+sqlite_db_name = 'airbnb_queries.db'
+
+# Out-of-core mode (--out-of-core): DuckDB memory limit, and directory of the on-disk listings table and spill files
+default_memory_limit = '2GB'
+spill_dir = 'airbnb_spill'
+
+
+def out_of_core_connection(memory_limit, spill_dir):
+    """
+    Opens a scratch DuckDB database file in `spill_dir`, so the listings table is stored on disk and only the
+    buffer pool, capped at `memory_limit`, is held in memory. Joins, aggregates and sorts larger than the
+    limit spill to `spill_dir`.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    database_path = os.path.join(spill_dir, 'listings.duckdb')
+    for path in (database_path, f"{database_path}.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+    # Not preserving the CSV row order lets the load stream without buffering (every query has an ORDER BY)
+    return duckdb.connect(database_path, config={'memory_limit': memory_limit, 'temp_directory': spill_dir,
+                                                 'preserve_insertion_order': False})
+
+
+def load_listings(con, csv_file_name, staging_dir=None, columns=None):
+    """
+    Makes the listings available as `airbnb_listings` on the DuckDB connection.
+    Without a staging directory the CSV is parsed into a table, keeping only `columns` when given.
+    With one, the CSV is converted once into partitioned Parquet files and `airbnb_listings` becomes
+    a view over them.
+    """
+    if staging_dir is None:
+        # Create the table and load data from the CSV file
+        select_list = '*' if columns is None else ', '.join(f'"{column}"' for column in columns)
+        con.execute(f"""
+            CREATE TABLE airbnb_listings AS 
+            SELECT {select_list} FROM {csv_source_sql()}
+        """, [csv_file_name])
+    else:
+        stage_listings(con, csv_file_name, staging_dir)
+        create_listings_view(con, staging_dir)
 
 
 # Function to execute DuckDB query and return as pandas DataFrame
-def duckdb_to_pandas(query):
+def duckdb_to_pandas(con, query):
     return con.execute(query).df()
 
 
@@ -208,21 +166,171 @@ queries = [
 
 ]
 
-pd.set_option('display.max_columns', None)
+def main():
+    """
+    Loads the listings, runs every query and saves each result to the SQLite database.
+    """
+    parser = argparse.ArgumentParser(description="Run the Airbnb listing queries and store the results in SQLite.")
+    parser.add_argument('--csv', default=csv_file_name, help="Path of the listings CSV file")
+    parser.add_argument('--stage', action='store_true',
+                        help="Convert the CSV once into partitioned Parquet files and query those instead")
+    parser.add_argument('--staging-dir', default=staging_dir, help="Directory of the staged Parquet files")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fold new Scrape ID/Last Scraped batches into the stored aggregates")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="With --incremental: the CSV holds every active listing, so missing listings are removed")
+    parser.add_argument('--state-db', default=state_db_name, help="DuckDB file holding the incremental state")
+    parser.add_argument('--workers', type=int, default=4, help="Number of queries run concurrently")
+    parser.add_argument('--no-shared-scans', action='store_true',
+                        help="Run every query as its own scan instead of sharing GROUPING SETS scans")
+    parser.add_argument('--invalidate', nargs='*', metavar='TABLE',
+                        help="Recompute the given tables even if cached (all tables when none are given)")
+    parser.add_argument('--out-of-core', action='store_true',
+                        help="Keep the listings in an on-disk DuckDB table under a memory limit, loading only "
+                             "the columns the queries read")
+    parser.add_argument('--memory-limit', default=default_memory_limit,
+                        help="DuckDB memory limit with --out-of-core (default: 2GB)")
+    parser.add_argument('--spill-dir', default=spill_dir,
+                        help="Directory of the on-disk listings table and the spill files with --out-of-core")
+    parser.add_argument('--profile', action='store_true',
+                        help="Also store the EXPLAIN ANALYZE profile of every query in the run log")
+    parser.add_argument('--run-log', default=RUN_LOG_DB, help="SQLite database receiving the stage records")
+    args = parser.parse_args()
+
+    # Wall time, rows in/out and peak memory of every stage are written to the run-log table
+    run_log = RunLog('main.py', args.run_log)
+
+    # Results are written to a new snapshot of the SQLite database, published atomically once complete
+    # (the incremental refresh publishes nothing when no new batch was ingested)
+    if args.incremental:
+        with run_log.stage('ingest_incremental') as stage:
+            stats = ingest_incremental(args.csv, sqlite_db_name, args.state_db, snapshot=args.snapshot)
+            stage['rows_in'] = stats['incoming_rows']
+        run_log.write()
+        return
+
+    # Read the published SQLite database
+    sqlite_conn = open_published(sqlite_db_name)
+
+    # Only the tables whose SQL or input data changed since their last export are recomputed
+    with run_log.stage('cache_check'):
+        source_fingerprint = csv_fingerprint(args.csv)
+        entries = cache_entries(queries)
+        entries += [(table_name, table_name, amenity_build_sql()) for table_name in AMENITY_TABLES]
+        entries += [(table_name, table_name, histogram_build_sql()) for table_name in HISTOGRAM_TABLES]
+        entries += [(table_name, table_name, spatial_build_sql()) for table_name in SPATIAL_TABLES]
+        entries += [(table_name, table_name, sketch_build_sql()) for table_name in SKETCH_TABLES]
+        entries += [(table_name, table_name, search_build_sql()) for table_name in SEARCH_TABLES]
+        entries += [(table_name, table_name, cube_build_sql()) for table_name in CUBE_TABLES]
+        stale = stale_tables(sqlite_conn, entries, source_fingerprint, args.invalidate)
+    sqlite_conn.close()
+    print_cache_report(entries, stale)
+    if args.out_of_core and any(table_name in stale for table_name in SEARCH_TABLES):
+        # The search index would load the free-text columns; the published index is kept until a regular run
+        stale = [table_name for table_name in stale if table_name not in SEARCH_TABLES]
+        print(f"Out-of-core mode: not rebuilding {', '.join(SEARCH_TABLES)} (run without --out-of-core to rebuild them)")
+    if not stale:
+        if args.stage:
+            # Keeps the Parquet copy read by the dashboard's Explore page current (a no-op while it is)
+            stage_listings(duckdb.connect(), args.csv, args.staging_dir)
+        run_log.write()
+        return
+
+    # Connect to DuckDB
+    columns = None
+    if args.out_of_core:
+        con = out_of_core_connection(args.memory_limit, args.spill_dir)
+        # Only the columns named by the stale tables' SQL are loaded
+        columns = referenced_columns([sql for table_name, _, sql in entries if table_name in stale])
+        print(f"Out-of-core mode: memory limit {args.memory_limit}, spilling to {args.spill_dir}, "
+              f"loading {len(columns)} of the CSV columns")
+    else:
+        con = duckdb.connect()
+    with run_log.stage('load_listings') as stage:
+        load_listings(con, args.csv, args.staging_dir if args.stage else None, columns)
+        listing_count = con.execute("SELECT COUNT(*) FROM airbnb_listings").fetchall()[0][0]
+        stage['rows_out'] = listing_count
+
+    # Execute the queries (sharing scans and running them concurrently), then save each result to SQLite
+    with run_log.stage('run_queries', rows_in=listing_count) as stage:
+        results, timings, built_from = run_queries(con, queries, workers=args.workers,
+                                                   share_scans=not args.no_shared_scans, only=stale)
+        stage['rows_out'] = sum(row_count for _, _, row_count in results)
+    for table_name, query_name, row_count in results:
+        print(f"Query {table_name.split('_')[1]}: {query_name} ({row_count} rows)")
+        print(con.table(result_table(table_name)))
+        print("=" * 50)
+        # Queries run concurrently, so each one only records its own time (the profile re-runs it)
+        details = None
+        if args.profile:
+            details = {'explain_analyze': duckdb_profile(con, queries[int(table_name.split('_')[1]) - 1][0])}
+        run_log.add(f"{table_name} {query_name}", timings[table_name], listing_count, row_count, details)
+    if 'shared_scan' in timings:
+        run_log.add('shared_scan', timings['shared_scan'], listing_count)
+
+    # Split the amenities into the dictionary, bridge and bitmask tables for the per-amenity analytics
+    if any(table_name in stale for table_name in AMENITY_TABLES):
+        with run_log.stage('amenities', rows_in=listing_count) as stage:
+            row_counts = build_amenity_dimension(con)
+            stage['rows_out'] = sum(row_counts.values())
+        results += [(table_name, table_name, row_counts[table_name]) for table_name in AMENITY_TABLES]
+
+    # Bin price against reviews into a multi-resolution pyramid for the dashboard's heatmap
+    if any(table_name in stale for table_name in HISTOGRAM_TABLES):
+        with run_log.stage('histograms', rows_in=listing_count) as stage:
+            row_counts = build_price_review_histograms(con)
+            stage['rows_out'] = sum(row_counts.values())
+        results += [(table_name, table_name, row_counts[table_name]) for table_name in HISTOGRAM_TABLES]
+
+    # Aggregate the listings into map tiles at several zoom levels for the dashboard's map
+    if any(table_name in stale for table_name in SPATIAL_TABLES):
+        with run_log.stage('tiles', rows_in=listing_count) as stage:
+            row_counts = build_listing_tiles(con)
+            stage['rows_out'] = sum(row_counts.values())
+        results += [(table_name, table_name, row_counts[table_name]) for table_name in SPATIAL_TABLES]
+
+    # Summarize prices and hosts per City, Neighbourhood and Property Type with mergeable sketches
+    if any(table_name in stale for table_name in SKETCH_TABLES):
+        with run_log.stage('sketches', rows_in=listing_count) as stage:
+            row_counts = build_listing_sketches(con)
+            stage['rows_out'] = sum(row_counts.values())
+        results += [(table_name, table_name, row_counts[table_name]) for table_name in SKETCH_TABLES]
+
+    # Index the listing text columns for the dashboard's full-text search
+    if any(table_name in stale for table_name in SEARCH_TABLES):
+        with run_log.stage('search_index', rows_in=listing_count) as stage:
+            row_counts = build_search_index(con)
+            stage['rows_out'] = sum(row_counts.values())
+        results += [(table_name, table_name, row_counts[table_name]) for table_name in SEARCH_TABLES]
+
+    # Roll the listings up over every combination of the drill-down dimensions for the dashboard
+    if any(table_name in stale for table_name in CUBE_TABLES):
+        with run_log.stage('cube', rows_in=listing_count) as stage:
+            row_counts = build_listing_cube(con)
+            stage['rows_out'] = sum(row_counts.values())
+        results += [(table_name, table_name, row_counts[table_name]) for table_name in CUBE_TABLES]
+
+    # Bulk-copy the results into a snapshot of the SQLite database (Arrow batches, no pandas round-trip).
+    # The cached tables are carried over from the published version; the dashboard sees the new version
+    # only once every table is written.
+    with run_log.stage('sqlite_export') as stage, publishing(sqlite_db_name, 'main.py') as snapshot_path:
+        sqlite_conn = sqlite3.connect(snapshot_path)
+        row_counts = export_tables(con, [(result_table(table_name), table_name) for table_name, _, _ in results],
+                                   sqlite_conn)
+        stage['rows_in'] = stage['rows_out'] = sum(row_counts.values())
+        record_results(sqlite_conn, entries, results, source_fingerprint, built_from)
+        sqlite_conn.close()
+    print_timings(timings, queries)
 
-# Connect to SQLite
-sqlite_conn = sqlite3.connect('airbnb_queries.db')
+    con.close()
+    if args.out_of_core:
+        os.remove(os.path.join(args.spill_dir, 'listings.duckdb'))
 
-# Execute each query, store the result in a DataFrame, and save it to SQLite
-for idx, (query, query_name) in enumerate(queries):
-    df_result = duckdb_to_pandas(query)
-    print(f"Query {idx + 1}: {query_name}")
-    print(df_result)
-    print("=" * 50)
+    run_log.print_summary()
+    run_log.write()
+    # Highest resident memory of the whole run, to size the workers
+    print(f"Peak RSS: {max_rss_so_far() / 1024 ** 2:.0f} MB")
 
-    # Save the DataFrame to SQLite
-    table_name = f"query_{idx + 1}"
-    df_result.to_sql(table_name, sqlite_conn, if_exists='replace', index=False)
 
-# Close the SQLite connection
-sqlite_conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import hashlib
+import re
+import time
+
+# Metadata table (inside airbnb_queries.db) recording what each query_N table was computed from
+CACHE_TABLE = 'query_cache'
+
+
+def sql_hash(sql):
+    """
+    Returns a hash of the query text. Whitespace differences do not change the hash.
+    """
+    normalized = re.sub(r'\s+', ' ', sql).strip()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def init_cache(sqlite_conn):
+    """
+    Creates the cache metadata table on first use.
+    """
+    sqlite_conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            query_name TEXT,
+            sql_hash TEXT,
+            source_fingerprint TEXT,
+            row_count INTEGER,
+            updated_at TEXT
+        )
+    """)
+
+
+def cache_entries(queries):
+    """
+    Returns the (table name, query name, SQL) cache entries of the main.py query list.
+    """
+    return [(f"query_{idx + 1}", query_name, query) for idx, (query, query_name) in enumerate(queries)]
+
+
+def stale_tables(sqlite_conn, entries, source_fingerprint, invalidate=None):
+    """
+    Returns the table names whose result must be recomputed: the SQL or the source data changed,
+    the result table is missing, or the table was invalidated explicitly.
+    `entries` is a list of (table name, query name, SQL) and `invalidate` a list of table names to force;
+    an empty list forces every table. Only reads, so it can run on the published database.
+    """
+    existing = {row[0] for row in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    cached = {}
+    if CACHE_TABLE in existing:
+        cached = {row[0]: (row[1], row[2]) for row in
+                  sqlite_conn.execute(f"SELECT table_name, sql_hash, source_fingerprint FROM {CACHE_TABLE}")}
+
+    stale = []
+    for table_name, _, query in entries:
+        forced = invalidate is not None and (not invalidate or table_name in invalidate)
+        if forced or table_name not in existing or cached.get(table_name) != (sql_hash(query), source_fingerprint):
+            stale.append(table_name)
+    return stale
+
+
+def record_results(sqlite_conn, entries, results, source_fingerprint, built_from=None):
+    """
+    Records the SQL hash and source fingerprint of every freshly exported (table name, query name, row count).
+    `built_from` maps table names to the hash of the SQL they were actually computed from (run_queries());
+    the other tables are recorded with the hash of their entry's SQL.
+    """
+    init_cache(sqlite_conn)
+    hashes = {table_name: sql_hash(query) for table_name, _, query in entries}
+    hashes.update(built_from or {})
+    updated_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    sqlite_conn.executemany(f"""
+        INSERT OR REPLACE INTO {CACHE_TABLE}
+            (table_name, query_name, sql_hash, source_fingerprint, row_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(table_name, query_name, hashes[table_name], source_fingerprint, row_count, updated_at)
+          for table_name, query_name, row_count in results])
+    sqlite_conn.commit()
+
+
+def forget_results(sqlite_conn, table_names):
+    """
+    Forgets the cached results of the given tables, e.g. after the incremental refresh rewrote them.
+    """
+    init_cache(sqlite_conn)
+    sqlite_conn.executemany(f"DELETE FROM {CACHE_TABLE} WHERE table_name = ?", [(name,) for name in table_names])
+    sqlite_conn.commit()
+
+
+def print_cache_report(entries, stale):
+    """
+    Prints which tables were served from the cache and which were recomputed.
+    """
+    hits = len(entries) - len(stale)
+    print(f"Result cache: {hits} hit(s), {len(stale)} miss(es)")
+    for table_name, query_name, _ in entries:
+        print(f"  {table_name} {query_name}: {'miss' if table_name in stale else 'hit'}")
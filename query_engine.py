@@ -0,0 +1,167 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from incremental import MERGEABLE_AGGREGATES, quoted
+from query_cache import sql_hash
+
+# Queries answered together from one GROUPING SETS scan over the listings
+SHARED_SCAN_TABLES = ['query_3', 'query_4', 'query_5']
+
+
+def shared_scan_sql(aggregates, source='airbnb_listings'):
+    """
+    Returns one GROUPING SETS query computing the partial aggregates of every given aggregate.
+    Each aggregate's measures are restricted to its own rows with FILTER (WHERE ...), and
+    aggregates grouping on the same columns share a grouping set.
+    """
+    grouping_sets = []
+    for aggregate in aggregates:
+        if aggregate['group_by'] not in grouping_sets:
+            grouping_sets.append(aggregate['group_by'])
+    group_columns = []
+    for group_by in grouping_sets:
+        group_columns.extend(column for column in group_by if column not in group_columns)
+
+    select_list = [quoted(group_columns), f"GROUPING({quoted(group_columns)}) AS grouping_id"]
+    for aggregate in aggregates:
+        prefix = aggregate['table']
+        for name, expression in aggregate['measures'].items():
+            select_list.append(f"COALESCE(SUM(CAST({expression} AS DOUBLE)) FILTER (WHERE {aggregate['where']}), 0) "
+                               f"AS {prefix}_{name}")
+        select_list.append(f"COUNT(*) FILTER (WHERE {aggregate['where']}) AS {prefix}_contributing_rows")
+
+    sets = ', '.join(f"({quoted(group_by)})" for group_by in grouping_sets)
+    return f"""
+        SELECT {', '.join(select_list)}
+        FROM {source}
+        GROUP BY GROUPING SETS ({sets})
+    """, group_columns
+
+
+def grouping_id(group_by, group_columns):
+    """
+    Returns the GROUPING() value of the grouping set `group_by` (a bit is set for every column not grouped on).
+    """
+    value = 0
+    for column in group_columns:
+        value = (value << 1) | (0 if column in group_by else 1)
+    return value
+
+
+def result_table(table_name):
+    """
+    Returns the name of the DuckDB table holding the result of a query_N table.
+    """
+    return f"result_{table_name}"
+
+
+def materialize(cursor, table_name, sql):
+    """
+    Stores the result of `sql` as a DuckDB table and returns its row count.
+    """
+    cursor.execute(f"CREATE OR REPLACE TABLE {result_table(table_name)} AS {sql}")
+    return cursor.execute(f"SELECT COUNT(*) FROM {result_table(table_name)}").fetchone()[0]
+
+
+def run_shared_scan(cursor, aggregates):
+    """
+    Runs the shared GROUPING SETS scan on `cursor` and derives each aggregate's final result from it.
+    Returns a dict of table name -> (row count, seconds spent on that table's final SELECT).
+    """
+    sql, group_columns = shared_scan_sql(aggregates)
+    cursor.execute(f"CREATE OR REPLACE TEMP TABLE shared_scan AS {sql}")
+
+    results = {}
+    for aggregate in aggregates:
+        prefix = aggregate['table']
+        columns = [quoted(aggregate['group_by'])]
+        columns += [f"{prefix}_{name} AS {name}" for name in aggregate['measures']]
+        state = f"""(
+            SELECT {', '.join(columns)}
+            FROM shared_scan
+            WHERE grouping_id = {grouping_id(aggregate['group_by'], group_columns)}
+            AND {prefix}_contributing_rows > 0
+        )"""
+        start = time.perf_counter()
+        results[prefix] = (materialize(cursor, prefix, aggregate['final'].format(state=state)),
+                           time.perf_counter() - start)
+    return results
+
+
+def run_queries(con, queries, workers=4, share_scans=True, only=None):
+    """
+    Runs the (sql, query_name) list on `con` and returns a list of (table_name, query_name, row count) in
+    the original order, along with the per-query timings and the SQL hash each table was computed from.
+    `only` restricts the run to the given table names. Each result is kept in the DuckDB table named by
+    result_table().
+
+    Queries listed in SHARED_SCAN_TABLES whose SQL is still the one their mergeable aggregate mirrors
+    (same sql_hash) are answered from a single GROUPING SETS scan; an edited query runs its own SQL.
+    All remaining queries, and the shared scan itself, run concurrently on separate DuckDB cursors.
+    """
+    all_tables = [f"query_{idx + 1}" for idx in range(len(queries))]
+    names = dict(zip(all_tables, (query_name for _, query_name in queries)))
+    sqls = dict(zip(all_tables, (query for query, _ in queries)))
+    tables = [table for table in all_tables if only is None or table in only]
+
+    shared = []
+    if share_scans:
+        shared = [aggregate for aggregate in MERGEABLE_AGGREGATES
+                  if aggregate['table'] in SHARED_SCAN_TABLES and aggregate['table'] in tables
+                  and names[aggregate['table']] == aggregate['query_name']
+                  and sql_hash(sqls[aggregate['table']]) == aggregate['sql_hash']]
+        if len(shared) < 2:
+            shared = []
+    shared_tables = [aggregate['table'] for aggregate in shared]
+
+    def run_single(table):
+        cursor = con.cursor()
+        start = time.perf_counter()
+        row_count = materialize(cursor, table, sqls[table])
+        cursor.close()
+        return {table: (row_count, time.perf_counter() - start)}
+
+    def run_shared():
+        cursor = con.cursor()
+        start = time.perf_counter()
+        results = run_shared_scan(cursor, shared)
+        cursor.close()
+        scan_seconds = time.perf_counter() - start - sum(seconds for _, seconds in results.values())
+        # The scan itself is reported as shared; each table keeps its own final SELECT time
+        results['shared_scan'] = (None, scan_seconds)
+        return results
+
+    start = time.perf_counter()
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(run_single, table) for table in tables if table not in shared_tables]
+        if shared:
+            futures.append(executor.submit(run_shared))
+        for future in futures:
+            results.update(future.result())
+    total_seconds = time.perf_counter() - start
+
+    timings = {table: seconds for table, (_, seconds) in results.items()}
+    timings['total'] = total_seconds
+    ordered = [(table, names[table], results[table][0]) for table in tables]
+    # The SQL each table was computed from: its own, or the query its shared-scan aggregate mirrors
+    built_from = {table: sql_hash(sqls[table]) for table in tables}
+    built_from.update({aggregate['table']: aggregate['sql_hash'] for aggregate in shared})
+    return ordered, timings, built_from
+
+
+def print_timings(timings, queries):
+    """
+    Prints the time spent per query, in the shared scan and in total.
+    """
+    print("Query timings:")
+    for idx, (_, query_name) in enumerate(queries):
+        table = f"query_{idx + 1}"
+        if table not in timings:
+            continue
+        suffix = " (+ shared scan)" if table in SHARED_SCAN_TABLES and 'shared_scan' in timings else ""
+        print(f"  {table} {query_name}: {timings[table]:.3f}s{suffix}")
+    if 'shared_scan' in timings:
+        shared = [table for table in SHARED_SCAN_TABLES if table in timings]
+        print(f"  shared scan ({', '.join(shared)}): {timings['shared_scan']:.3f}s")
+    print(f"  total wall time: {timings['total']:.3f}s")
@@ -0,0 +1,178 @@
+import json
+import os
+import resource
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# SQLite database shared by main.py, spark_analysis.py and the dashboard for their stage records
+RUN_LOG_DB = 'airbnb_run_log.db'
+RUN_LOG_TABLE = 'run_log'
+
+# Interval of the peak RSS sampler
+RSS_SAMPLE_SECONDS = 0.02
+
+# Runs kept per script (older runs are deleted when a run is written)
+RUN_LOG_KEEP_RUNS = 200
+
+RUN_LOG_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS {RUN_LOG_TABLE} (
+        run_id TEXT,
+        script TEXT,
+        stage TEXT,
+        started_at TEXT,
+        seconds REAL,
+        rows_in INTEGER,
+        rows_out INTEGER,
+        peak_rss_mb REAL,
+        details TEXT
+    )
+"""
+
+
+def process_tree_rss(pid):
+    """
+    Returns the resident set size in bytes of a process and all its descendants (the Spark JVM included),
+    read from /proc. Returns None where /proc is not available.
+    """
+    total = 0
+    pending = [pid]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+def max_rss_so_far():
+    """
+    Returns the highest RSS of this process or of any finished child, in bytes (fallback without /proc).
+    """
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def sample_peak_rss(stop, peak):
+    """
+    Records the highest RSS of this process tree in `peak['bytes']` until `stop` is set.
+    """
+    while True:
+        rss = process_tree_rss(os.getpid())
+        peak['bytes'] = max(peak['bytes'], rss if rss is not None else max_rss_so_far())
+        if stop.wait(RSS_SAMPLE_SECONDS):
+            return
+
+
+@contextmanager
+def peak_rss():
+    """
+    Samples the RSS of this process tree while the block runs; `peak['bytes']` holds the maximum afterwards.
+    """
+    peak = {'bytes': 0}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_peak_rss, args=(stop, peak), daemon=True)
+    sampler.start()
+    try:
+        yield peak
+    finally:
+        stop.set()
+        sampler.join()
+
+
+def duckdb_profile(con, sql):
+    """
+    Runs `sql` under EXPLAIN ANALYZE on a DuckDB connection and returns the profiled plan as text.
+    """
+    return con.execute(f"EXPLAIN ANALYZE {sql.strip().rstrip(';')}").fetchall()[0][1]
+
+
+class RunLog:
+    """
+    Collects the stage records of one run of a script: wall time, rows in and out, peak RSS and optional
+    details (query profiles, Spark stage metrics). write() appends them to the run-log table.
+    """
+
+    def __init__(self, script, db_path=RUN_LOG_DB):
+        self.script = script
+        self.db_path = db_path
+        self.run_id = uuid.uuid4().hex
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Times the block and samples its peak RSS. The yielded record can be updated inside the block
+        with `rows_out`, `rows_in` and `details`.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, 'details': None}
+        started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        start = time.perf_counter()
+        with peak_rss() as peak:
+            yield record
+        record.update(started_at=started_at, seconds=time.perf_counter() - start,
+                      peak_rss_mb=peak['bytes'] / 1024 ** 2)
+        self.records.append(record)
+
+    def add(self, name, seconds, rows_in=None, rows_out=None, details=None):
+        """
+        Records a stage timed elsewhere (for example a query run on a worker thread).
+        """
+        self.records.append({'stage': name, 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seconds': seconds,
+                             'rows_in': rows_in, 'rows_out': rows_out, 'peak_rss_mb': None, 'details': details})
+
+    def print_summary(self):
+        """
+        Prints the recorded stages.
+        """
+        print(f"Run log ({self.script}, run {self.run_id}):")
+        for record in self.records:
+            rows = ' -> '.join(str(value) for value in (record['rows_in'], record['rows_out']) if value is not None)
+            rss = f"{record['peak_rss_mb']:.0f} MB" if record['peak_rss_mb'] is not None else ''
+            print(f"  {record['stage']:<50} {record['seconds']:>8.3f}s {rows:>20} {rss:>8}")
+
+    def write(self):
+        """
+        Appends the records to the run-log table and keeps the last RUN_LOG_KEEP_RUNS runs of the script.
+        """
+        write_run_logs([self], self.db_path)
+
+
+def write_run_logs(run_logs, db_path=RUN_LOG_DB):
+    """
+    Appends the records of several runs to the run-log table in one transaction, and keeps the last
+    RUN_LOG_KEEP_RUNS runs of each of their scripts.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    with conn:
+        conn.execute(RUN_LOG_SCHEMA)
+        conn.executemany(f"""
+            INSERT INTO {RUN_LOG_TABLE}
+            (run_id, script, stage, started_at, seconds, rows_in, rows_out, peak_rss_mb, details)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(run_log.run_id, run_log.script, record['stage'], record['started_at'], record['seconds'],
+               record['rows_in'], record['rows_out'], record['peak_rss_mb'],
+               json.dumps(record['details']) if record['details'] is not None else None)
+              for run_log in run_logs for record in run_log.records])
+        for script in sorted({run_log.script for run_log in run_logs}):
+            conn.execute(f"""
+                DELETE FROM {RUN_LOG_TABLE}
+                WHERE script = ?
+                AND run_id NOT IN (
+                    SELECT run_id FROM {RUN_LOG_TABLE} WHERE script = ?
+                    GROUP BY run_id ORDER BY MAX(started_at) DESC LIMIT ?
+                )
+            """, (script, script, RUN_LOG_KEEP_RUNS))
+    conn.close()
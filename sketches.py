@@ -0,0 +1,234 @@
+import math
+import time
+
+# Columns the listings are summarized by
+SKETCH_DIMENSIONS = ['City', 'Neighbourhood', 'Property Type']
+
+# Price quantile sketch (DDSketch-style): prices fall into logarithmic buckets of relative width
+# PRICE_SKETCH_ACCURACY, so any quantile is returned within 1% of the true value
+PRICE_SKETCH_ACCURACY = 0.01
+PRICE_SKETCH_GAMMA = (1 + PRICE_SKETCH_ACCURACY) / (1 - PRICE_SKETCH_ACCURACY)
+
+# Distinct host sketch (HyperLogLog): 2**HLL_PRECISION registers, about 3% standard error
+HLL_PRECISION = 10
+HLL_REGISTERS = 2 ** HLL_PRECISION
+
+# Tables exported to the dashboard database
+SKETCH_TABLES = ['listing_sketches']
+
+# Partial sketches of `source` in a single GROUPING SETS pass: one row per (dimension, value, kind, slot).
+# Price rows count the listings per price bucket (multiplied by `sign`, so they can be retracted);
+# host rows keep the highest HyperLogLog rank per register. Partials of any batches or partitions merge
+# by SUM(count) and MAX(rank).
+SKETCH_PARTIALS_SQL = """
+    WITH hashed AS (
+        SELECT
+            {dimension_columns},
+            CASE WHEN Price > 0 THEN CAST(CEIL(ln(Price) / {log_gamma}) AS INTEGER) END AS price_bucket,
+            CAST(hash("Host ID") & {register_mask} AS INTEGER) AS host_register,
+            hash("Host ID") >> {precision} AS host_bits,
+            "Host ID" IS NOT NULL AS has_host
+        FROM {source}
+    )
+    SELECT
+        CASE {dimension_cases} END AS dimension,
+        COALESCE({dimension_values}) AS value,
+        CASE WHEN GROUPING(price_bucket) = 0 THEN 'price' ELSE 'host' END AS kind,
+        COALESCE(price_bucket, host_register) AS slot,
+        {sign} * COUNT(price_bucket) AS count,
+        -- Rank of the first set bit of the remaining hash bits
+        MAX(CASE WHEN host_bits = 0 THEN {rank_bits} + 1 ELSE bit_count(xor(host_bits, host_bits - 1)) END)
+            FILTER (WHERE has_host) AS rank
+    FROM hashed
+    GROUP BY GROUPING SETS ({grouping_sets})
+"""
+
+# Merges partial sketch rows (the state and any number of signed partials) into one row per slot
+MERGE_SKETCHES_SQL = """
+    SELECT dimension, value, kind, slot, SUM(count) AS count, MAX(rank) AS rank
+    FROM ({partials})
+    WHERE value IS NOT NULL AND slot IS NOT NULL
+    GROUP BY dimension, value, kind, slot
+    HAVING (kind = 'price' AND SUM(count) > 0) OR (kind = 'host' AND MAX(rank) IS NOT NULL)
+"""
+
+# Serializes the merged slots of every (dimension, value) into compact "slot:count,..." strings,
+# with the estimates read by the dashboard
+LISTING_SKETCHES_SQL = """
+    WITH serialized AS (
+        SELECT
+            dimension,
+            value,
+            SUM(count) FILTER (WHERE kind = 'price') AS priced_listings,
+            string_agg(slot || ':' || count, ',' ORDER BY slot) FILTER (WHERE kind = 'price') AS price_sketch,
+            string_agg(slot || ':' || rank, ',' ORDER BY slot) FILTER (WHERE kind = 'host') AS host_sketch
+        FROM {state}
+        GROUP BY dimension, value
+    )
+    SELECT
+        dimension,
+        value,
+        priced_listings,
+        sketch_price_quantile(price_sketch, 0.5) AS median_price,
+        sketch_price_quantile(price_sketch, 0.9) AS p90_price,
+        sketch_host_count(host_sketch) AS hosts,
+        price_sketch,
+        host_sketch
+    FROM serialized
+    ORDER BY dimension, priced_listings DESC NULLS LAST
+"""
+
+
+def sketch_partials_sql(source, sign=1):
+    """
+    Returns the SELECT computing the signed partial sketches of `source`.
+    """
+    return SKETCH_PARTIALS_SQL.format(
+        source=source,
+        dimension_columns=', '.join(f'"{column}"' for column in SKETCH_DIMENSIONS),
+        log_gamma=math.log(PRICE_SKETCH_GAMMA),
+        register_mask=HLL_REGISTERS - 1,
+        precision=HLL_PRECISION,
+        rank_bits=64 - HLL_PRECISION,
+        sign=sign,
+        dimension_cases=' '.join(f"WHEN GROUPING(\"{column}\") = 0 THEN '{column}'" for column in SKETCH_DIMENSIONS),
+        dimension_values=', '.join(f'CAST("{column}" AS VARCHAR)' for column in SKETCH_DIMENSIONS),
+        grouping_sets=', '.join(f'("{column}", {slot})' for column in SKETCH_DIMENSIONS
+                                for slot in ('price_bucket', 'host_register')))
+
+
+def merge_sketches_sql(*partials):
+    """
+    Returns the SELECT merging the given partial sketch SELECTs or tables.
+    """
+    return MERGE_SKETCHES_SQL.format(partials=' UNION ALL BY NAME '.join(f"SELECT * FROM ({partial})"
+                                                                         for partial in partials))
+
+
+def parse_sketch(sketch):
+    """
+    Parses a serialized "slot:value,..." sketch into a dict of slot -> value.
+    """
+    if not sketch:
+        return {}
+    return {int(slot): int(value) for slot, value in (item.split(':') for item in sketch.split(','))}
+
+
+def serialize_sketch(slots):
+    """
+    Serializes a dict of slot -> value into the "slot:value,..." form.
+    """
+    return ','.join(f"{slot}:{value}" for slot, value in sorted(slots.items()))
+
+
+def merge_price_sketches(sketches):
+    """
+    Merges serialized price sketches by adding the bucket counts.
+    """
+    merged = {}
+    for sketch in sketches:
+        for bucket, count in parse_sketch(sketch).items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    return serialize_sketch(merged)
+
+
+def merge_host_sketches(sketches):
+    """
+    Merges serialized HyperLogLog sketches by keeping the highest rank per register.
+    """
+    merged = {}
+    for sketch in sketches:
+        for register, rank in parse_sketch(sketch).items():
+            merged[register] = max(merged.get(register, 0), rank)
+    return serialize_sketch(merged)
+
+
+def price_quantile(sketch, quantile):
+    """
+    Returns the `quantile` (0..1) of a serialized price sketch, within PRICE_SKETCH_ACCURACY of the true value.
+    """
+    buckets = sorted(parse_sketch(sketch).items())
+    total = sum(count for _, count in buckets)
+    if total <= 0:
+        return None
+    target = quantile * (total - 1)
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen > target:
+            break
+    return 2 * PRICE_SKETCH_GAMMA ** bucket / (PRICE_SKETCH_GAMMA + 1)
+
+
+def host_count(sketch):
+    """
+    Returns the estimated number of distinct hosts of a serialized HyperLogLog sketch.
+    """
+    registers = parse_sketch(sketch)
+    empty = HLL_REGISTERS - len(registers)
+    harmonic_sum = empty + sum(2.0 ** -rank for rank in registers.values())
+    estimate = 0.7213 / (1 + 1.079 / HLL_REGISTERS) * HLL_REGISTERS ** 2 / harmonic_sum
+    # Linear counting is more accurate while many registers are still empty
+    if estimate <= 2.5 * HLL_REGISTERS and empty > 0:
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / empty)
+    return int(round(estimate))
+
+
+def register_sketch_functions(con):
+    """
+    Makes the sketch estimators available to DuckDB SQL as sketch_price_quantile() and sketch_host_count().
+    """
+    con.create_function('sketch_price_quantile', price_quantile, ['VARCHAR', 'DOUBLE'], 'DOUBLE')
+    con.create_function('sketch_host_count', host_count, ['VARCHAR'], 'BIGINT')
+
+
+def init_sketch_state(con, listings='listing_state', state='sketch_state'):
+    """
+    Creates the persistent table of merged partial sketches on first use (incremental mode), seeded from the
+    stored `listings` so later retractions of those listings stay consistent.
+    """
+    exists = con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                         [state]).fetchall()[0][0]
+    if not exists:
+        con.execute(f"""
+            CREATE TABLE {state} (
+                dimension VARCHAR, value VARCHAR, kind VARCHAR, slot INTEGER, count BIGINT, rank INTEGER
+            )
+        """)
+        con.execute(f"INSERT INTO {state} BY NAME {merge_sketches_sql(sketch_partials_sql(listings))}")
+
+
+def merge_sketch_state(con, incoming, retracted, state='sketch_state'):
+    """
+    Adds the partial sketches of the `incoming` rows to the persistent state and subtracts the price buckets
+    of the `retracted` rows. HyperLogLog registers cannot forget a host, so host counts never decrease.
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE merged_sketches AS
+        {merge_sketches_sql(f"SELECT * FROM {state}", sketch_partials_sql(incoming, 1),
+                            sketch_partials_sql(retracted, -1))}
+    """)
+    con.execute(f"DELETE FROM {state}")
+    con.execute(f"INSERT INTO {state} BY NAME SELECT * FROM merged_sketches")
+
+
+def sketch_build_sql():
+    """
+    Returns the SQL text of every sketch step, used as the result cache key of the sketch table.
+    """
+    return '\n'.join([sketch_partials_sql('airbnb_listings'), MERGE_SKETCHES_SQL, LISTING_SKETCHES_SQL])
+
+
+def build_listing_sketches(con, source='airbnb_listings'):
+    """
+    Builds the price quantile and distinct host sketches of every City, Neighbourhood and Property Type in
+    one pass over the listings and stores them, serialized and with their estimates, as a DuckDB table
+    (result_listing_sketches).
+    """
+    start = time.perf_counter()
+    register_sketch_functions(con)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE sketch_state AS {merge_sketches_sql(sketch_partials_sql(source))}")
+    con.execute(f"CREATE OR REPLACE TABLE result_listing_sketches AS {LISTING_SKETCHES_SQL.format(state='sketch_state')}")
+    print(f"Built price and host sketches in {time.perf_counter() - start:.2f}s")
+    return {table_name: con.execute(f"SELECT COUNT(*) FROM result_{table_name}").fetchone()[0]
+            for table_name in SKETCH_TABLES}
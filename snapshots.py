@@ -0,0 +1,189 @@
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): concurrent publishers are not serialized
+    fcntl = None
+
+# Table (inside every published snapshot) recording its version, the script that wrote it and when
+SNAPSHOT_TABLE = 'snapshot_info'
+
+# Published versions always kept on disk
+SNAPSHOT_KEEP_VERSIONS = 3
+
+# Older versions are only deleted once they were superseded this long ago, so a dashboard still serving
+# them (until it has moved its sessions to the new version) can keep opening connections
+SNAPSHOT_RETAIN_SECONDS = 600
+
+SNAPSHOT_FILE = re.compile(r'^v(\d+)\.db$')
+
+
+def snapshot_dir(db_path):
+    """
+    Returns the directory of the versioned snapshots of a database (airbnb_queries.db -> airbnb_queries_snapshots).
+    """
+    return f"{os.path.splitext(db_path)[0]}_snapshots"
+
+
+def snapshot_versions(db_path):
+    """
+    Returns the published (version, path) pairs of a database, oldest first.
+    """
+    directory = snapshot_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+    versions = [(int(match.group(1)), os.path.join(directory, name))
+                for name in os.listdir(directory) for match in [SNAPSHOT_FILE.match(name)] if match]
+    return sorted(versions)
+
+
+def published_snapshot(db_path):
+    """
+    Returns the versioned snapshot file currently published as `db_path`, or None when `db_path` was not
+    published as a snapshot (written in place by an older version of the pipelines).
+    """
+    inode = os.stat(db_path).st_ino
+    for _, path in reversed(snapshot_versions(db_path)):
+        if os.stat(path).st_ino == inode:
+            return path
+    return None
+
+
+def open_published(db_path):
+    """
+    Returns a read-only connection to the published database, or to an empty in-memory database if nothing
+    was published yet.
+    """
+    if not os.path.exists(db_path):
+        return sqlite3.connect(':memory:')
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+
+def fsync_path(path):
+    """
+    Flushes a file or directory to disk (directories only where the platform allows opening them).
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def begin_snapshot(db_path):
+    """
+    Locks the database against other publishers and copies the published version into a new, unpublished
+    snapshot file. Returns the snapshot dict passed to publish_snapshot() or discard_snapshot(); results are
+    written to `snapshot['path']`.
+    """
+    directory = snapshot_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    lock = open(os.path.join(directory, 'publish.lock'), 'w')
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+    try:
+        # Unpublished files left by a publisher that crashed
+        for name in os.listdir(directory):
+            if '.db.tmp' in name:
+                os.remove(os.path.join(directory, name))
+
+        versions = snapshot_versions(db_path)
+        version = versions[-1][0] + 1 if versions else 1
+        path = os.path.join(directory, f"v{version:06d}.db.tmp")
+        if os.path.exists(db_path):
+            # The backup API copies a consistent state, even of a database still written in place (WAL)
+            source = open_published(db_path)
+            target = sqlite3.connect(path)
+            source.backup(target)
+            target.close()
+            source.close()
+    except BaseException:
+        # Later publishers would otherwise wait on the lock forever
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+        raise
+    return {'db_path': db_path, 'version': version, 'path': path, 'lock': lock}
+
+
+def publish_snapshot(snapshot, script):
+    """
+    Publishes a snapshot atomically: it is stamped with its version, made self-contained (no WAL), renamed
+    to its versioned name and hard-linked in place of the database with a single rename. Readers opening the
+    database see either the previous version or this one, never a partial state.
+    """
+    db_path = snapshot['db_path']
+    conn = sqlite3.connect(snapshot['path'])
+    with conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (version INTEGER, script TEXT, published_at TEXT)")
+        conn.execute(f"DELETE FROM {SNAPSHOT_TABLE}")
+        conn.execute(f"INSERT INTO {SNAPSHOT_TABLE} VALUES (?, ?, ?)",
+                     (snapshot['version'], script, time.strftime('%Y-%m-%dT%H:%M:%S')))
+    # Folds the WAL into the file, so the snapshot is a single immutable file
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+    fsync_path(snapshot['path'])
+
+    published_path = snapshot['path'][:-len('.tmp')]
+    os.replace(snapshot['path'], published_path)
+    link_path = f"{db_path}.publishing"
+    if os.path.exists(link_path):
+        os.remove(link_path)
+    os.link(published_path, link_path)
+    # WAL files of a database written in place would otherwise be replayed onto the new version
+    for path in (f"{db_path}-wal", f"{db_path}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    os.replace(link_path, db_path)
+    fsync_path(os.path.dirname(os.path.abspath(db_path)))
+
+    prune_snapshots(db_path)
+    snapshot['lock'].close()
+    print(f"Published {db_path} version {snapshot['version']}")
+
+
+def prune_snapshots(db_path):
+    """
+    Deletes the versions older than the last SNAPSHOT_KEEP_VERSIONS whose successor was published more than
+    SNAPSHOT_RETAIN_SECONDS ago.
+    """
+    versions = snapshot_versions(db_path)
+    for (_, path), (_, successor) in zip(versions[:-SNAPSHOT_KEEP_VERSIONS], versions[1:]):
+        if time.time() - os.stat(successor).st_mtime > SNAPSHOT_RETAIN_SECONDS:
+            os.remove(path)
+
+
+def discard_snapshot(snapshot):
+    """
+    Deletes an unpublished snapshot; the published database is left untouched.
+    """
+    for path in (snapshot['path'], f"{snapshot['path']}-wal", f"{snapshot['path']}-shm", f"{snapshot['path']}-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+    snapshot['lock'].close()
+
+
+@contextmanager
+def publishing(db_path, script):
+    """
+    Yields the path of a new snapshot of `db_path` to write into, and publishes it when the block succeeds.
+    If the block fails, the snapshot is discarded and the published database is left untouched.
+    """
+    snapshot = begin_snapshot(db_path)
+    try:
+        yield snapshot['path']
+    except BaseException:
+        discard_snapshot(snapshot)
+        raise
+    publish_snapshot(snapshot, script)
@@ -9,77 +9,488 @@ written and submitted by [Your Name] [Your ID]
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import col, avg, year, desc, collect_list, struct, explode
 from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, StringType, DoubleType, LongType, ArrayType
 from pyspark.sql.window import Window
+import argparse
+import itertools
+import json
 import sqlite3
 import os
+import time
+import urllib.error
+import urllib.request
 
-print("Starting Spark session...")
+from analysis_engines import (ENGINES, JSON_TABLE, RANKED_TABLE, SPARK_MIN_INPUT_BYTES, SparkEngine,
+                              choose_engine, export_top_cities, input_format, input_size, top_cities_sql)
+from run_log import RUN_LOG_DB, RunLog
+from snapshots import publishing
+from sqlite_export import EXPORT_BATCH_SIZE, configure_sqlite, create_dashboard_indexes, export_spark_dataframe
 
-# Create a Spark session
-spark = SparkSession.builder \
-    .appName("Airbnb Data Analysis") \
-    .getOrCreate()
+# Schema of the listings written by fake_data.py. Declaring it up front spares Spark
+# a full pass over the input to infer it.
+LISTING_SCHEMA = StructType([
+    StructField("id", StringType()),
+    StructField("name", StringType()),
+    StructField("host", StructType([
+        StructField("id", StringType()),
+        StructField("name", StringType()),
+        StructField("location", StringType()),
+        StructField("response_rate", DoubleType()),
+    ])),
+    StructField("city", StructType([
+        StructField("name", StringType()),
+        StructField("country", StringType()),
+    ])),
+    StructField("price", DoubleType()),
+    StructField("bedrooms", LongType()),
+    StructField("property_type", StringType()),
+    StructField("room_type", StringType()),
+    StructField("amenities", ArrayType(StringType())),
+])
 
-# File path
-filename = 'airbnb_listings.json'
 
-print(f"Checking for file: {filename}")
+def read_listings(spark, path):
+    """
+    Reads the listings from a JSON array file, an NDJSON file or directory, or a Parquet file or directory,
+    using the declared schema instead of schema inference.
+    """
+    if input_format(path) == 'parquet':
+        return spark.read.schema(LISTING_SCHEMA).parquet(path)
+    # Spark's line-based JSON reader turns a top-level JSON array into one row per element
+    return spark.read.schema(LISTING_SCHEMA).json(path)
 
-# Check if file exists
-if not os.path.exists(filename):
-    print(f"Error: {filename} not found. Please ensure the file is in the same directory as this script.")
-    exit(1)
 
-print("Reading JSON file...")
+def rank_cities_by_property_type(df, layout='normalized'):
+    """
+    Question: What are the top 5 cities with the highest average listing prices for each property type?
+    Runs the engine-independent TOP_CITIES_SQL (see analysis_engines.py) on Spark SQL.
+    """
+    df.createOrReplaceTempView("listings")
+    _, sql = top_cities_sql(SparkEngine, layout)
+    return df.sparkSession.sql(sql)
 
-# Read the JSON file
-df = spark.read.json(filename)
 
-print("Preprocessing data...")
+def price_by_room_type(df):
+    """
+    Question: How do listing prices differ by room type?
+    """
+    return df.groupBy("room_type") \
+             .agg(F.count("*").alias("listings"),
+                  F.avg("price").alias("avg_price"),
+                  F.percentile_approx("price", 0.5).alias("median_price"),
+                  F.min("price").alias("min_price"),
+                  F.max("price").alias("max_price")) \
+             .orderBy(F.desc("avg_price"))
 
-# Convert 'price' to numeric
-df = df.withColumn("price", col("price").cast("double"))
 
-print("Performing analysis...")
+def amenity_price_uplift(df):
+    """
+    Question: How much more do listings offering an amenity cost than listings without it?
+    """
+    # Step 1: Priced listings and total price overall (listings without a price count on neither side)
+    priced = df.where(F.col("price").isNotNull())
+    totals = priced.agg(F.count("*").alias("total_listings"), F.sum("price").alias("total_price"))
 
-# Question: What are the top 5 cities with the highest average listing prices for each property type?
+    # Step 2: Priced listings and total price per amenity
+    per_amenity = priced.select("price", F.explode(F.array_distinct("amenities")).alias("amenity")) \
+                        .groupBy("amenity") \
+                        .agg(F.count("*").alias("priced_listings"), F.sum("price").alias("price_sum"))
 
-# Step 1: Calculate average price per city and property type
-avg_prices = df.groupBy("city.name", "property_type") \
-               .agg(F.avg("price").alias("avg_price"))
+    # Step 3: Average price with and without the amenity
+    without_listings = F.col("total_listings") - F.col("priced_listings")
+    return per_amenity.crossJoin(totals) \
+                      .select("amenity", "priced_listings",
+                              (F.col("price_sum") / F.col("priced_listings")).alias("avg_price_with"),
+                              ((F.col("total_price") - F.col("price_sum")) /
+                               F.when(without_listings > 0, without_listings)).alias("avg_price_without")) \
+                      .withColumn("uplift", F.col("avg_price_with") - F.col("avg_price_without")) \
+                      .orderBy(F.desc("uplift"))
 
-# Step 2: Rank cities within each property type based on average price
-window_spec = Window.partitionBy("property_type").orderBy(F.desc("avg_price"))
 
-# Step 3: Rank cities with dense_rank to handle ties
-ranked_cities = avg_prices.withColumn("rank", F.dense_rank().over(window_spec))
+# Width of the host response-rate buckets (response rates are fractions between 0 and 1)
+RESPONSE_RATE_BUCKET_WIDTH = 0.1
 
-# Step 4: Select top 5 cities for each property type
-top_cities_by_property_type = ranked_cities.filter(F.col("rank") <= 5) \
-                                           .groupBy("property_type") \
-                                           .agg(F.collect_list(F.struct("name", "avg_price")).alias("top_cities"))
 
-print("Analysis results:")
-top_cities_by_property_type.show(truncate=False)
+def host_response_rate_buckets(df):
+    """
+    Question: Do hosts who respond more often charge different prices?
+    """
+    buckets = int(round(1 / RESPONSE_RATE_BUCKET_WIDTH))
+    # A response rate of exactly 1.0 falls into the last bucket
+    bucket = F.least(F.floor(F.col("host.response_rate") * buckets), F.lit(buckets - 1))
+    return df.filter(F.col("host.response_rate").isNotNull()) \
+             .withColumn("bucket", bucket) \
+             .groupBy("bucket") \
+             .agg(F.count("*").alias("listings"),
+                  F.countDistinct("host.id").alias("hosts"),
+                  F.avg("price").alias("avg_price"),
+                  F.avg("bedrooms").alias("avg_bedrooms")) \
+             .select((F.col("bucket") / buckets).alias("response_rate_from"),
+                     ((F.col("bucket") + 1) / buckets).alias("response_rate_to"),
+                     "listings", "hosts", "avg_price", "avg_bedrooms") \
+             .orderBy("response_rate_from")
 
-print("Preparing data for SQLite...")
 
-# Convert the 'top_cities' column to a JSON string
-top_cities_by_property_type = top_cities_by_property_type.withColumn('top_cities', F.to_json(col('top_cities')))
+# Analyses run against the one cached listings DataFrame: name -> (SQLite table, function)
+ANALYSES = {
+    'top_cities': (RANKED_TABLE, rank_cities_by_property_type),
+    'price_by_room_type': ('price_by_room_type', price_by_room_type),
+    'amenity_uplift': ('amenity_price_uplift', amenity_price_uplift),
+    'host_response_rate': ('host_response_rate_buckets', host_response_rate_buckets),
+}
 
-# Convert to Pandas
-pandas_df = top_cities_by_property_type.toPandas()
+# Shuffle partitions for local mode. Spark's default of 200 mostly schedules empty tasks on a single machine;
+# adaptive query execution coalesces whatever is left over.
+LOCAL_SHUFFLE_PARTITIONS = max(8, 2 * (os.cpu_count() or 4))
 
-print("Saving results to SQLite database...")
 
-# Save to SQLite
-conn = sqlite3.connect('airbnb_analysis_results.db')
-pandas_df.to_sql('top_cities_by_property_type', conn, if_exists='replace', index=False)
-conn.close()
+def spark_session(shuffle_partitions=LOCAL_SHUFFLE_PARTITIONS):
+    """
+    Starts (or returns) the Spark session, tuned for local mode.
+    """
+    return SparkSession.builder \
+        .appName("Airbnb Data Analysis") \
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+        .config("spark.sql.shuffle.partitions", str(shuffle_partitions)) \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
+        .config("spark.sql.adaptive.skewJoin.enabled", "true") \
+        .getOrCreate()
 
-print("Analysis complete. Results saved to airbnb_analysis_results.db")
 
-# Stop the Spark session
-spark.stop()
+# Task metrics summed over the stages of an analysis with --profile (Spark UI REST API field names)
+SPARK_STAGE_METRICS = ['numTasks', 'executorRunTime', 'executorCpuTime', 'jvmGcTime', 'inputBytes', 'inputRecords',
+                       'outputRecords', 'shuffleReadBytes', 'shuffleReadRecords', 'shuffleWriteBytes',
+                       'shuffleWriteRecords', 'memoryBytesSpilled', 'diskBytesSpilled']
 
-print("Spark session stopped. Script completed.")
\ No newline at end of file
+
+def spark_stage_metrics(spark, job_group):
+    """
+    Returns the number of jobs and stages run under `job_group` and their summed task metrics (run times in
+    ms, CPU time in ns, sizes in bytes), read from the Spark UI's REST API. Returns None when the UI is disabled.
+    """
+    sc = spark.sparkContext
+    if not sc.uiWebUrl:
+        return None
+    base_url = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}"
+    with urllib.request.urlopen(f"{base_url}/jobs", timeout=10) as response:
+        jobs = [job for job in json.load(response) if job.get('jobGroup') == job_group]
+    metrics = dict({'jobs': len(jobs), 'stages': 0}, **{name: 0 for name in SPARK_STAGE_METRICS})
+    for stage_id in sorted({stage_id for job in jobs for stage_id in job['stageIds']}):
+        try:
+            with urllib.request.urlopen(f"{base_url}/stages/{stage_id}", timeout=10) as response:
+                attempts = json.load(response)
+        except urllib.error.HTTPError:
+            # Stages skipped because their shuffle output was reused are not listed
+            continue
+        for attempt in attempts:
+            if attempt['status'] == 'SKIPPED':
+                continue
+            metrics['stages'] += 1
+            for name in SPARK_STAGE_METRICS:
+                metrics[name] += attempt.get(name, 0)
+    return metrics
+
+
+def run_analysis(df, name, layout, conn):
+    """
+    Runs one registered analysis, shows its result and writes it to SQLite.
+    Returns the table name and the number of rows written.
+    """
+    table_name, analysis = ANALYSES[name]
+    if name == 'top_cities':
+        # The nested 'top_cities' column of the JSON layout is written as a JSON string
+        table_name, _ = top_cities_sql(SparkEngine, layout)
+        result = analysis(df, layout)
+    else:
+        result = analysis(df)
+
+    # Results are small: keep them cached so show() and the export do not recompute them
+    result = result.cache()
+    print(f"Analysis results ({name}):")
+    result.show(truncate=False)
+
+    # Stream the result partitions into SQLite in batched transactions
+    row_count = export_spark_dataframe(result, conn, table_name)
+    create_dashboard_indexes(conn, [table_name])
+    result.unpersist()
+    return table_name, row_count
+
+
+# Running price totals per (city, property_type), maintained by the streaming mode
+STREAM_STATS_TABLE = 'city_property_type_prices'
+
+
+def init_stream_tables(conn):
+    """
+    Creates the streaming results tables on first use. The ranked table has the same columns as the
+    one written by the batch mode, so the dashboard reads either.
+    """
+    with conn:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS "{STREAM_STATS_TABLE}" (
+                city TEXT,
+                property_type TEXT,
+                price_sum REAL,
+                listings INTEGER,
+                avg_price REAL,
+                PRIMARY KEY (city, property_type)
+            )
+        """)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{RANKED_TABLE}" '
+                     f'("property_type" TEXT, "rank" INTEGER, "city" TEXT, "avg_price" REAL)')
+    create_dashboard_indexes(conn, [RANKED_TABLE])
+
+
+def upsert_stream_batch(batch_df, batch_id, output_db):
+    """
+    foreachBatch sink: upserts the (city, property_type) totals changed by one micro-batch, then re-ranks the
+    top 5 cities of the affected property types, in a new snapshot of the database published atomically.
+    The totals are absolute values from the streaming state, so replaying a batch after a failure is harmless.
+    Every micro-batch copies the whole results database (aggregates only, usually well under a few MB). The
+    copy is published before Spark checkpoints the batch, so nothing is lost after a crash; a longer
+    --trigger-seconds publishes less often.
+    """
+    property_types = set()
+
+    def rows():
+        for row in batch_df.toLocalIterator(prefetchPartitions=True):
+            property_types.add(row['property_type'])
+            yield row['city'], row['property_type'], row['price_sum'], row['listings']
+
+    with publishing(output_db, 'spark_analysis.py --stream') as snapshot_path:
+        conn = sqlite3.connect(snapshot_path)
+        configure_sqlite(conn)
+        row_iterator = rows()
+        with conn:
+            for batch in iter(lambda: list(itertools.islice(row_iterator, EXPORT_BATCH_SIZE)), []):
+                conn.executemany(f"""
+                    INSERT INTO "{STREAM_STATS_TABLE}" (city, property_type, price_sum, listings, avg_price)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (city, property_type) DO UPDATE SET
+                        price_sum = excluded.price_sum,
+                        listings = excluded.listings,
+                        avg_price = excluded.avg_price
+                """, [(city, property_type, price_sum, listings, price_sum / listings)
+                      for city, property_type, price_sum, listings in batch])
+
+            if property_types:
+                placeholders = ', '.join('?' * len(property_types))
+                conn.execute(f'DELETE FROM "{RANKED_TABLE}" WHERE property_type IN ({placeholders})',
+                             list(property_types))
+                conn.execute(f"""
+                    INSERT INTO "{RANKED_TABLE}" (property_type, rank, city, avg_price)
+                    SELECT property_type, rank, city, avg_price
+                    FROM (
+                        SELECT property_type, city, avg_price,
+                               DENSE_RANK() OVER (PARTITION BY property_type ORDER BY avg_price DESC) AS rank
+                        FROM "{STREAM_STATS_TABLE}"
+                        WHERE property_type IN ({placeholders})
+                    )
+                    WHERE rank <= 5
+                    ORDER BY property_type, rank, city
+                """, list(property_types))
+        conn.close()
+    print(f"Micro-batch {batch_id}: updated {len(property_types)} property type(s)")
+
+
+def stream_top_cities(spark, landing_dir, checkpoint_dir, output_db, landing_format='json',
+                      trigger_seconds=10, available_now=False, max_files_per_trigger=None):
+    """
+    Keeps the per-city/per-property-type average prices and the top 5 rankings up to date while new
+    listing files are dropped into `landing_dir`. Running sums and counts are kept in Spark's state store,
+    and the checkpoint directory records which files were processed, so a restart picks up where it left off.
+    With `available_now`, every file present is processed and the query stops.
+    """
+    os.makedirs(landing_dir, exist_ok=True)
+    with publishing(output_db, 'spark_analysis.py --stream') as snapshot_path:
+        conn = sqlite3.connect(snapshot_path)
+        configure_sqlite(conn)
+        init_stream_tables(conn)
+        conn.close()
+
+    reader = spark.readStream.schema(LISTING_SCHEMA)
+    if max_files_per_trigger:
+        reader = reader.option("maxFilesPerTrigger", max_files_per_trigger)
+    listings = reader.parquet(landing_dir) if landing_format == 'parquet' else reader.json(landing_dir)
+
+    # Stateful aggregation: only the groups changed by a micro-batch are emitted (update mode)
+    totals = listings.filter(F.col("city.name").isNotNull() & F.col("property_type").isNotNull()
+                             & F.col("price").isNotNull()) \
+                     .groupBy(F.col("city.name").alias("city"), "property_type") \
+                     .agg(F.sum("price").alias("price_sum"), F.count("price").alias("listings"))
+
+    writer = totals.writeStream \
+                   .outputMode("update") \
+                   .option("checkpointLocation", checkpoint_dir) \
+                   .foreachBatch(lambda batch_df, batch_id: upsert_stream_batch(batch_df, batch_id, output_db))
+    if available_now:
+        writer = writer.trigger(availableNow=True)
+    else:
+        writer = writer.trigger(processingTime=f"{trigger_seconds} seconds")
+
+    query = writer.start()
+    print(f"Streaming from {landing_dir} (checkpoints in {checkpoint_dir}); results in {output_db}")
+    query.awaitTermination()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse the fake Airbnb listings with PySpark.")
+    parser.add_argument('--input', default='airbnb_listings.json',
+                        help="JSON array file, NDJSON file or directory, or Parquet file or directory")
+    parser.add_argument('--output-db', default='airbnb_analysis_results.db', help="SQLite database for the results")
+    parser.add_argument('--layout', choices=['normalized', 'json'], default='normalized',
+                        help=f"Write one row per ranked city ({RANKED_TABLE}) "
+                             f"or one JSON list per property type ({JSON_TABLE})")
+    parser.add_argument('--analyses', nargs='+', choices=list(ANALYSES), default=list(ANALYSES),
+                        help="Analyses to run (default: all)")
+    parser.add_argument('--shuffle-partitions', type=int, default=LOCAL_SHUFFLE_PARTITIONS,
+                        help="spark.sql.shuffle.partitions (default: twice the CPU count)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Re-read the input for every analysis instead of caching it (for comparison)")
+    parser.add_argument('--engine', choices=['auto'] + list(ENGINES), default='auto',
+                        help="Engine for the top cities analysis (default: DuckDB below --spark-min-bytes, else Spark)")
+    parser.add_argument('--spark-min-bytes', type=int, default=SPARK_MIN_INPUT_BYTES,
+                        help="Input size from which --engine auto picks Spark")
+    parser.add_argument('--stream', action='store_true',
+                        help="Continuously update the top cities from files dropped into --landing-dir")
+    parser.add_argument('--landing-dir', default='airbnb_landing', help="Directory watched by --stream")
+    parser.add_argument('--landing-format', choices=['json', 'parquet'], default='json',
+                        help="Format of the landing files (JSON array or NDJSON, or Parquet)")
+    parser.add_argument('--checkpoint-dir', default='airbnb_checkpoint',
+                        help="Streaming checkpoint directory (processed files and aggregation state)")
+    parser.add_argument('--trigger-seconds', type=int, default=10, help="Micro-batch interval of --stream")
+    parser.add_argument('--max-files-per-trigger', type=int, default=None,
+                        help="Limit the number of new files per micro-batch")
+    parser.add_argument('--available-now', action='store_true',
+                        help="With --stream: process the files already in the landing directory, then stop")
+    parser.add_argument('--profile', action='store_true',
+                        help="Also store the Spark stage metrics (task time, shuffle, spill) of every analysis")
+    parser.add_argument('--run-log', default=RUN_LOG_DB, help="SQLite database receiving the stage records")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    # Wall time, rows in/out and peak memory (driver and JVM) of every stage are written to the run-log table
+    run_log = RunLog('spark_analysis.py', args.run_log)
+
+    if args.stream:
+        print("Starting Spark session...")
+        with run_log.stage('spark_session'):
+            spark = spark_session(args.shuffle_partitions)
+        with run_log.stage('stream'):
+            stream_top_cities(spark, args.landing_dir, args.checkpoint_dir, args.output_db, args.landing_format,
+                              args.trigger_seconds, args.available_now, args.max_files_per_trigger)
+        spark.stop()
+        run_log.write()
+        print("Spark session stopped. Script completed.")
+        return
+
+    # File path
+    filename = args.input
+
+    print(f"Checking for file: {filename}")
+
+    # Check if file exists
+    if not os.path.exists(filename):
+        print(f"Error: {filename} not found. Please ensure the file is in the same directory as this script.")
+        exit(1)
+
+    # Results are written to a new snapshot of the database, published atomically once every analysis is done
+    with publishing(args.output_db, 'spark_analysis.py') as snapshot_path:
+        conn = sqlite3.connect(snapshot_path)
+        configure_sqlite(conn)
+        timings = {}
+        analyses = list(args.analyses)
+
+        engine_name = args.engine
+        if engine_name == 'auto':
+            engine_name = choose_engine(filename, args.spark_min_bytes)
+            print(f"Input is {input_size(filename) / 1024 ** 2:.1f} MB: "
+                  f"using {engine_name} for the top cities analysis")
+
+        # The top cities analysis runs on DuckDB without starting a JVM
+        if engine_name == 'duckdb' and 'top_cities' in analyses:
+            analyses.remove('top_cities')
+            analysis_start = time.perf_counter()
+            with run_log.stage('top_cities (duckdb)') as stage:
+                engine = ENGINES['duckdb']()
+                engine.load_listings(filename)
+                table_name, row_count = export_top_cities(engine, conn, args.layout)
+                engine.close()
+                stage['rows_out'] = row_count
+            timings['top_cities'] = time.perf_counter() - analysis_start
+            print(f"Wrote {row_count} rows to {table_name} with DuckDB in {timings['top_cities']:.2f}s")
+            print(f"Startup to first result: {time.perf_counter() - start:.2f}s")
+
+        if not analyses:
+            conn.close()
+            run_log.write()
+            print(f"Analysis complete. Results saved to {args.output_db}")
+            return
+
+        print("Starting Spark session...")
+
+        # Create a Spark session
+        with run_log.stage('spark_session'):
+            spark = spark_session(args.shuffle_partitions)
+
+        print(f"Reading {input_format(filename)} input with the declared schema...")
+
+        # Read the listings (price is declared as double, so no cast is needed)
+        df = read_listings(spark, filename)
+
+        # Parse the input once and keep it in memory for all analyses
+        cache_seconds = None
+        listing_count = None
+        if not args.no_cache:
+            cache_start = time.perf_counter()
+            with run_log.stage('read_and_cache') as stage:
+                spark.sparkContext.setJobGroup('read_and_cache', "Read and cache the listings")
+                df = df.cache()
+                listing_count = df.count()
+                stage['rows_out'] = listing_count
+                if args.profile:
+                    stage['details'] = spark_stage_metrics(spark, 'read_and_cache')
+            cache_seconds = time.perf_counter() - cache_start
+            print(f"Cached {listing_count} listings in {cache_seconds:.2f}s")
+
+        print("Performing analysis...")
+
+        for name in analyses:
+            analysis_start = time.perf_counter()
+            with run_log.stage(name, rows_in=listing_count) as stage:
+                # Jobs are grouped per analysis so their stage metrics can be looked up
+                spark.sparkContext.setJobGroup(name, f"Analysis {name}")
+                table_name, row_count = run_analysis(df, name, args.layout, conn)
+                stage['rows_out'] = row_count
+                if args.profile:
+                    stage['details'] = spark_stage_metrics(spark, name)
+            timings[name] = time.perf_counter() - analysis_start
+            print(f"Wrote {row_count} rows to {table_name} in {timings[name]:.2f}s")
+            if len(timings) == 1:
+                print(f"Startup to first result: {time.perf_counter() - start:.2f}s")
+        conn.close()
+
+    print("Analysis timings:")
+    for name, seconds in timings.items():
+        print(f"  {name}: {seconds:.2f}s")
+    if cache_seconds is not None:
+        # Without the cache every analysis pays the read and parse once more
+        saved = cache_seconds * (len(analyses) - 1)
+        print(f"  read + cache (paid once): {cache_seconds:.2f}s, "
+              f"an estimated {saved:.2f}s saved over re-reading it per analysis (compare with --no-cache)")
+    print(f"  total: {time.perf_counter() - start:.2f}s")
+    run_log.print_summary()
+    run_log.write()
+
+    print(f"Analysis complete. Results saved to {args.output_db}")
+
+    # Stop the Spark session
+    spark.stop()
+
+    print("Spark session stopped. Script completed.")
+
+
+if __name__ == "__main__":
+    main()
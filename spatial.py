@@ -0,0 +1,104 @@
+import math
+import time
+
+# Zoom levels of the tile grid (web-mercator/quadkey tiles: zoom z splits the world into 2**z x 2**z tiles).
+# Listings are assigned to tiles at MAX_ZOOM; every coarser zoom merges the tiles below it.
+ZOOM_LEVELS = [2, 4, 6, 8, 10, 12, 14]
+
+# Latitude limit of the web-mercator projection
+MAX_LATITUDE = 85.05112878
+
+# Tables exported to the dashboard database
+SPATIAL_TABLES = ['listing_tiles']
+
+# Step 1: Tile of every listing at the finest zoom
+LISTING_TILE_SQL = """
+    CREATE OR REPLACE TABLE listing_tile AS
+    WITH points AS (
+        SELECT
+            CAST(Latitude AS DOUBLE) AS lat,
+            CAST(Longitude AS DOUBLE) AS lon,
+            radians(LEAST(GREATEST(CAST(Latitude AS DOUBLE), -{max_latitude}), {max_latitude})) AS lat_radians,
+            Price,
+            "Review Scores Rating" AS Rating
+        FROM {source}
+        WHERE Latitude BETWEEN -90 AND 90
+        AND Longitude BETWEEN -180 AND 180
+    )
+    SELECT
+        GREATEST(LEAST(CAST(FLOOR((lon + 180) / 360 * {tiles}) AS BIGINT), {tiles} - 1), 0) AS tile_x,
+        GREATEST(LEAST(CAST(FLOOR((1 - ln(tan(lat_radians) + 1 / cos(lat_radians)) / pi()) / 2 * {tiles})
+                            AS BIGINT), {tiles} - 1), 0) AS tile_y,
+        lat,
+        lon,
+        Price,
+        Rating
+    FROM points
+"""
+
+# Step 2: Per-tile sums at every zoom level (sums and counts merge exactly across zooms)
+LISTING_TILES_SQL = """
+    WITH finest AS (
+        SELECT
+            tile_x,
+            tile_y,
+            COUNT(*) AS listings,
+            SUM(lat) AS lat_sum,
+            SUM(lon) AS lon_sum,
+            SUM(Price) AS price_sum,
+            COUNT(Price) AS priced_listings,
+            SUM(Rating) AS rating_sum,
+            COUNT(Rating) AS rated_listings
+        FROM listing_tile
+        GROUP BY tile_x, tile_y
+    )
+    SELECT
+        z.zoom,
+        f.tile_x >> ({max_zoom} - z.zoom) AS tile_x,
+        f.tile_y >> ({max_zoom} - z.zoom) AS tile_y,
+        SUM(f.listings) AS listings,
+        SUM(f.lat_sum) / SUM(f.listings) AS latitude,
+        SUM(f.lon_sum) / SUM(f.listings) AS longitude,
+        SUM(f.price_sum) / NULLIF(SUM(f.priced_listings), 0) AS average_price,
+        SUM(f.rating_sum) / NULLIF(SUM(f.rated_listings), 0) AS average_rating
+    FROM finest f
+    CROSS JOIN (SELECT UNNEST({zoom_levels}) AS zoom) z
+    GROUP BY ALL
+    ORDER BY zoom, tile_x, tile_y
+"""
+
+
+def tile_xy(latitude, longitude, zoom):
+    """
+    Returns the (tile_x, tile_y) of a point at a zoom level, matching LISTING_TILE_SQL.
+    """
+    tiles = 2 ** zoom
+    lat_radians = math.radians(min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE))
+    tile_x = min(int(math.floor((longitude + 180) / 360 * tiles)), tiles - 1)
+    tile_y = min(int(math.floor((1 - math.log(math.tan(lat_radians) + 1 / math.cos(lat_radians)) / math.pi) / 2
+                                * tiles)), tiles - 1)
+    return max(tile_x, 0), max(tile_y, 0)
+
+
+def spatial_build_sql():
+    """
+    Returns the SQL text of every tile step, used as the result cache key of the tile table.
+    """
+    return '\n'.join([LISTING_TILE_SQL, LISTING_TILES_SQL, f"-- zoom_levels={ZOOM_LEVELS}"])
+
+
+def build_listing_tiles(con, source='airbnb_listings'):
+    """
+    Assigns every listing with a valid Latitude/Longitude to its tile at the finest zoom, then stores the
+    listings, centroid, average price and average rating of every tile at every zoom level as a DuckDB
+    table (result_listing_tiles). A tile is identified by (zoom, tile_x, tile_y), the quadkey tile scheme.
+    """
+    start = time.perf_counter()
+    max_zoom = max(ZOOM_LEVELS)
+    con.execute(LISTING_TILE_SQL.format(source=source, max_latitude=MAX_LATITUDE, tiles=2 ** max_zoom))
+    con.execute("CREATE OR REPLACE TABLE result_listing_tiles AS " +
+                LISTING_TILES_SQL.format(max_zoom=max_zoom, zoom_levels=ZOOM_LEVELS))
+    print(f"Built listing tiles (zoom {', '.join(str(zoom) for zoom in ZOOM_LEVELS)}) "
+          f"in {time.perf_counter() - start:.2f}s")
+    return {table_name: con.execute(f"SELECT COUNT(*) FROM result_{table_name}").fetchone()[0]
+            for table_name in SPATIAL_TABLES}
@@ -0,0 +1,146 @@
+import itertools
+import time
+
+# Rows per Arrow record batch, and per SQLite transaction
+EXPORT_BATCH_SIZE = 100000
+
+# Columns the dashboard filters or sorts on, per result table (a tuple of columns makes a composite index)
+DASHBOARD_INDEXES = {
+    'query_1': ['Average_Price'],
+    'query_2': ['Number_of_Listings'],
+    'query_3': ['Average_Review_Score'],
+    'query_4': ['Total_Reviews'],
+    'query_5': ['Average_Price'],
+    'query_6': ['Price'],
+    'top_cities_by_property_type_ranked': ['property_type'],
+    'price_review_histogram': [('split', 'split_value', 'level')],
+    'listing_tiles': [('zoom', 'tile_x', 'tile_y')],
+    'listing_sketches': [('dimension', 'value')],
+    'search_postings': [('term', 'listing_id')],
+    'search_documents': ['listing_id'],
+    'listing_cube': [('dimension_mask', 'city', 'neighbourhood', 'property_type', 'room_type', 'bedrooms',
+                      'cancellation_policy')],
+}
+
+INTEGER_TYPES = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT', 'UINTEGER',
+                 'UBIGINT', 'BOOLEAN')
+REAL_TYPES = ('FLOAT', 'DOUBLE', 'DECIMAL')
+
+
+def configure_sqlite(sqlite_conn):
+    """
+    Switches the SQLite database to WAL mode so the dashboard can keep reading while results are written.
+    """
+    sqlite_conn.execute("PRAGMA journal_mode=WAL")
+    sqlite_conn.execute("PRAGMA synchronous=NORMAL")
+
+
+def sqlite_column(name, duckdb_type):
+    """
+    Returns the DuckDB expression converting a column to a SQLite-compatible value, and the SQLite column type.
+    """
+    base_type = duckdb_type.split('(')[0]
+    if base_type in INTEGER_TYPES:
+        return f'CAST("{name}" AS BIGINT)', 'INTEGER'
+    if base_type in REAL_TYPES:
+        return f'CAST("{name}" AS DOUBLE)', 'REAL'
+    return f'CAST("{name}" AS VARCHAR)', 'TEXT'
+
+
+def create_table(sqlite_conn, table_name, column_defs):
+    """
+    (Re)creates a SQLite table from a list of (column name, SQLite type).
+    """
+    columns = ', '.join(f'"{name}" {sqlite_type}' for name, sqlite_type in column_defs)
+    with sqlite_conn:
+        sqlite_conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        sqlite_conn.execute(f'CREATE TABLE "{table_name}" ({columns})')
+
+
+def insert_batches(sqlite_conn, table_name, column_count, batches):
+    """
+    Inserts an iterable of row batches, one transaction per batch. Returns the number of rows written.
+    """
+    insert = f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * column_count)})'
+    row_count = 0
+    for rows in batches:
+        with sqlite_conn:
+            row_count += sqlite_conn.executemany(insert, rows).rowcount
+    return row_count
+
+
+def export_table(con, source, sqlite_conn, table_name, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Copies a DuckDB table (or subquery) into a SQLite table without going through pandas.
+    Rows are streamed as Arrow record batches and each batch is inserted in its own transaction.
+    Returns the number of rows written.
+    """
+    columns = con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    converted = [sqlite_column(name, duckdb_type) for name, duckdb_type, *_ in columns]
+    create_table(sqlite_conn, table_name,
+                 [(name, sqlite_type) for (name, *_), (_, sqlite_type) in zip(columns, converted)])
+
+    reader = con.execute(f"SELECT {', '.join(expression for expression, _ in converted)} FROM {source}") \
+                .fetch_record_batch(batch_size)
+    batches = (list(zip(*(column.to_pylist() for column in batch.columns))) for batch in reader)
+    return insert_batches(sqlite_conn, table_name, len(columns), batches)
+
+
+def spark_sqlite_type(data_type):
+    """
+    Returns the SQLite column type of a Spark SQL type name (DataType.simpleString()).
+    """
+    if data_type in ('tinyint', 'smallint', 'int', 'bigint', 'boolean'):
+        return 'INTEGER'
+    if data_type in ('float', 'double') or data_type.startswith('decimal'):
+        return 'REAL'
+    return 'TEXT'
+
+
+def export_spark_dataframe(df, sqlite_conn, table_name, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Streams a Spark DataFrame into a SQLite table. Partitions are pulled to the driver one at a time
+    with toLocalIterator() and inserted in batched transactions, so the full result never has to fit
+    in driver memory. Nested columns are written as JSON strings.
+    Returns the number of rows written.
+    """
+    from pyspark.sql import functions as F
+
+    fields = df.schema.fields
+    nested = ('struct', 'array', 'map')
+    df = df.select([F.to_json(field.name).alias(field.name) if field.dataType.typeName() in nested
+                    else F.col(field.name) for field in fields])
+    create_table(sqlite_conn, table_name, [(field.name, spark_sqlite_type(field.dataType.simpleString()))
+                                           for field in fields])
+
+    rows = (tuple(row) for row in df.toLocalIterator(prefetchPartitions=True))
+    batches = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+    return insert_batches(sqlite_conn, table_name, len(fields), batches)
+
+
+def create_dashboard_indexes(sqlite_conn, table_names):
+    """
+    Creates the indexes backing the dashboard's filter and ORDER BY columns on the given result tables.
+    """
+    with sqlite_conn:
+        for table_name in table_names:
+            for columns in DASHBOARD_INDEXES.get(table_name, []):
+                columns = (columns,) if isinstance(columns, str) else columns
+                index_name = f"idx_{table_name}_{'_'.join(column.lower() for column in columns)}"
+                column_list = ', '.join(f'"{column}"' for column in columns)
+                sqlite_conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_list})')
+
+
+def export_tables(con, sources, sqlite_conn):
+    """
+    Exports every (DuckDB source, SQLite table name) pair and creates the dashboard indexes.
+    Returns a dict of table name -> rows written.
+    """
+    configure_sqlite(sqlite_conn)
+    row_counts = {}
+    for source, table_name in sources:
+        start = time.perf_counter()
+        row_counts[table_name] = export_table(con, source, sqlite_conn, table_name)
+        print(f"Exported {row_counts[table_name]} rows to {table_name} in {time.perf_counter() - start:.2f}s")
+    create_dashboard_indexes(sqlite_conn, [table_name for _, table_name in sources])
+    return row_counts
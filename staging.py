@@ -0,0 +1,233 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+# Column types of the semicolon-delimited Airbnb listings CSV
+CSV_COLUMN_TYPES = {
+    'ID': 'VARCHAR',
+    'Listing Url': 'VARCHAR',
+    'Scrape ID': 'VARCHAR',
+    'Last Scraped': 'DATE',
+    'Name': 'VARCHAR',
+    'Summary': 'VARCHAR',
+    'Space': 'VARCHAR',
+    'Description': 'VARCHAR',
+    'Experiences Offered': 'VARCHAR',
+    'Neighborhood Overview': 'VARCHAR',
+    'Notes': 'VARCHAR',
+    'Transit': 'VARCHAR',
+    'Access': 'VARCHAR',
+    'Interaction': 'VARCHAR',
+    'House Rules': 'VARCHAR',
+    'Thumbnail Url': 'VARCHAR',
+    'Medium Url': 'VARCHAR',
+    'Picture Url': 'VARCHAR',
+    'XL Picture Url': 'VARCHAR',
+    'Host ID': 'VARCHAR',
+    'Host URL': 'VARCHAR',
+    'Host Name': 'VARCHAR',
+    'Host Since': 'DATE',
+    'Host Location': 'VARCHAR',
+    'Host About': 'VARCHAR',
+    'Host Response Time': 'VARCHAR',
+    'Host Response Rate': 'VARCHAR',
+    'Host Acceptance Rate': 'VARCHAR',
+    'Host Thumbnail Url': 'VARCHAR',
+    'Host Picture Url': 'VARCHAR',
+    'Host Neighbourhood': 'VARCHAR',
+    'Host Listings Count': 'INTEGER',
+    'Host Total Listings Count': 'INTEGER',
+    'Host Verifications': 'VARCHAR',
+    'Street': 'VARCHAR',
+    'Neighbourhood': 'VARCHAR',
+    'Neighbourhood Cleansed': 'VARCHAR',
+    'Neighbourhood Group Cleansed': 'VARCHAR',
+    'City': 'VARCHAR',
+    'State': 'VARCHAR',
+    'Zipcode': 'VARCHAR',
+    'Market': 'VARCHAR',
+    'Smart Location': 'VARCHAR',
+    'Country Code': 'VARCHAR',
+    'Country': 'VARCHAR',
+    'Latitude': 'FLOAT',
+    'Longitude': 'FLOAT',
+    'Property Type': 'VARCHAR',
+    'Room Type': 'VARCHAR',
+    'Accommodates': 'INTEGER',
+    'Bathrooms': 'FLOAT',
+    'Bedrooms': 'INTEGER',
+    'Beds': 'INTEGER',
+    'Bed Type': 'VARCHAR',
+    'Amenities': 'VARCHAR',
+    'Square Feet': 'FLOAT',
+    'Price': 'FLOAT',
+    'Weekly Price': 'FLOAT',
+    'Monthly Price': 'FLOAT',
+    'Security Deposit': 'FLOAT',
+    'Cleaning Fee': 'FLOAT',
+    'Guests Included': 'INTEGER',
+    'Extra People': 'FLOAT',
+    'Minimum Nights': 'INTEGER',
+    'Maximum Nights': 'INTEGER',
+    'Calendar Updated': 'VARCHAR',
+    'Has Availability': 'VARCHAR',
+    'Availability 30': 'INTEGER',
+    'Availability 60': 'INTEGER',
+    'Availability 90': 'INTEGER',
+    'Availability 365': 'INTEGER',
+    'Calendar last Scraped': 'VARCHAR',
+    'Number of Reviews': 'INTEGER',
+    'First Review': 'DATE',
+    'Last Review': 'DATE',
+    'Review Scores Rating': 'FLOAT',
+    'Review Scores Accuracy': 'FLOAT',
+    'Review Scores Cleanliness': 'FLOAT',
+    'Review Scores Checkin': 'FLOAT',
+    'Review Scores Communication': 'FLOAT',
+    'Review Scores Location': 'FLOAT',
+    'Review Scores Value': 'FLOAT',
+    'License': 'VARCHAR',
+    'Jurisdiction Names': 'VARCHAR',
+    'Cancellation Policy': 'VARCHAR',
+    'Calculated host listings count': 'INTEGER',
+    'Reviews per Month': 'FLOAT',
+    'Geolocation': 'VARCHAR',
+    'Features': 'VARCHAR'
+}
+
+# Columns the staged Parquet files are partitioned by
+PARTITION_COLUMNS = ['Country', 'City']
+
+# Hive partition values are not round-tripped exactly (a value spelled 'NULL' reads back as SQL NULL), so the
+# directories are named after prefixed copies of the columns (country_key=p_France/...) and the columns
+# themselves stay in the Parquet files. A missing value goes to the __HIVE_DEFAULT_PARTITION__ directory.
+PARTITION_KEY_PREFIX = 'p_'
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def csv_source_sql():
+    """
+    Returns the read_csv_auto() expression for the listings CSV with the declared column types.
+    The CSV path is passed as the first query parameter.
+    """
+    types = ', '.join(f"'{name}': '{col_type}'" for name, col_type in CSV_COLUMN_TYPES.items())
+    return f"read_csv_auto(?, types={{{types}}})"
+
+
+def referenced_columns(sql_texts):
+    """
+    Returns the CSV columns named anywhere in the given SQL texts, in CSV order. Loading only these columns
+    keeps the wide free-text columns (Description, House Rules, ...) out of memory when no query reads them.
+    """
+    text = '\n'.join(sql_texts)
+    return [name for name in CSV_COLUMN_TYPES if re.search(rf'(?<!\w){re.escape(name)}(?!\w)', text)]
+
+
+def csv_fingerprint(csv_file_name):
+    """
+    Returns a fingerprint of the CSV file contents (SHA-256 plus file size).
+    The hash is computed once per process for an unchanged file.
+    """
+    stat = os.stat(csv_file_name)
+    return _content_fingerprint(os.path.abspath(csv_file_name), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def _content_fingerprint(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"{size}-{digest.hexdigest()}"
+
+
+def read_manifest(staging_dir):
+    """
+    Returns the manifest of the staging directory, or None if nothing has been staged yet (or the listings
+    were staged with a different directory layout).
+    """
+    manifest_path = os.path.join(staging_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest['partition_by'] != [partition_key(column) for column in PARTITION_COLUMNS]:
+        return None
+    return manifest
+
+
+def partition_key(column):
+    """
+    Returns the name of the directory key column of a partition column ('Country' -> country_key).
+    """
+    return f"{column.lower()}_key"
+
+
+def staged_parquet_glob(staging_dir):
+    """
+    Returns the glob matching every staged Parquet file.
+    """
+    return os.path.join(staging_dir, 'listings', '**', '*.parquet')
+
+
+def stage_listings(con, csv_file_name, staging_dir):
+    """
+    Converts the listings CSV into Parquet files partitioned by Country/City.
+    The conversion is skipped while the CSV fingerprint matches the one recorded in the manifest.
+    Returns True if the CSV was (re)staged.
+    """
+    fingerprint = csv_fingerprint(csv_file_name)
+    partition_keys = [partition_key(column) for column in PARTITION_COLUMNS]
+    manifest = read_manifest(staging_dir)
+    if manifest is not None and manifest['fingerprint'] == fingerprint:
+        print(f"Reusing staged listings in {staging_dir} (CSV unchanged)")
+        return False
+
+    print(f"Staging {csv_file_name} into {staging_dir}...")
+    start = time.perf_counter()
+
+    # Write into a temporary directory first so a failed run never leaves a half-written store
+    os.makedirs(staging_dir, exist_ok=True)
+    listings_dir = os.path.join(staging_dir, 'listings')
+    tmp_dir = listings_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    keys = ', '.join(f"'{PARTITION_KEY_PREFIX}' || \"{column}\" AS {partition_key(column)}"
+                     for column in PARTITION_COLUMNS)
+    con.execute(f"""
+        COPY (SELECT *, {keys} FROM {csv_source_sql()})
+        TO '{tmp_dir}' (FORMAT PARQUET, PARTITION_BY ({', '.join(partition_keys)}))
+    """, [csv_file_name])
+    shutil.rmtree(listings_dir, ignore_errors=True)
+    os.rename(tmp_dir, listings_dir)
+
+    manifest = {
+        'source': os.path.abspath(csv_file_name),
+        'fingerprint': fingerprint,
+        'partition_by': partition_keys,
+        'staged_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with open(os.path.join(staging_dir, MANIFEST_FILE_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Staged listings in {time.perf_counter() - start:.2f}s")
+    return True
+
+
+def create_listings_view(con, staging_dir, view_name='airbnb_listings'):
+    """
+    Creates a view over the staged Parquet files. DuckDB only reads the Parquet columns a query references.
+    The directory key columns are left out; every file holds a single Country and City, so filters on them
+    skip the other files from their Parquet statistics.
+    """
+    keys = [partition_key(column) for column in PARTITION_COLUMNS]
+    hive_types = ', '.join(f"'{key}': 'VARCHAR'" for key in keys)
+    con.execute(f"""
+        CREATE OR REPLACE VIEW {view_name} AS
+        SELECT * EXCLUDE ({', '.join(keys)}) FROM read_parquet('{staged_parquet_glob(staging_dir)}',
+            hive_partitioning=true, hive_types={{{hive_types}}})
+    """)
@@ -0,0 +1,166 @@
+import math
+import re
+import time
+
+# Listing text columns indexed for full-text search
+SEARCH_TEXT_COLUMNS = ['Name', 'Summary', 'Description', 'Neighborhood Overview', 'Transit']
+
+# Tokens are runs of letters and digits, lower-cased; shorter tokens and stopwords are not indexed
+MIN_TOKEN_LENGTH = 2
+SEARCH_STOPWORDS = ['an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'in', 'is', 'it',
+                    'its', 'of', 'on', 'or', 'our', 'so', 'that', 'the', 'this', 'to', 'was', 'we', 'will', 'with',
+                    'you', 'your']
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Tables exported to the dashboard database
+SEARCH_TABLES = ['search_documents', 'search_postings', 'search_stats']
+
+# Step 1: One row per indexed token occurrence
+SEARCH_TOKENS_SQL = """
+    CREATE OR REPLACE TEMP TABLE search_tokens AS
+    SELECT listing_id, term
+    FROM (
+        SELECT
+            ID AS listing_id,
+            unnest(regexp_extract_all(lower(concat_ws(' ', {text_columns})), '[\\p{{L}}\\p{{N}}]+')) AS term
+        FROM {source}
+        WHERE ID IS NOT NULL
+    )
+    WHERE length(term) >= {min_length}
+    AND term NOT IN ({stopwords})
+"""
+
+# Step 2: Searchable listings with their facets and length in tokens
+SEARCH_DOCUMENTS_SQL = """
+    SELECT
+        l.ID AS listing_id,
+        l.Name AS name,
+        l.City AS city,
+        l."Property Type" AS property_type,
+        l.Price AS price,
+        l."Review Scores Rating" AS rating,
+        t.length
+    FROM {source} l
+    JOIN (SELECT listing_id, COUNT(*) AS length FROM search_tokens GROUP BY listing_id) t
+        ON t.listing_id = l.ID
+"""
+
+# Step 3: Postings (term frequency per term and listing)
+SEARCH_POSTINGS_SQL = """
+    SELECT term, listing_id, COUNT(*) AS frequency
+    FROM search_tokens
+    GROUP BY term, listing_id
+    ORDER BY term, listing_id
+"""
+
+# Step 4: Collection statistics used by the BM25 weights
+SEARCH_STATS_SQL = """
+    SELECT
+        COUNT(*) AS documents,
+        AVG(length) AS average_length,
+        MIN(price) AS min_price,
+        MAX(price) AS max_price
+    FROM {documents}
+"""
+
+
+def tokenize(text):
+    """
+    Splits a search query into index terms, the same way SEARCH_TOKENS_SQL tokenizes the listings.
+    """
+    return [term for term in re.findall(r'[^\W_]+', (text or '').lower())
+            if len(term) >= MIN_TOKEN_LENGTH and term not in SEARCH_STOPWORDS]
+
+
+def bm25_idf(documents, term_documents):
+    """
+    Returns the BM25 inverse document frequency of a term found in `term_documents` of `documents` listings.
+    """
+    return math.log((documents - term_documents + 0.5) / (term_documents + 0.5) + 1)
+
+
+def search_tokens_sql(source):
+    """
+    Returns the statement tokenizing the text columns of `source` into the search_tokens table.
+    """
+    return SEARCH_TOKENS_SQL.format(
+        source=source,
+        text_columns=', '.join(f'"{column}"' for column in SEARCH_TEXT_COLUMNS),
+        min_length=MIN_TOKEN_LENGTH,
+        stopwords=', '.join(f"'{word}'" for word in SEARCH_STOPWORDS))
+
+
+def search_build_sql():
+    """
+    Returns the SQL text of every indexing step, used as the result cache key of the search tables.
+    """
+    return '\n'.join([search_tokens_sql('airbnb_listings'), SEARCH_DOCUMENTS_SQL, SEARCH_POSTINGS_SQL,
+                      SEARCH_STATS_SQL])
+
+
+def build_search_index(con, source='airbnb_listings'):
+    """
+    Tokenizes the listing text columns and stores the inverted index as DuckDB tables: the postings
+    (result_search_postings), the searchable listings with their facets and lengths (result_search_documents)
+    and the collection statistics (result_search_stats).
+    """
+    start = time.perf_counter()
+    con.execute(search_tokens_sql(source))
+    con.execute("CREATE OR REPLACE TABLE result_search_documents AS " + SEARCH_DOCUMENTS_SQL.format(source=source))
+    con.execute("CREATE OR REPLACE TABLE result_search_postings AS " + SEARCH_POSTINGS_SQL)
+    con.execute("CREATE OR REPLACE TABLE result_search_stats AS " +
+                SEARCH_STATS_SQL.format(documents='result_search_documents'))
+    con.execute("DROP TABLE search_tokens")
+    print(f"Built full-text index over {', '.join(SEARCH_TEXT_COLUMNS)} in {time.perf_counter() - start:.2f}s")
+    return {table_name: con.execute(f"SELECT COUNT(*) FROM result_{table_name}").fetchone()[0]
+            for table_name in SEARCH_TABLES}
+
+
+def init_search_state(con, listings='listing_state'):
+    """
+    Creates the persistent postings and documents tables on first use (incremental mode), seeded from the
+    stored `listings`. Listings stored without their text columns are indexed once they are ingested again.
+    """
+    exists = con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'search_documents_state'"
+                         ).fetchall()[0][0]
+    if exists:
+        return
+    con.execute("""
+        CREATE TABLE search_documents_state (
+            listing_id VARCHAR, name VARCHAR, city VARCHAR, property_type VARCHAR, price FLOAT, rating FLOAT,
+            length BIGINT
+        )
+    """)
+    con.execute("CREATE TABLE search_postings_state (term VARCHAR, listing_id VARCHAR, frequency BIGINT)")
+    con.execute(search_tokens_sql(listings))
+    con.execute("INSERT INTO search_documents_state BY NAME " + SEARCH_DOCUMENTS_SQL.format(source=listings))
+    con.execute("INSERT INTO search_postings_state BY NAME " + SEARCH_POSTINGS_SQL)
+    con.execute("DROP TABLE search_tokens")
+
+
+def update_search_state(con, incoming, retracted):
+    """
+    Drops the postings and documents of the `retracted` and `incoming` listings from the persistent index,
+    then indexes the `incoming` listings. Only the changed listings are tokenized.
+    """
+    for table in ('search_postings_state', 'search_documents_state'):
+        con.execute(f"""
+            DELETE FROM {table}
+            WHERE listing_id IN (SELECT ID FROM {retracted} UNION SELECT ID FROM {incoming})
+        """)
+    con.execute(search_tokens_sql(incoming))
+    con.execute("INSERT INTO search_documents_state BY NAME " + SEARCH_DOCUMENTS_SQL.format(source=incoming))
+    con.execute("INSERT INTO search_postings_state BY NAME " + SEARCH_POSTINGS_SQL)
+    con.execute("DROP TABLE search_tokens")
+
+
+def search_state_sources():
+    """
+    Returns the (DuckDB source, SQLite table name) pairs exporting the incremental index.
+    """
+    return [('search_documents_state', 'search_documents'),
+            ('(SELECT * FROM search_postings_state ORDER BY term, listing_id)', 'search_postings'),
+            (f"({SEARCH_STATS_SQL.format(documents='search_documents_state')})", 'search_stats')]